@@ -0,0 +1,388 @@
+"""
+benchmarks/bench_engine.py
+--------------------------
+benchmark של ה-engine v2 על נתונים סינתטיים — בלי API של דוד ובלי Gmail.
+
+מייצר רשומות GetFeedbackData סינתטיות (מספר מעסיקים / קופות / קודי שגיאה / counters /
+שיעור מקרי קרן ברירת מחדל — ניתנים להגדרה) וקובץ mapping סינתטי באותו מבנה של
+error_code_mapping_v2.xlsx, ומודד כל שלב לכל גודל:
+
+  mapping          load_mapping (מה-bytes של ה-workbook)
+  classify         classify_all (engine=rows)
+  classify_columnar classify_all (engine=columnar) — רק עם --engines rows,columnar
+  routing_separate apply_employer_max_counter_routing + apply_cross_error_inheritance
+  routing_fused    apply_post_routing
+  group            group_records
+  build            build_all_emails (קבצים מצורפים נשארים lazy)
+  attachments      בניית כל הקבצים המצורפים (מה ש-gmail_sender עושה בזמן הרכבת ה-MIME)
+  payload          build_payload (send_results במצב stub)
+  report           build_run_report
+  cm_reports       build_case_manager_reports
+
+לכל שלב: seconds, cpu_seconds, rss_peak_delta_mb, records_in / records_out (StageRecorder).
+בדיקות תקינות: routing_separate == routing_fused, ו-rows == columnar כשמורצים שניהם.
+
+שימוש:
+  python benchmarks/bench_engine.py --sizes 1000,10000,100000 --output bench.json
+  python benchmarks/bench_engine.py --sizes 10000 --mapping error_code_mapping_v2.xlsx --skip report,cm_reports
+  python benchmarks/bench_engine.py --sizes 100000 --engines rows,columnar --skip build,attachments,report,cm_reports
+פלט: JSON (stdout, ו---output אם ניתן) — להשוואה בין גרסאות.
+"""
+
+import io
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import subprocess
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mapping_loader import (  # noqa: E402
+    load_mapping, DEFAULT_FUND_MAP,
+    SHEET_ERRORS, SHEET_ESCALATION, SHEET_STATUSES, SHEET_TEMPLATES,
+    FORMAT_MOSADI_1, FORMAT_MOSADI_2, FORMAT_EMPLOYER, FORMAT_CASE_MGR, FORMAT_EXCLUDED,
+)
+from record_classifier import (  # noqa: E402
+    classify_all, apply_post_routing, apply_employer_max_counter_routing, apply_cross_error_inheritance,
+)
+from record_grouper import group_records            # noqa: E402
+from email_builder import build_all_emails          # noqa: E402
+from gmail_sender import send_all_groups            # noqa: E402
+from payload_builder import build_payload           # noqa: E402
+from report_builder import build_run_report, build_case_manager_reports  # noqa: E402
+from instrumentation import StageRecorder           # noqa: E402
+
+STAGES = ("mapping", "classify", "classify_columnar", "routing_separate", "routing_fused",
+          "group", "build", "attachments", "payload", "report", "cm_reports")
+
+FUND_NAMES = ["הראל", "מגדל", "כלל", "הפניקס", "מנורה", "אלטשולר שחם", "מור", "אינפיניטי", "אייל", "מיטב"]
+FUND_TYPES = ["קרן פנסיה", "קופת גמל", "ביטוח מנהלים", "קרן השתלמות"]
+FIRST      = ["דנה", "יוסי", "מיכל", "אבי", "נועה", "רון", "שירה", "עומר", "תמר", "איתי"]
+LAST       = ["כהן", "לוי", "מזרחי", "פרץ", "ביטון", "אברהם", "פרידמן", "שפירא"]
+
+# (פורמט, אחריות, משקל) — התפלגות הקודים בקובץ המיפוי הסינתטי
+_CODE_PROFILES = [
+    (FORMAT_MOSADI_1, "מוסדי",     0.25),
+    (FORMAT_MOSADI_2, "מוסדי",     0.05),
+    (FORMAT_EMPLOYER, "מעסיק",     0.30),
+    (FORMAT_CASE_MGR, "מנהלת תיק", 0.30),
+    (FORMAT_EXCLUDED, "מנהלת תיק", 0.10),
+]
+
+_OVERRIDES = [
+    (None, None, None, None),
+    ("סוכן", "מנהלת תיק", "איש קשר 1 מעסיק", "מנהלת תיק+ איש קשר 2 מעסיק"),
+    ('רו"ח', "מנהלת תיק + איש קשר 1 + איש קשר 2 מעסיק", "איש קשר 1 מעסיק", None),
+    ("איש קשר 1 מעסיק", "מנהלת תיק + איש קשר 2 מעסיק", None, None),
+]
+
+
+# =============================================================================
+# נתונים סינתטיים
+# =============================================================================
+
+def synthetic_mapping(n_codes=60, seed=7):
+    """bytes של workbook מיפוי סינתטי (4 הגיליונות של error_code_mapping_v2.xlsx)."""
+    rnd = random.Random(seed)
+    weights = [w for _, _, w in _CODE_PROFILES]
+    rows = []
+    for code in range(3, 3 + n_codes):
+        fmt, resp, _ = rnd.choices(_CODE_PROFILES, weights)[0]
+        o1, cc1, o2, cc2 = rnd.choice(_OVERRIDES) if fmt != FORMAT_EXCLUDED else _OVERRIDES[0]
+        pre = fmt == FORMAT_MOSADI_1 and rnd.random() < 0.8
+        rows.append({
+            "קוד שגיאה":              code,
+            "תיאור שגיאה":            f"שגיאה סינתטית {code}",
+            "מוחרג":                  "כן" if fmt == FORMAT_EXCLUDED else "לא",
+            "פורמט מייל":             fmt,
+            "אחריות ברירת מחדל":      resp,
+            "CC ברירת מחדל":          "מנהלת תיק" if rnd.random() < 0.5 else None,
+            "OverrideMailRecipients":  o1,
+            "CC Override 1":           cc1,
+            "OverrideMailRecipients 2": o2,
+            "CC Override 2":           cc2,
+            "נושא מייל":              "ח.פ מעסיק+ שם המעסיק",
+            "הסבר למעסיק":            f"הסבר למעסיק עבור קוד {code}. האם ידוע ובטיפול?",
+            "הסבר מנהלת תיק":         None,
+            "PreMailConditionField":   "LastPositive_CHODESH_MASKORET" if pre else None,
+            "PreMailCondition":        "יש לבדוק בהיזון החוזר אם לעובד יש קליטה קודמת." if pre else None,
+        })
+
+    escalation = [
+        {"Counter": c, "פעולה": action, "נמען": to}
+        for c, action, to in [(0, "ללא פעולה", "—"), (1, "מייל ראשון", "לפי אחריות"), (2, "תזכורת", "לפי אחריות"),
+                              (3, "הסלמה פנימית", "מנהלת תיק"), (4, "הסלמה מנהלת ראשית", "מנהלת תיק"),
+                              ("5+", "הסלמה הנהלה בכירה", "מנהלת תיק")]
+    ]
+    statuses = [
+        {"סטטוס רשומה": "רשומה הועברה לטיפול מעסיק", "לעיבוד?": "כן"},
+        {"סטטוס רשומה": "רשומה לא נקלטה על ידי יצרן - נדחה על ידי יצרן", "לעיבוד?": "כן"},
+        {"סטטוס רשומה": "כל שאר הסטטוסים", "לעיבוד?": "לא"},
+    ]
+    templates = [
+        {"סוג נמען": "מוסדי", "פורמט": FORMAT_MOSADI_1, "נושא": "ח.פ מעסיק + שם המעסיק",
+         "גוף מייל": "שלום, התקבל היזון חוזר מ(שם קופה) עבור המעסיק CustomerNumber.", "קבצים מצורפים": "אין"},
+        {"סוג נמען": "מוסדי", "פורמט": FORMAT_MOSADI_2, "נושא": "ח.פ מעסיק + שם המעסיק",
+         "גוף מייל": "שלום, אין קרן פנסיה לעובד תחת המעסיק.", "קבצים מצורפים": "אין"},
+        {"סוג נמען": 'מעסיק / רו"ח / סוכן', "פורמט": FORMAT_EMPLOYER, "נושא": "ח.פ [מספר מעסיק] [שם מעסיק]",
+         "גוף מייל": "שלום, מצורפים למייל זה תשובות הקופות. האם ידוע ובטיפול?", "קבצים מצורפים": "קובץ Excel"},
+        {"סוג נמען": "מנהלת תיק", "פורמט": FORMAT_CASE_MGR, "נושא": "דו\"ח היזון חוזר",
+         "גוף מייל": "דו\"ח למנהלת תיק", "קבצים מצורפים": "Excel"},
+    ]
+
+    out = io.BytesIO()
+    with pd.ExcelWriter(out, engine="openpyxl") as writer:
+        pd.DataFrame(rows).to_excel(writer, sheet_name=SHEET_ERRORS, index=False)
+        pd.DataFrame(escalation).to_excel(writer, sheet_name=SHEET_ESCALATION, index=False)
+        pd.DataFrame(statuses).to_excel(writer, sheet_name=SHEET_STATUSES, index=False)
+        pd.DataFrame(templates).to_excel(writer, sheet_name=SHEET_TEMPLATES, index=False)
+    return out.getvalue()
+
+
+def synthetic_records(n, codes, employers=None, employees_per_employer=40, funds=8, managers=6,
+                      max_counter=5, default_fund_rate=0.1, seed=1):
+    """
+    n רשומות GetFeedbackData סינתטיות.
+    codes : קודי השגיאה (בד"כ המפתחות של mapping["error_codes"]); 3% קודים לא ממופים / חסרים.
+    employers : ברירת מחדל n // 50 (לפחות 5). לכל עובד כמה רשומות (קודים / קופות שונים) —
+    כדי שה-routing (max counter / inheritance) יעבוד על קבוצות אמיתיות.
+    """
+    rnd       = random.Random(seed)
+    employers = employers or max(5, n // 50)
+    codes     = list(codes)
+    mgrs      = [f"manager{m}@hasheket.example" for m in range(managers)]
+    fund_pool = [(f"51{rnd.randint(1000000, 9999999)}", str(rnd.randint(100, 20000)), FUND_NAMES[i % len(FUND_NAMES)])
+                 for i in range(funds)]
+
+    emp_rows = []
+    for e in range(employers):
+        customer = str(500000000 + e)
+        emp_rows.append({
+            "customer":   customer,
+            "name":       f"מעסיק סינתטי {e}",
+            "manager":    mgrs[e % len(mgrs)],
+            "employees":  [str(rnd.randint(10000000, 399999999)) for _ in range(employees_per_employer)],
+            "agent":      f"agent{e}@example.co.il" if rnd.random() < 0.4 else None,
+            "accountant": f"cpa{e}@example.co.il" if rnd.random() < 0.4 else None,
+            "contact1":   f"hr{e}@example.co.il" if rnd.random() < 0.8 else None,
+            "contact2":   f"pay{e}@example.co.il" if rnd.random() < 0.3 else None,
+        })
+
+    counters = list(range(max_counter + 1))
+    counter_w = [0.15] + [0.85 / max_counter * (0.6 ** i) for i in range(max_counter)]
+    records = []
+    for i in range(n):
+        emp  = emp_rows[rnd.randrange(employers)]
+        oved = rnd.choice(emp["employees"])
+        r    = rnd.random()
+        code = rnd.choice(codes) if r > 0.03 else (None if r < 0.01 else 9999)
+
+        if rnd.random() < default_fund_rate:
+            dfm = DEFAULT_FUND_MAP[int(oved[-1])]
+            fund_id, tax, fund_name, fund_type = dfm["fund_id"], dfm["income_tax_auth"], "קרן ברירת מחדל", "קרן פנסיה"
+        else:
+            fund_id, tax, fund_name = rnd.choice(fund_pool)
+            fund_type = rnd.choice(FUND_TYPES)
+
+        records.append({
+            "MISPAR_MEZAHE_RESHUMA":               f"R{seed}{i:08d}",
+            "CustomerNumber":                      emp["customer"],
+            "CustomerName":                        emp["name"],
+            "EmployerName":                        emp["name"],
+            "ErrorCodeV4Id":                       code,
+            "OnlyOnStatusChange_DatesDiffInWeeks": rnd.choices(counters, counter_w)[0],
+            "FeedbackStatus":                      6 if rnd.random() < 0.02 else rnd.choice([1, 2, 3]),
+            "StatusDescription":                   "רשומה מבוטלת" if rnd.random() < 0.02 else "",
+            "LastPositive_CHODESH_MASKORET":       rnd.choice([None, "202401", "202406", "202312", "202209"]),
+            "CHODESH_MASKORET":                    rnd.choice(["202405", "202406", "202407"]),
+            "FundInstitutionName":                 fund_name,
+            "FundInstitutionIdentityNumber":       fund_id,
+            "FundInstitutionTaxNumber":            tax,
+            "FundInstitutionType":                 fund_type,
+            "MISPAR_MEZAHE_OVED":                  oved,
+            "EmployeeFirstName":                   rnd.choice(FIRST),
+            "EmployeeLastName":                    rnd.choice(LAST),
+            "AgentEmail":                          emp["agent"],
+            "AccountantEmail":                     emp["accountant"],
+            "Contact1Email":                       emp["contact1"],
+            "Contact2Email":                       emp["contact2"],
+            "CustomerContactEmail":                f"office{emp['customer'][-3:]}@example.co.il",
+            "CustomerAccountManagerEmail":         emp["manager"],
+            "CustomerAccountManagerName":          f"מנהלת {emp['manager'][7]}",
+            "OriginalFileName":                    f"feedback_{rnd.randint(1, 30)}.xml",
+            "TikMislaka":                          f"T{rnd.randint(1, 9)}",
+        })
+    return records
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def _strip_raw(results):
+    return [{k: v for k, v in r.items() if k != "_raw"} for r in results]
+
+
+def run_size(n, mapping_bytes, engines, skip, data_args):
+    """מריץ את כל השלבים על n רשומות. מחזיר dict עם stages / counts / checks."""
+    rec    = StageRecorder()
+    checks = {}
+
+    rec.stage("mapping")
+    mapping = load_mapping(mapping_bytes)
+    rec.records(out=len(mapping["error_codes"]))
+    rec.finish()
+
+    records = synthetic_records(n, mapping["error_codes"].keys(), **data_args)
+
+    rec.stage("classify", records_in=n)
+    classified, skipped = classify_all(records, mapping, engine="rows")
+    rec.records(out=len(classified))
+
+    if "columnar" in engines and "classify_columnar" not in skip:
+        rec.stage("classify_columnar", records_in=n)
+        col_classified, col_skipped = classify_all(records, mapping, engine="columnar")
+        rec.records(out=len(col_classified))
+        rec.finish()
+        checks["engines_equal"] = col_classified == classified and col_skipped == skipped
+        del col_classified, col_skipped
+
+    separate = [dict(r) for r in classified]
+    if "routing_separate" not in skip:
+        rec.stage("routing_separate", records_in=len(separate))
+        separate = apply_cross_error_inheritance(apply_employer_max_counter_routing(separate))
+        rec.records(out=len(separate))
+        rec.finish()
+
+    rec.stage("routing_fused", records_in=len(classified))
+    classified = apply_post_routing(classified)
+    rec.records(out=len(classified))
+    rec.finish()
+    if "routing_separate" not in skip:
+        checks["routing_equal"] = _strip_raw(separate) == _strip_raw(classified)
+    del separate
+
+    rec.stage("group", records_in=len(classified))
+    groups = group_records(classified)
+    rec.records(out=len(groups))
+
+    rec.stage("build", records_in=len(groups))
+    email_results, build_skipped = build_all_emails(groups, mapping)
+    rec.records(out=len(email_results) - build_skipped)
+    rec.finish()
+
+    if "attachments" not in skip:
+        atts = [att for _, content in email_results if content for att in content.get("attachments", [])]
+        rec.stage("attachments", records_in=len(atts))
+        for att in atts:
+            if callable(att["data"]):
+                att["data"]()
+        rec.records(out=len(atts))
+        rec.finish()
+        del atts
+
+    send_results, _ = send_all_groups(email_results, None, "")   # stub — ללא Gmail
+    del email_results
+
+    rec.stage("payload", records_in=len(send_results))
+    payload = build_payload(send_results, classified, skipped_records=skipped)
+    rec.records(out=payload["total"])
+    rec.finish()
+
+    if "report" not in skip:
+        rec.stage("report", records_in=len(records))
+        build_run_report(groups, send_results, skipped_records=skipped, raw_records=records)
+        rec.finish()
+
+    if "cm_reports" not in skip:
+        rec.stage("cm_reports", records_in=len(groups))
+        cm_reports = build_case_manager_reports(groups, send_results, skipped_records=skipped)
+        rec.records(out=len(cm_reports))
+    rec.finish()
+
+    stages = [s for s in rec.stages() if s["stage"] not in skip]
+    return {
+        "records": n,
+        "counts": {
+            "classified": len(classified),
+            "skipped":    len(skipped),
+            "groups":     len(groups),
+            "emails":     len(send_results),
+            "payload":    payload["total"],
+        },
+        "stages":        stages,
+        "total_seconds": round(sum(s["seconds"] for s in stages), 3),
+        "checks":        checks,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="מספרי רשומות, מופרדים בפסיק")
+    parser.add_argument("--mapping", help="workbook מיפוי אמיתי במקום הסינתטי")
+    parser.add_argument("--codes", type=int, default=60, help="קודי שגיאה במיפוי הסינתטי")
+    parser.add_argument("--employers", type=int, default=0, help="0 = רשומות/50")
+    parser.add_argument("--employees-per-employer", type=int, default=40)
+    parser.add_argument("--funds", type=int, default=8)
+    parser.add_argument("--managers", type=int, default=6)
+    parser.add_argument("--max-counter", type=int, default=5)
+    parser.add_argument("--default-fund-rate", type=float, default=0.1)
+    parser.add_argument("--engines", default="rows", help='"rows" או "rows,columnar" (כולל בדיקת שקילות)')
+    parser.add_argument("--skip", default="", help=f"שלבים לדילוג: {','.join(STAGES)}")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="קובץ JSON לפלט")
+    args = parser.parse_args(argv)
+
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    unknown = skip - set(STAGES)
+    if unknown:
+        parser.error(f"שלבים לא מוכרים: {', '.join(sorted(unknown))}")
+
+    if args.mapping:
+        with open(args.mapping, "rb") as f:
+            mapping_bytes = f.read()
+    else:
+        mapping_bytes = synthetic_mapping(args.codes, seed=args.seed)
+
+    data_args = {
+        "employers":              args.employers or None,
+        "employees_per_employer": args.employees_per_employer,
+        "funds":                  args.funds,
+        "managers":               args.managers,
+        "max_counter":            args.max_counter,
+        "default_fund_rate":      args.default_fund_rate,
+        "seed":                   args.seed,
+    }
+    engines = {e.strip() for e in args.engines.split(",") if e.strip()}
+
+    result = {
+        "revision": _git_revision(),
+        "python":   platform.python_version(),
+        "cpus":     os.cpu_count(),
+        "mapping":  args.mapping or f"synthetic ({args.codes} codes)",
+        "data":     data_args,
+        "runs":     [run_size(int(n), mapping_bytes, engines, skip, data_args) for n in args.sizes.split(",")],
+    }
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    return result
+
+
+if __name__ == "__main__":
+    main()
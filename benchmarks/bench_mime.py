@@ -0,0 +1,133 @@
+"""
+benchmarks/bench_mime.py
+------------------------
+מדידת זיכרון וזמן לבניית MIME של draft — _build_mime הנוכחי מול המימוש הקודם
+(MIMEBase + encoders.encode_base64 + as_bytes + urlsafe_b64encode).
+
+לכל draft נמדד שיא ההקצאות (tracemalloc) מעל הבסיס, וממוצע על כל ה-drafts.
+--distinct קובע כמה קבצים מצורפים שונים יש (ברירת מחדל: קובץ שונה לכל draft, כמו בריצה אמיתית —
+הקובץ למעסיק נבנה מהרשומות של הקבוצה שלו). עם --distinct קטן מ---drafts קבצים זהים חוזרים
+בין drafts; _build_mime מקודד כל קובץ מחדש (אין cache לפי תוכן), והשדה "repeated_attachments"
+בפלט מראה כמה קידודים כאלה היו.
+
+שימוש:
+  python benchmarks/bench_mime.py --drafts 200 --attachment-kb 200
+  python benchmarks/bench_mime.py --drafts 200 --attachment-kb 200 --distinct 50
+פלט: JSON
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import tracemalloc
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.mime.base import MIMEBase
+from email import encoders
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmail_sender import _build_mime  # noqa: E402
+
+_MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _legacy_build_mime(email_content):
+    """_build_mime הקודם — לצורך השוואה."""
+    msg = MIMEMultipart()
+    msg["to"]      = email_content.get("to_email", "")
+    msg["subject"] = email_content.get("subject", "")
+
+    cc = email_content.get("cc_email")
+    if cc:
+        msg["cc"] = cc
+
+    msg.attach(MIMEText(email_content.get("body_html", ""), "html", "utf-8"))
+
+    for att in email_content.get("attachments", []):
+        part = MIMEBase(*att["mimetype"].split("/", 1))
+        part.set_payload(att["data"])
+        encoders.encode_base64(part)
+        part.add_header(
+            "Content-Disposition",
+            "attachment",
+            filename=att["filename"],
+        )
+        msg.attach(part)
+
+    return base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
+
+
+def _contents(drafts, attachment_kb, distinct=None, seed=1):
+    rnd   = random.Random(seed)
+    files = [rnd.randbytes(attachment_kb * 1024) for _ in range(max(1, distinct or drafts))]
+    body  = "<p>" + "שלום, מצורף קובץ העובדים. " * 40 + "</p>"
+    return [
+        {
+            "to_email":    f"employer{i}@example.co.il",
+            "cc_email":    None,
+            "subject":     f"דיווח מעסיק {i}",
+            "body_html":   body,
+            "attachments": [{"filename": f"employees_{i}.xlsx", "data": files[i % len(files)], "mimetype": _MIME_XLSX}],
+        }
+        for i in range(drafts)
+    ]
+
+
+def _measure(build, contents):
+    peaks = []
+    t0 = time.perf_counter()
+    tracemalloc.start()
+    for content in contents:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        raw = build(content)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+        del raw
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - t0
+    return {
+        "peak_bytes_per_draft_avg": int(sum(peaks) / len(peaks)),
+        "peak_bytes_per_draft_max": max(peaks),
+        "seconds":                  round(elapsed, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drafts", type=int, default=200)
+    parser.add_argument("--attachment-kb", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=None, help="מספר קבצים מצורפים שונים (ברירת מחדל: drafts)")
+    args = parser.parse_args(argv)
+
+    distinct = min(args.distinct or args.drafts, args.drafts)
+    contents = _contents(args.drafts, args.attachment_kb, distinct)
+
+    # תקינות — אותה הודעה בפענוח (פרט ל-boundary)
+    from email import message_from_bytes
+    a = message_from_bytes(base64.urlsafe_b64decode(_build_mime(contents[0])))
+    b = message_from_bytes(base64.urlsafe_b64decode(_legacy_build_mime(contents[0])))
+    assert [p.get_payload(decode=True) for p in a.walk()] == [p.get_payload(decode=True) for p in b.walk()]
+
+    result = {
+        "drafts":        args.drafts,
+        "attachment_kb": args.attachment_kb,
+        "distinct":      distinct,
+        "repeated_attachments": args.drafts - distinct,
+        "legacy":        _measure(_legacy_build_mime, contents),
+        "current":       _measure(_build_mime, contents),
+    }
+    result["peak_reduction"] = round(
+        1 - result["current"]["peak_bytes_per_draft_avg"] / result["legacy"]["peak_bytes_per_draft_avg"], 3
+    )
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+"""
+columnar_classifier.py
+----------------------
+מנוע סיווג עמודתי — חלופה ל-classify_all של record_classifier (engine="columnar").
+
+classify_record מריץ לכל רשומה ~35 קריאות _get (dict.get + pd.isna), מילוני recipients
+והמרות float/int/str על אותם ערכים שחוזרים שוב ושוב (סטטוס, counter, קוד שגיאה, סוג
+קופה, חודש שכר...). כאן:
+
+  1. סוג השורה (דילוג / סטטוס 6 / קוד חסר / לא ממופה / חוק) נקבע מ-4 עמודות בלבד.
+     כל עמודה מפורקת לקודים (factorize), כל המרה רצה פעם אחת לכל ערך שונה, והתוצאה
+     מופצת לשורות כ-mask של numpy.
+  2. שאר השדות נקראים במעבר אחד, רק לרשומות שסווגו, ומשמשים גם לניתוב וגם לפלט.
+  3. ענף הניתוב (קרן ברירת מחדל, PreMailCondition, Override) מחושב כ-masks; ספרת
+     הביקורת של ת.ז. נבדקת רק בשורות שכבר עברו את בדיקות סוג הקופה / מס / קופה.
+  4. אחריות / פורמט / נמענים תלויים רק ב-(חוק, ענף) — נקבעים פעם אחת לכל צירוף.
+  5. התוצאות נבנות כהעתק של dict תבנית לכל (חוק, ענף, counter) + השדות מהרשומה,
+     כשה-GC המחזורי מושבת (_gc_paused) — ההקצאות לא יוצרות מעגלים.
+
+הפלט זהה ל-classify_all(engine="rows"): אותן רשימות classified / skipped, באותו סדר,
+עם אותם מפתחות, ערכים וטיפוסים (כולל "_raw" כהפניה לרשומה המקורית). ערכים זהים (==)
+מאותו טיפוס נחשבים ערך אחד. המרה שזורקת חריגה שאינה חלק מהלוגיקה (למשל counter
+אינסופי — OverflowError) זורקת אותה גם כאן, רק אם שורה שמגיעה לבדיקה נתקלת בה.
+
+שימוש:
+  from record_classifier import classify_all
+  classified, skipped = classify_all(records, mapping, engine="columnar")
+"""
+
+from itertools import chain, repeat
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from mapping_loader import (
+    FORMAT_EXCLUDED, FORMAT_CASE_MGR, FORMAT_MOSADI_3,
+    RESP_CASE_MANAGER,
+    RESPONSIBILITY_MAP,
+    DEFAULT_FUND_MAP,
+)
+from record_classifier import (
+    FIELD_RECORD_ID, FIELD_CUSTOMER, FIELD_ERROR_CODE, FIELD_COUNTER,
+    FIELD_FEEDBACK_STATUS, FIELD_CHODESH, FIELD_CONTACT_EMAIL, FIELD_TIK_MISLAKA,
+    FIELD_ORIGINAL_FILE, FIELD_FUND_NAME, FIELD_FUND_ID, FIELD_FUND_TYPE,
+    FIELD_STATUS_DESC, FIELD_INCOME_TAX_AUTH_NUMBER,
+    FIELD_FIRST_NAME, FIELD_LAST_NAME, FIELD_AGENT_EMAIL, FIELD_ACCOUNTANT_EMAIL,
+    FIELD_CONTACT1_EMAIL, FIELD_CONTACT2_EMAIL, FIELD_EMPLOYER_NAME, FIELD_EMPLOYEE_ID,
+    ROLE_TO_FIELD,
+    _gc_paused,
+    _infer_format_from_role,
+)
+
+FIELD_CUSTOMER_NAME = "CustomerName"
+FIELD_ACCT_MGR      = "CustomerAccountManagerEmail"
+
+# סוגי שורה — לפי סדר הבדיקות ב-classify_record
+_K_CANCELLED = 0   # דילוג — רשומה מבוטלת
+_K_STATUS6   = 1   # מנהלת תיק — סטטוס 6
+_K_COUNTER   = 2   # דילוג — Counter<1
+_K_NO_CODE   = 3   # מנהלת תיק — קוד שגיאה חסר / לא מספרי
+_K_CODE_1_2  = 4   # דילוג — קוד 1/2
+_K_UNKNOWN   = 5   # מנהלת תיק — קוד לא ממופה
+_K_EXCLUDED  = 6   # דילוג — מוחרג במיפוי
+_K_RULE      = 7   # ניתוב לפי חוק המיפוי
+
+_SKIP_KINDS = (_K_CANCELLED, _K_COUNTER, _K_CODE_1_2, _K_EXCLUDED)
+
+# ענפי ניתוב בתוך _K_RULE (אינדקס בטבלת ההחלטות של כל חוק)
+_B_DEFAULT, _B_DEFAULT_FUND, _B_COND_TRUE, _B_COND_FALSE, _B_OVERRIDE_1, _B_OVERRIDE_2 = range(6)
+_BRANCHES = 6
+
+_CM_ROLE = "מנהלת תיק"
+_PENSION = "קרן פנסיה"
+
+# סדר המפתחות של _build_result
+_RESULT_KEYS = (
+    "record_id", "customer_number", "error_code", "customer_name",
+    "responsibility", "base_responsibility", "email_format", "excluded",
+    "to_role", "cc_role", "routing_path",
+    "mail_subject_template", "explanation_employer", "explanation_case_manager", "error_description",
+    "fund_institution_id", "fund_institution_name", "fund_institution_type",
+    "original_file_name", "tik_mislaka", "account_manager_email", "employee_id", "full_name",
+    "contact_email", "employer_name",
+    "email_agent", "email_accountant", "email_contact1", "email_contact2",
+    "pre_mail_condition_result", "pre_mail_condition_field", "pre_mail_condition_value",
+    "counter_weeks", "_raw",
+)
+# השדות שנקראים מהרשומה עצמה — לפי סדר הערכים ב-_assemble
+_ROW_KEYS = (
+    "record_id", "customer_number", "error_code", "customer_name",
+    "fund_institution_id", "fund_institution_name", "fund_institution_type",
+    "original_file_name", "tik_mislaka", "account_manager_email", "employee_id", "full_name",
+    "contact_email", "employer_name",
+    "email_agent", "email_accountant", "email_contact1", "email_contact2",
+    "pre_mail_condition_value", "_raw",
+)
+# שדות שנקראים לכל רשומה שסווגה (פלט + ניתוב)
+_CLASSIFIED_FIELDS = (
+    FIELD_RECORD_ID, FIELD_CUSTOMER, FIELD_CUSTOMER_NAME,
+    FIELD_FUND_ID, FIELD_FUND_NAME, FIELD_FUND_TYPE, FIELD_INCOME_TAX_AUTH_NUMBER,
+    FIELD_ORIGINAL_FILE, FIELD_TIK_MISLAKA, FIELD_ACCT_MGR, FIELD_EMPLOYEE_ID, FIELD_FIRST_NAME, FIELD_LAST_NAME,
+    FIELD_CONTACT_EMAIL, FIELD_EMPLOYER_NAME,
+    FIELD_AGENT_EMAIL, FIELD_ACCOUNTANT_EMAIL, FIELD_CONTACT1_EMAIL, FIELD_CONTACT2_EMAIL,
+    FIELD_CHODESH,
+)
+
+
+# =============================================================================
+# Public API
+# =============================================================================
+
+def classify_all_columnar(records, mapping):
+    """מקביל ל-record_classifier.classify_all — מחזיר (classified, skipped)."""
+    records = records if isinstance(records, list) else list(records)
+    if not records:
+        return [], []
+    with _gc_paused():
+        return _classify(records, mapping)
+
+
+def _classify(records, mapping):
+    rules = mapping["error_codes"]
+
+    # --- סוג שורה ---
+    head = _Columns(records, (FIELD_STATUS_DESC, FIELD_FEEDBACK_STATUS, FIELD_COUNTER, FIELD_ERROR_CODE))
+    status_desc = head.factor(FIELD_STATUS_DESC)
+    cancelled   = status_desc.rows(status_desc.apply(_is_cancelled, bool))
+
+    status  = head.factor(FIELD_FEEDBACK_STATUS)
+    status6 = status.rows(status.apply(_is_status6, bool))
+    status.check(~cancelled)
+
+    counter = head.factor(FIELD_COUNTER)
+    c_vals  = counter.apply(_counter_value, failed=(0, False))   # (c_val, ok)
+    counter.check(~cancelled)
+    c_val   = counter.rows(_object_array([c for c, _ in c_vals]))
+    c_skip  = counter.rows(np.array([ok and c < 1 for c, ok in c_vals], dtype=bool))
+
+    raw_code = head.factor(FIELD_ERROR_CODE)
+    codes    = raw_code.apply(_error_code)
+    raw_code.check(~cancelled & ~status6 & ~c_skip)
+    rule_list, rule_of_code = [], []
+    for code in codes:
+        rule = rules.get(code) if code is not None else None
+        rule_of_code.append(len(rule_list) if rule is not None else -1)
+        if rule is not None:
+            rule_list.append(rule)
+    code     = raw_code.rows(_object_array(codes))
+    rule_ix  = raw_code.rows(np.array(rule_of_code, dtype=np.int64))
+    excluded = np.array([bool(r.get("excluded", False)) for r in rule_list] + [False], dtype=bool)[rule_ix]
+
+    kind = np.select(
+        [cancelled, status6, c_skip,
+         raw_code.rows(np.array([c is None for c in codes], dtype=bool)),
+         raw_code.rows(np.array([c in (1, 2) for c in codes], dtype=bool)),
+         rule_ix < 0, excluded],
+        [_K_CANCELLED, _K_STATUS6, _K_COUNTER, _K_NO_CODE, _K_CODE_1_2, _K_UNKNOWN, _K_EXCLUDED],
+        default=_K_RULE,
+    )
+
+    # סטטוס 6 — קוד השגיאה בפלט הוא הערך הגולמי; קוד חסר — None
+    error_code = code.copy()
+    m = kind == _K_STATUS6
+    error_code[m] = _object_array(raw_code.uniques)[raw_code.codes[m]]
+    error_code[kind == _K_NO_CODE] = None
+
+    skipped = _skipped(records, kind, c_val, code)
+
+    # --- מכאן רק הרשומות שסווגו ---
+    sel  = np.flatnonzero(~np.isin(kind, _SKIP_KINDS))
+    cond_fields = {r.get("pre_mail_condition_field") for r in rule_list} - {None, ""}
+    cols = _Columns([records[i] for i in sel.tolist()], _CLASSIFIED_FIELDS + tuple(sorted(cond_fields)))
+    kind = kind[sel]
+    rule_ix = np.where(kind == _K_RULE, rule_ix[sel], len(rule_list))
+    branch  = _route(cols, rule_ix, rule_list)
+
+    classified = _assemble(cols, rule_list, kind, rule_ix, branch, counter.codes[sel], c_vals, error_code[sel])
+    return classified, skipped
+
+
+# =============================================================================
+# Columns
+# =============================================================================
+
+def _column(records, field):
+    """ערכי השדה לכל רשומה כמו _get: חסר / None / NaN → None."""
+    return [None if (v := r.get(field)) != v and isinstance(v, float) else v for r in records]
+
+
+def _object_array(values):
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+class _Columns:
+    """
+    עמודות (ו-_Factor) של רשומות — כל שדה נקרא מהרשומות פעם אחת.
+    fields נקראים מראש במעבר אחד על הרשומות (itemgetter — כל השדות של רשומה ברצף, בלי
+    קריאת פונקציה לכל ערך). שדה שחסר בחלק מהרשומות נקרא ב-values, עמודה לעמודה.
+    """
+
+    def __init__(self, records, fields=()):
+        self.records  = records
+        self._values  = {}
+        self._factors = {}
+        if records:
+            self._prefetch(fields)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _prefetch(self, fields):
+        first   = self.records[0]
+        present = [f for f in fields if f in first]
+        for field in fields:
+            # שדה שלא קיים באף רשומה (שדות "עתידיים" של ה-API) — בלי מעבר שני
+            if field not in first and not any(map(dict.__contains__, self.records, repeat(field))):
+                self._values[field] = [None] * len(self.records)
+        if len(present) < 2:
+            return
+        try:
+            rows = list(map(itemgetter(*present), self.records))
+        except KeyError:
+            return
+        has_float = float in set(map(type, chain.from_iterable(rows)))
+        for field, col in zip(present, zip(*rows)):
+            col = list(col)
+            if has_float and float in set(map(type, col)):
+                col = [None if v != v and isinstance(v, float) else v for v in col]
+            self._values[field] = col
+
+    def values(self, field):
+        if field not in self._values:
+            self._values[field] = _column(self.records, field)
+        return self._values[field]
+
+    def factor(self, field):
+        if field not in self._factors:
+            self._factors[field] = _Factor(self.values(field))
+        return self._factors[field]
+
+    def has_value(self, field):
+        f = self.factor(field)
+        return f.rows(f.apply(_has_value, bool))
+
+
+class _Factor:
+    """
+    עמודה מפורקת: codes (קוד לכל שורה) + uniques (ערך לכל קוד).
+    apply(fn) מריץ את fn פעם אחת לכל ערך (התוצאה נשמרת); rows(per_unique) מפיץ לשורות.
+    חריגה של fn נשמרת (הערך מקבל failed), ו-check(mask) זורק אותה אם שורה ב-mask קיבלה
+    ערך שנכשל — כמו classify_record, שנכשל רק ברשומה שמגיעה להמרה.
+    """
+
+    def __init__(self, values):
+        self.codes, self.uniques = _factorize(values)
+        self._applied = {}
+        self._failed  = {}
+
+    def apply(self, fn, dtype=None, failed=None):
+        if fn not in self._applied:
+            out = []
+            for i, value in enumerate(self.uniques):
+                try:
+                    out.append(fn(value))
+                except Exception as e:   # noqa: BLE001 — נזרק מחדש ב-check
+                    self._failed[i] = e
+                    out.append(failed)
+            self._applied[fn] = np.array(out, dtype=dtype) if dtype is not None else out
+        return self._applied[fn]
+
+    def check(self, mask):
+        if not self._failed:
+            return
+        hit = np.flatnonzero(mask & np.isin(self.codes, list(self._failed)))
+        if len(hit):
+            raise self._failed[int(self.codes[hit[0]])]
+
+    def rows(self, per_unique):
+        return per_unique[self.codes]
+
+
+def _factorize(values):
+    """
+    (codes, uniques). ערכים מטיפוס אחד (str / int / float) — pd.factorize;
+    אחרת מפתח (טיפוס, ערך), כדי ש-1 / 1.0 / True לא יתמזגו (ההמרות שלהם שונות).
+    """
+    types = set(map(type, values))
+    types.discard(type(None))
+    if len(types) <= 1 and types <= {str, int, float}:
+        codes, uniques = pd.factorize(_object_array(values))
+        uniques = list(uniques)
+        if (codes < 0).any():
+            codes[codes < 0] = len(uniques)
+            uniques.append(None)
+        return codes.astype(np.int64, copy=False), uniques
+
+    index, uniques = {}, []
+    codes = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        try:
+            key = (type(value), value)
+            hash(key)
+        except TypeError:
+            key = (id(value),)   # list / dict — כל מופע ערך נפרד
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(uniques)
+            uniques.append(value)
+        codes[i] = code
+    return codes, uniques
+
+
+# --- המרות לכל ערך שונה (אותה לוגיקה כמו classify_record) ---
+
+def _is_cancelled(value):
+    status_desc = "" if value is None else value
+    return bool(status_desc and "מבוטלת" in str(status_desc))
+
+
+def _is_status6(value):
+    if value is None:
+        return False
+    try:
+        return int(float(str(value).strip())) == 6
+    except (ValueError, TypeError):
+        return False
+
+
+def _counter_value(value):
+    """(c_val, ok) — ok=False: ההמרה נכשלה (c_val=0 ולא מדלגים)."""
+    try:
+        return (int(float(value)) if value is not None else 0), True
+    except (ValueError, TypeError):
+        return 0, False
+
+
+def _error_code(value):
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def _text(value):
+    return str(value or "").strip()
+
+
+def _has_value(value):
+    return value is not None and str(value).strip() not in ("", "nan", "None")
+
+
+def _default_fund(value):
+    """הקרן של ספרת הביקורת של ת.ז. (DEFAULT_FUND_MAP), או None."""
+    emp_id = _text(value)
+    if not emp_id or len(emp_id) < 2:
+        return None
+    try:
+        return DEFAULT_FUND_MAP.get(int(emp_id[-1]))
+    except (ValueError, IndexError):
+        return None
+
+
+def _month_index(value):
+    """חודש שכר YYYYMM → מספר חודשים מוחלט (כמו _months_diff), None אם לא מספר."""
+    try:
+        c = int(str(value).strip())
+    except (ValueError, TypeError):
+        return None
+    return (c // 100) * 12 + (c % 100)
+
+
+# =============================================================================
+# Routing
+# =============================================================================
+
+def _route(cols, rule_ix, rule_list):
+    """ענף ניתוב לכל שורה שסווגה (_B_DEFAULT לשורות בלי חוק)."""
+    branch = np.full(len(cols), _B_DEFAULT, dtype=np.int64)
+    default_fund = None
+
+    for r in np.unique(rule_ix[rule_ix < len(rule_list)]).tolist():
+        rule  = rule_list[r]
+        pos   = np.flatnonzero(rule_ix == r)
+        field = rule.get("pre_mail_condition_field")
+
+        if field:
+            if default_fund is None:
+                default_fund = _default_fund_mask(cols)
+            hit = default_fund[pos]
+            branch[pos[hit]] = _B_DEFAULT_FUND
+            rest = pos[~hit]
+            branch[rest] = np.where(_pre_condition_mask(cols, field)[rest], _B_COND_TRUE, _B_COND_FALSE)
+
+        elif rule.get("override_recipients"):
+            pending = np.ones(len(pos), dtype=bool)
+            for role_key, path in (("override_recipients", _B_OVERRIDE_1), ("override_recipients_2", _B_OVERRIDE_2)):
+                role = rule.get(role_key)
+                role_field = ROLE_TO_FIELD.get(role) if role and role in ROLE_TO_FIELD else None
+                if not role_field:
+                    continue
+                hit = pending & cols.has_value(role_field)[pos]
+                branch[pos[hit]] = path
+                pending &= ~hit
+
+    return branch
+
+
+def _default_fund_mask(cols):
+    """_check_default_fund_condition(...) is True, לכל שורה."""
+    fund_type = cols.factor(FIELD_FUND_TYPE)
+    cand = fund_type.rows(np.array([_text(v) == _PENSION for v in fund_type.uniques], dtype=bool))
+
+    funds = [f for f in DEFAULT_FUND_MAP.values() if f is not None]
+    for field, key in ((FIELD_INCOME_TAX_AUTH_NUMBER, "income_tax_auth"), (FIELD_FUND_ID, "fund_id")):
+        f = cols.factor(field)
+        known = {fund[key] for fund in funds}
+        cand &= f.rows(np.array([_text(v) in known for v in f.uniques], dtype=bool))
+
+    # ספרת הביקורת — רק לשורות שנשארו מועמדות (ת.ז. כמעט תמיד ייחודית)
+    mask = np.zeros(len(cols), dtype=bool)
+    emp  = cols.values(FIELD_EMPLOYEE_ID)
+    tax, fund_id = cols.values(FIELD_INCOME_TAX_AUTH_NUMBER), cols.values(FIELD_FUND_ID)
+    for i in np.flatnonzero(cand).tolist():
+        expected = _default_fund(emp[i])
+        mask[i] = (expected is not None and _text(tax[i]) == expected["income_tax_auth"]
+                   and _text(fund_id[i]) == expected["fund_id"])
+    return mask
+
+
+def _pre_condition_mask(cols, field):
+    """_check_pre_mail_condition(...) לכל שורה — True / False."""
+    last, current = cols.factor(field), cols.factor(FIELD_CHODESH)
+    cur_months  = [_month_index(v) for v in current.uniques]
+    last_months = [_month_index(v) for v in last.uniques]
+
+    # כל צירוף (חודש נוכחי, חודש קליטה אחרונה) מחושב פעם אחת
+    width = len(last.uniques)
+    pairs, inverse = np.unique(current.codes * width + last.codes, return_inverse=True)
+    ok = []
+    for key in pairs.tolist():
+        c_code, l_code = divmod(key, width)
+        if current.uniques[c_code] is None:
+            ok.append(True)
+            continue
+        c, l = cur_months[c_code], last_months[l_code]
+        ok.append(c is not None and l is not None and c - l <= 6)
+    return cols.has_value(field) & np.array(ok, dtype=bool)[inverse.reshape(-1)]
+
+
+def _decide(rule, branch):
+    """(responsibility, email_format, to_role, cc_role, path) לפני הסלמה — כמו classify_record."""
+    email_format   = rule.get("email_format", FORMAT_EXCLUDED)
+    responsibility = rule.get("responsibility", RESP_CASE_MANAGER)
+    default_to     = rule.get("responsibility_he")
+    default_cc     = rule.get("cc_responsibility")
+
+    if branch == _B_DEFAULT_FUND:
+        return responsibility, FORMAT_MOSADI_3, default_to, default_cc, "default_fund_match"
+
+    if branch == _B_COND_TRUE:
+        true_action = rule.get("pre_mail_condition_true_action")
+        true_value  = rule.get("pre_mail_condition_true_value")
+        if true_action == "change_format" and true_value:
+            email_format = true_value
+        elif true_action == "change_recipient" and true_value:
+            responsibility = RESPONSIBILITY_MAP.get(true_value, responsibility)
+            email_format   = _infer_format_from_role(true_value, email_format)
+        return responsibility, email_format, default_to, default_cc, "pre_condition_true"
+
+    if branch == _B_COND_FALSE:
+        to_role = rule.get("override_recipients") or default_to
+        responsibility = RESPONSIBILITY_MAP.get(to_role, responsibility)
+        email_format   = _infer_format_from_role(to_role, email_format)
+        return responsibility, email_format, to_role, rule.get("cc_override_1"), "pre_condition_false"
+
+    if branch in (_B_OVERRIDE_1, _B_OVERRIDE_2):
+        first   = branch == _B_OVERRIDE_1
+        to_role = rule.get("override_recipients" if first else "override_recipients_2")
+        cc_role = rule.get("cc_override_1" if first else "cc_override_2")
+        responsibility = RESPONSIBILITY_MAP.get(to_role, responsibility)
+        email_format   = _infer_format_from_role(to_role, email_format)
+        return responsibility, email_format, to_role, cc_role, "override_1" if first else "override_2"
+
+    return responsibility, email_format, default_to, default_cc, "default"
+
+
+# =============================================================================
+# Output
+# =============================================================================
+
+def _skipped(records, kind, c_val, code):
+    """(רשומה, סיבה) לכל רשומה שדולגה, בסדר הקלט — אותן סיבות כמו classify_record."""
+    out = []
+    for i in np.flatnonzero(np.isin(kind, _SKIP_KINDS)).tolist():
+        k = kind[i]
+        if k == _K_CANCELLED:
+            reason = "רשומה מבוטלת"
+        elif k == _K_COUNTER:
+            reason = f"Counter={c_val[i]} (פחות מ-1)"
+        elif k == _K_CODE_1_2:
+            reason = f"קוד שגיאה {code[i]} מוחרג"
+        else:
+            reason = f"קוד שגיאה {code[i]} מוחרג בקובץ מיפוי"
+        out.append((records[i], reason))
+    return out
+
+
+def _assemble(cols, rule_list, kind, rule_ix, branch, counter_codes, c_vals, error_code):
+    """
+    בונה את classified. השדות שנגזרים מההחלטה (אחריות, פורמט, נמענים, שדות החוק,
+    counter) זהים לכל השורות עם אותו (חוק, ענף, counter) — dict תבנית אחד לכל צירוף,
+    מועתק לכל שורה ומתעדכן רק בשדות מהרשומה (סדר המפתחות נשמר).
+    """
+    n_rules = len(rule_list)
+    has_rule = rule_ix < n_rules
+
+    # טבלת החלטות: שורה לכל (חוק, ענף) + שלוש שורות מנהלת תיק בלי חוק
+    table = [_decide(rule, b) for rule in rule_list for b in range(_BRANCHES)]
+    table += [(RESP_CASE_MANAGER, FORMAT_CASE_MGR, _CM_ROLE, None, path)
+              for path in ("status_6_ended", "קוד שגיאה חסר", "unknown_code")]
+    decision = np.where(has_rule, rule_ix * _BRANCHES + branch, 0)
+    decision[kind == _K_STATUS6] = n_rules * _BRANCHES
+    decision[kind == _K_NO_CODE] = n_rules * _BRANCHES + 1
+    decision[kind == _K_UNKNOWN] = n_rules * _BRANCHES + 2
+
+    width = len(c_vals)
+    keys, template_ix = np.unique(decision * width + counter_codes, return_inverse=True)
+    templates = [_template(table, rule_list, *divmod(key, width), c_vals) for key in keys.tolist()]
+
+    recs, raw = cols.records, cols.values
+    cond_field = [t["pre_mail_condition_field"] for t in templates]
+    cond_value = [None] * len(recs)
+    for t, field in enumerate(cond_field):
+        if field:
+            values = raw(field)
+            for i in np.flatnonzero(template_ix == t).tolist():
+                cond_value[i] = values[i]
+
+    record_id = [rid if rid is not None else f"UNKNOWN_{id(rec)}"
+                 for rid, rec in zip(raw(FIELD_RECORD_ID), recs)]
+    full_name = [" ".join(filter(None, pair)) or None
+                 for pair in zip(raw(FIELD_FIRST_NAME), raw(FIELD_LAST_NAME))]
+    rows = zip(
+        record_id, raw(FIELD_CUSTOMER), error_code.tolist(), raw(FIELD_CUSTOMER_NAME),
+        raw(FIELD_FUND_ID), raw(FIELD_FUND_NAME), raw(FIELD_FUND_TYPE),
+        raw(FIELD_ORIGINAL_FILE), raw(FIELD_TIK_MISLAKA), raw(FIELD_ACCT_MGR), raw(FIELD_EMPLOYEE_ID), full_name,
+        raw(FIELD_CONTACT_EMAIL), raw(FIELD_EMPLOYER_NAME),
+        raw(FIELD_AGENT_EMAIL), raw(FIELD_ACCOUNTANT_EMAIL), raw(FIELD_CONTACT1_EMAIL), raw(FIELD_CONTACT2_EMAIL),
+        cond_value, recs,
+    )
+    classified = list(map(dict.copy, map(templates.__getitem__, template_ix.reshape(-1).tolist())))
+    for result, values in zip(classified, rows):
+        result.update(zip(_ROW_KEYS, values))
+    return classified
+
+
+def _template(table, rule_list, decision, counter_code, c_vals):
+    """dict התוצאה עם השדות של (החלטה, counter) — כמו classify_record + _build_result."""
+    responsibility, email_format, to_role, cc_role, path = table[decision]
+    rule_ix, branch = divmod(decision, _BRANCHES)
+    rule = rule_list[rule_ix] if rule_ix < len(rule_list) else None
+    c_val = c_vals[counter_code][0]
+
+    base_responsibility = responsibility
+    if rule is not None and c_val >= 2:
+        responsibility, email_format = RESP_CASE_MANAGER, FORMAT_CASE_MGR
+        to_role, cc_role, path = _CM_ROLE, None, f"escalation_c{c_val}"
+    if base_responsibility is None:
+        base_responsibility = responsibility
+
+    if rule is None:
+        rule, condition_result = {}, None
+    elif branch in (_B_DEFAULT_FUND, _B_COND_TRUE):
+        condition_result = True
+    elif branch == _B_COND_FALSE:
+        condition_result = False
+    else:
+        condition_result = None
+
+    result = dict.fromkeys(_RESULT_KEYS)
+    result.update({
+        "responsibility":            responsibility,
+        "base_responsibility":       base_responsibility,
+        "email_format":              email_format,
+        "excluded":                  False,
+        "to_role":                   to_role,
+        "cc_role":                   cc_role,
+        "routing_path":              path,
+        "mail_subject_template":     rule.get("mail_subject"),
+        "explanation_employer":      rule.get("explanation_employer"),
+        "explanation_case_manager":  rule.get("explanation_case_manager"),
+        "error_description":         rule.get("description"),
+        "pre_mail_condition_result": condition_result,
+        "pre_mail_condition_field":  rule.get("pre_mail_condition_field"),
+        "counter_weeks":             c_val,
+    })
+    return result
@@ -0,0 +1,137 @@
+"""
+david_api_stub.py
+-----------------
+שרת stub מקומי ל-API של דוד — לבדיקות של ה-runner בלי גישה לפורטל.
+
+  POST {base}/services/AutomationFeedback/GetFeedbackData
+       גוף: {"StartDate", "top", "AccountManagerEmail"?, "skip"?}
+       → רשומות מקובץ / רשימה (מסונן לפי CustomerAccountManagerEmail, עם skip/top)
+  POST {base}/services/AutomationFeedback/SetFeedbackStatusBatch
+       גוף: [ {record}, ... ] → [] או [{success: false, ...}] לרשומות שנדחו
+
+הזרקת תקלות (לבדיקת retry / דו"ח כשלונות חלקי):
+  fail_first    : N הקריאות הראשונות ל-SetFeedbackStatusBatch מחזירות 503
+  reject_ids    : MISPAR_MEZAHE_RESHUMA שיחזרו כ-success=false
+  fail_chunks   : chunks שמכילים אחד מה-ids האלה מחזירים 400 (כשל סופי)
+
+שימוש:
+  python david_api_stub.py --records records.json --port 8099
+  → api_base = http://127.0.0.1:8099
+
+  from david_api_stub import start_stub
+  server, api_base = start_stub(records, reject_ids={"123"})
+  ...
+  server.state["batches"]   # כל ה-chunks שהתקבלו
+  server.shutdown()
+"""
+
+import json
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from record_fetcher import FETCH_PATH
+from status_submitter import SUBMIT_PATH
+
+
+def start_stub(records=None, host="127.0.0.1", port=0, fail_first=0, reject_ids=(), fail_chunks=()):
+    """מפעיל את ה-stub ב-thread ברקע. מחזיר (server, api_base)."""
+    server = _make_server(records, host, port, fail_first, reject_ids, fail_chunks)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def _make_server(records, host, port, fail_first, reject_ids, fail_chunks):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.state = {
+        "records":     list(records or []),
+        "fail_first":  int(fail_first),
+        "reject_ids":  {str(r) for r in reject_ids},
+        "fail_chunks": {str(r) for r in fail_chunks},
+        "batches":     [],   # chunks שנקלטו בהצלחה
+        "calls":       0,    # קריאות ל-SetFeedbackStatusBatch (כולל כשלונות)
+        "lock":        threading.Lock(),
+    }
+    return server
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+        except ValueError:
+            return self._reply(400, {"error": "invalid json"})
+
+        if self.path.endswith(FETCH_PATH):
+            return self._get_feedback_data(body or {})
+        if self.path.endswith(SUBMIT_PATH):
+            return self._set_feedback_status_batch(body)
+        return self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def _get_feedback_data(self, body):
+        records = self.server.state["records"]
+        mgr = body.get("AccountManagerEmail")
+        if mgr:
+            records = [r for r in records if r.get("CustomerAccountManagerEmail") == mgr]
+        skip = int(body.get("skip") or 0)
+        top  = int(body.get("top") or len(records))
+        return self._reply(200, records[skip:skip + top])
+
+    def _set_feedback_status_batch(self, chunk):
+        state = self.server.state
+        if not isinstance(chunk, list):
+            return self._reply(400, {"error": "body must be a JSON array"})
+        with state["lock"]:
+            state["calls"] += 1
+            if state["fail_first"] > 0:
+                state["fail_first"] -= 1
+                return self._reply(503, {"error": "temporarily unavailable"})
+
+        ids = [str(item.get("MISPAR_MEZAHE_RESHUMA")) for item in chunk]
+        if state["fail_chunks"] & set(ids):
+            return self._reply(400, {"error": "chunk rejected"})
+
+        with state["lock"]:
+            state["batches"].append(chunk)
+        rejected = [
+            {"success": False, "MISPAR_MEZAHE_RESHUMA": rid, "message": "rejected by stub"}
+            for rid in ids if rid in state["reject_ids"]
+        ]
+        return self._reply(200, rejected)
+
+    def _reply(self, status, payload):
+        out = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="stub מקומי ל-API של דוד")
+    parser.add_argument("--records", help="קובץ JSON עם מערך רשומות GetFeedbackData")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--reject-ids", default="", help="מזהים מופרדים בפסיק")
+    args = parser.parse_args(argv)
+
+    records = []
+    if args.records:
+        with open(args.records, encoding="utf-8") as f:
+            records = json.load(f)
+
+    reject = [r.strip() for r in args.reject_ids.split(",") if r.strip()]
+    server = _make_server(records, args.host, args.port, args.fail_first, reject, ())
+    print(f"david api stub: http://{args.host}:{server.server_port} ({len(records)} records)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+draft_journal.py
+----------------
+יומן drafts מקומי (SQLite) — הופך ריצה חוזרת של שלב 6 לדלתא.
+
+כל draft שנוצר נרשם מיד: (run_id, group_key, content_hash) → draft_id.
+ריצה עם אותו run_id (למשל אחרי timeout של gunicorn) מוצאת את ה-drafts שכבר
+נוצרו, לא יוצרת אותם שוב, ומחזירה את ה-draft_id הקיים — כך build_payload מקבל
+את אותם מזהים ואין drafts כפולים בתיבות המנהלות.
+
+מיקום היומן:
+  ברירת המחדל (/tmp) ב-Cloud Run היא דיסק בזיכרון, פרטי ל-instance — היומן מגן
+  רק על ריצות חוזרות באותו instance כל עוד הוא חי. restart / scale-down / ריצה
+  שמגיעה ל-instance אחר מתחילים מיומן ריק (ו-drafts עלולים להיווצר שוב).
+  להגנה מעבר לחיי ה-instance יש להפנות את DRAFT_JOURNAL_PATH לנתיב על volume
+  קבוע שמחובר לשירות (למשל Filestore/NFS). GCS FUSE לא מתאים — אין בו נעילת
+  קבצים ש-SQLite צריך.
+
+content_hash מכסה את כל תוכן המייל (תיבה, נמענים, נושא, גוף, קבצים מצורפים) —
+קבוצה שהתוכן שלה השתנה בין הריצות תיצור draft חדש. קובץ מצורף עם "digest" (producer lazy
+מ-email_builder) נכנס ל-hash לפי ה-digest — בלי לבנות את הקובץ. digest יכול להיות גם callable
+שמחושב רק כאן.
+
+שימוש:
+  journal = DraftJournal(path, run_id)
+  draft_id = journal.lookup().get((group_key, content_hash(email_content, impersonate)))
+  journal.record(group_key, h, draft_id, impersonate)
+  journal.close()
+"""
+
+import os
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+DEFAULT_JOURNAL_PATH = "/tmp/draft_journal.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    run_id       TEXT NOT NULL,
+    group_key    TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    draft_id     TEXT NOT NULL,
+    impersonate  TEXT,
+    created_at   TEXT NOT NULL,
+    PRIMARY KEY (run_id, group_key, content_hash)
+)
+"""
+
+
+def journal_path():
+    """נתיב היומן — env var DRAFT_JOURNAL_PATH או DEFAULT_JOURNAL_PATH (per-instance, ראה למעלה)."""
+    return os.environ.get("DRAFT_JOURNAL_PATH") or DEFAULT_JOURNAL_PATH
+
+
+def content_hash(email_content, impersonate):
+    """sha256 של תוכן ה-draft כפי שיישלח ל-Gmail."""
+    h = hashlib.sha256()
+    for value in (impersonate,
+                  email_content.get("to_email"),
+                  email_content.get("cc_email"),
+                  email_content.get("subject"),
+                  email_content.get("body_html")):
+        h.update(str(value or "").encode("utf-8"))
+        h.update(b"\0")
+    for att in email_content.get("attachments", []):
+        h.update(str(att.get("filename")).encode("utf-8") + b"\0")
+        h.update(str(att.get("mimetype")).encode("utf-8") + b"\0")
+        digest = att.get("digest")
+        if callable(digest):
+            digest = digest()
+        if digest:
+            # קובץ מצורף lazy — מזהה התוכן שה-builder חישב, בלי לבנות את הקובץ
+            h.update(b"digest:" + str(digest).encode("utf-8"))
+        else:
+            data = att.get("data") or b""
+            if callable(data):
+                data = data()
+            h.update(data if isinstance(data, bytes) else str(data).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class DraftJournal:
+    """יומן drafts לריצה אחת (run_id). thread-safe — חיבור אחד מוגן ב-lock."""
+
+    def __init__(self, path, run_id):
+        self.path   = path
+        self.run_id = str(run_id)
+        self._lock  = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def lookup(self):
+        """{(group_key, content_hash): draft_id} של כל ה-drafts שנרשמו ל-run_id."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT group_key, content_hash, draft_id FROM drafts WHERE run_id = ?",
+                (self.run_id,),
+            ).fetchall()
+        return {(gk, ch): draft_id for gk, ch, draft_id in rows}
+
+    def record(self, group_key, content_hash, draft_id, impersonate=None):
+        """רושם draft שנוצר (commit מיידי — שורד קריסה של ה-process)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO drafts VALUES (?, ?, ?, ?, ?, ?)",
+                (self.run_id, group_key, content_hash, draft_id, impersonate,
+                 datetime.utcnow().isoformat(timespec="seconds")),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
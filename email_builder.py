@@ -11,14 +11,20 @@ email_builder.py
   מנהלת תיק -- Excel עם כל שדות API
 """
 
-import io
+import html
+import hashlib
+import multiprocessing
+import time
+from collections import deque
 from datetime import date
-import pandas as pd
+from functools import partial
+from itertools import chain, islice
 
 from mapping_loader import (
     FORMAT_MOSADI_1, FORMAT_MOSADI_2, FORMAT_MOSADI_3,
     FORMAT_EMPLOYER, FORMAT_CASE_MGR,
 )
+from xlsx_writer import table_xlsx
 
 
 _HTML_STYLE = """
@@ -37,6 +43,72 @@ _TR_ODD  = "background-color:#ffffff;"
 
 _MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
+# תבניות HTML מקומפלות — כל שורה היא רצף קבוע של טוקנים (כולל הסגנונות ה-inline, מחושבים פעם אחת
+# בטעינת המודול) ובין הטוקנים ערכים שעברו escape. הטבלה נבנית ברשימת חלקים אחת ו-"".join בסוף —
+# לינארי במספר השורות, בלי מחרוזת ביניים לכל שורה.
+_EMPLOYER_TR  = '\n        <tr style="'
+_EMPLOYER_TD1 = f'">\n          <td style="{_TD}">'
+_EMPLOYER_TD  = f'</td>\n          <td style="{_TD}">'
+_EMPLOYER_END = '</td>\n        </tr>'
+
+_EMPLOYEE_TR         = '<tr style="'
+_EMPLOYEE_TD1        = f'"><td style="{_TD}">'
+_EMPLOYEE_TD         = f'</td><td style="{_TD}">'
+_EMPLOYEE_END        = '</td></tr>'
+_EMPLOYEE_CHODESH_TD = f'</td><td style="{_TD}'   # + רקע השורה + '">'
+
+_EMPLOYER_TABLE_HEAD = f"""
+<table style="{_TABLE}">
+  <thead>
+    <tr>
+      <th style="{_TH}">מ.ז. עובד</th>
+      <th style="{_TH}">שם מלא</th>
+      <th style="{_TH}">שם קופה</th>
+      <th style="{_TH}">סוג קופה</th>
+      <th style="{_TH}">תיאור שגיאה</th>
+      <th style="{_TH}">טיפול נדרש</th>
+      <th style="{_TH}">חודש שכר</th>
+    </tr>
+  </thead>
+  <tbody>"""
+_EMPLOYER_TABLE_TAIL = """
+  </tbody>
+</table>"""
+
+
+def _employees_table_head(include_chodesh):
+    chodesh_th = f"<th style=\"{_TH}\">חודש שכר</th>" if include_chodesh else ""
+    return f"""
+<table style="{_TABLE}">
+  <thead>
+    <tr>
+      <th style="{_TH}">ת.ז. עובד</th>
+      <th style="{_TH}">שם עובד</th>
+      <th style="{_TH}">תיאור הבעיה</th>
+      {chodesh_th}
+    </tr>
+  </thead>
+  <tbody>"""
+
+
+_EMPLOYEES_TABLE_HEAD         = _employees_table_head(False)
+_EMPLOYEES_TABLE_HEAD_CHODESH = _employees_table_head(True)
+_EMPLOYEES_TABLE_TAIL         = "</tbody>\n</table>"
+
+
+class _Escaper(dict):
+    """
+    html.escape עם memo לטבלה אחת: esc[value] → str מוכן ל-HTML.
+    ערכים חוזרים (שם קופה, תיאור שגיאה, טיפול נדרש) עוברים escape פעם אחת בלבד.
+    """
+
+    def __missing__(self, value):
+        text = str(value)
+        if "&" in text or "<" in text or ">" in text or '"' in text or "'" in text:
+            text = html.escape(text)
+        self[value] = text
+        return text
+
 
 def build_email(group, mapping):
     fmt = group.get("email_format", "")
@@ -57,17 +129,136 @@ def build_email(group, mapping):
     return content
 
 
-def build_all_emails(groups, mapping):
-    results = []
-    skipped = 0
+EMAIL_BUILD_CHUNK_SIZE = 100   # קבוצות לכל משימה ב-process pool
+
+
+def build_all_emails(groups, mapping, processes=0, chunk_size=EMAIL_BUILD_CHUNK_SIZE, stats=None):
+    """
+    בונה מייל לכל קבוצה. מחזיר (results, skipped) — results: [(group, content)] לפי סדר הקבוצות,
+    בלי קבוצות שהבנייה שלהן נכשלה; skipped = מספר הקבוצות שנכשלו.
+    processes : >1 → בנייה ב-process pool (ראה iter_emails).
+    stats     : dict אופציונלי — ממולא כמו ב-iter_emails.
+    """
+    stats   = stats if stats is not None else {}
+    results = list(iter_emails(groups, mapping, processes=processes, chunk_size=chunk_size, stats=stats))
+    return results, stats["skipped"]
+
+
+def iter_emails(groups, mapping, processes=0, chunk_size=EMAIL_BUILD_CHUNK_SIZE, stats=None):
+    """
+    generator של (group, content) לפי סדר הקבוצות — send_all_groups יכול לצרוך מיילים מוכנים
+    לפני שכל הקבוצות נבנו. קבוצה שהבנייה שלה נכשלה מדולגת ונספרת ב-stats["skipped"].
+
+    processes : >1 → הקבוצות נבנות ב-ProcessPoolExecutor ב-chunks של chunk_size קבוצות.
+                ה-mapping נשלח פעם אחת לכל worker; chunk שהסתיים מוחזר לפי הסדר בלי לחכות לשאר.
+                groups נקרא chunk אחרי chunk (לא list מראש); קלט שנכנס ב-chunk אחד נבנה באותו process.
+                קבצים מצורפים נבנים ב-worker (bytes במקום producer — ה-records לא חוזרים ב-pickle).
+    stats     : dict אופציונלי — {"built": int, "skipped": int, "seconds": float}, מתעדכן תוך כדי הצריכה.
+                seconds = זמן הבנייה עצמה (סכום על כל הקבוצות, גם כשהן נבנות ב-workers במקביל) —
+                לא כולל את הזמן שה-consumer מחזיק את ה-generator בין קבוצה לקבוצה.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(built=0, skipped=0, seconds=0.0)
+    built = None
+    if processes and processes > 1:
+        chunks = _iter_chunks(groups, chunk_size)
+        first  = next(chunks, [])
+        if len(first) < chunk_size:
+            groups = first
+        else:
+            built = _build_sharded(chain([first], chunks), mapping, processes, stats)
+    if built is None:
+        built = _build_inline(groups, mapping, stats)
+
+    for g, (content, error) in built:
+        if error is not None:
+            print(f"[WARN] email_builder: skip group {g.get('group_key')} -- {error}")
+            stats["skipped"] += 1
+            continue
+        stats["built"] += 1
+        yield g, content
+
+
+def _build_inline(groups, mapping, stats):
+    """(group, (content, error)) לכל קבוצה ב-process הנוכחי; זמן הבנייה נצבר ב-stats["seconds"]."""
     for g in groups:
-        try:
-            content = build_email(g, mapping)
-            results.append((g, content))
-        except Exception as e:
-            print(f"[WARN] email_builder: skip group {g.get('group_key')} -- {e}")
-            skipped += 1
-    return results, skipped
+        t0 = time.perf_counter()
+        result = _try_build(g, mapping)
+        stats["seconds"] += time.perf_counter() - t0
+        yield g, result
+
+
+def _try_build(group, mapping):
+    """(content, None) או (None, הודעת שגיאה) — שגיאה בקבוצה אחת לא עוצרת את השאר."""
+    try:
+        return build_email(group, mapping), None
+    except Exception as e:
+        return None, str(e)
+
+
+# --- process pool ---
+
+_worker_mapping = None
+
+
+def _init_build_worker(mapping):
+    """initializer של ה-pool — ה-mapping נשמר ב-worker ולא נשלח שוב עם כל chunk."""
+    global _worker_mapping
+    _worker_mapping = mapping
+
+
+def _build_chunk(chunk):
+    """
+    בונה chunk של קבוצות ב-worker. producer של קובץ מצורף (וה-digest שלו) מופעל כאן — ה-partial
+    מחזיק את ה-records של הקבוצה, וה-bytes קטנים בהרבה מה-pickle שלהם בדרך חזרה.
+    מחזיר (built, seconds) — seconds = זמן הבנייה ב-worker.
+    """
+    t0 = time.perf_counter()
+    built = [_try_build(g, _worker_mapping) for g in chunk]
+    for content, _ in built:
+        for att in (content or {}).get("attachments", []):
+            if callable(att["data"]):
+                att["data"] = att["data"]()
+            if callable(att.get("digest")):
+                att["digest"] = att["digest"]()
+    return built, time.perf_counter() - t0
+
+
+def _iter_chunks(groups, chunk_size):
+    """lists של עד chunk_size קבוצות, בלי לקרוא את כל ה-iterable מראש."""
+    it = iter(groups)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _build_sharded(chunks, mapping, processes, stats):
+    """
+    (group, (content, error)) לכל קבוצה לפי הסדר, chunk אחרי chunk ככל שה-workers מסיימים.
+    chunk מוגש ברגע שנקרא מהקלט, עד 2*processes chunks בטיפול בו-זמנית.
+    forkserver — ה-workers לא יורשים (fork) את ה-threads ואת הזיכרון של ה-process הראשי.
+    זמן הבנייה שה-workers מדדו נצבר ב-stats["seconds"].
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    def _collect(chunk, future):
+        built, seconds = future.result()
+        stats["seconds"] += seconds
+        return zip(chunk, built)
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=multiprocessing.get_context("forkserver"),
+                             initializer=_init_build_worker,
+                             initargs=(mapping,)) as pool:
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_build_chunk, chunk)))
+            if len(pending) >= 2 * processes:
+                yield from _collect(*pending.popleft())
+        while pending:
+            yield from _collect(*pending.popleft())
 
 
 # =============================================================================
@@ -94,7 +285,7 @@ def _build_mosadi_1(group, mapping):
 {_HTML_STYLE}
 <body dir="rtl">
   <p>שלום,</p>
-  <p>התקבל היזון חוזר מ<strong>{fund_name}</strong> עבור המעסיק <strong>{customer_number}</strong>
+  <p>התקבל היזון חוזר מ<strong>{_esc(fund_name)}</strong> עבור המעסיק <strong>{_esc(customer_number)}</strong>
   בגין העובדים הבאים אשר לא נקלטו באופן תקין למרות שחודשי שכר קודמים עם נתונים זהים נקלטו תקין
   על פי ההיזון החוזר שהתקבל מכם. האם ניתן לבדוק שוב ולשייך?</p>
   {emp_table}
@@ -135,7 +326,7 @@ def _build_mosadi_2(group, mapping):
 {_HTML_STYLE}
 <body dir="rtl">
   <p>שלום,</p>
-  <p>התקבל היזון חוזר מ<strong>{fund_name}</strong> בגין העובדים הבאים כי אין קרן פנסיה לעובד
+  <p>התקבל היזון חוזר מ<strong>{_esc(fund_name)}</strong> בגין העובדים הבאים כי אין קרן פנסיה לעובד
   תחת המעסיק. ע"פ הנחיות אגף שוק ההון ביטוח וחיסכון במשרד האוצר לא נדרש ביצוע קבלת בעלות
   בקרן פנסיה. כל הפרטים לקבלת בעלות נמצאים בממשק שדווח אליכם.</p>
   {emp_table}
@@ -177,7 +368,7 @@ def _build_mosadi_3(group, mapping):
 <body dir="rtl">
   <p>שלום,</p>
   <p>על פי נהלי קרן ברירת מחדל, העובדים המפורטים להלן משויכים לקרן
-  <strong>{fund_name}</strong> כקרן ברירת המחדל עבור המעסיק <strong>{customer_number}</strong>.
+  <strong>{_esc(fund_name)}</strong> כקרן ברירת המחדל עבור המעסיק <strong>{_esc(customer_number)}</strong>.
   התקבל היזון חוזר המעיד כי הכספים טרם נקלטו בקרן. נבקשכם לבדוק את הנושא ולטפל בהתאם.</p>
   {emp_table}
   {files_html}
@@ -220,7 +411,9 @@ def _build_employer(group, mapping):
 </body>
 """
 
-    xlsx_data     = _employer_excel(records)
+    # הקובץ המצורף נבנה רק כש-gmail_sender מרכיב את ה-MIME ומשוחרר אחרי יצירת ה-draft;
+    # digest מזהה את התוכן ליומן ה-drafts בלי לבנות את הקובץ — גם הוא lazy, ומחושב רק
+    # כש-draft_journal.content_hash מבקש אותו (ריצה בלי run_id לא מחשבת אותו בכלל)
     xlsx_filename = f"שגיאות_פנסיה_{customer}.xlsx"
 
     return {
@@ -231,7 +424,8 @@ def _build_employer(group, mapping):
         "attachments": [
             {
                 "filename": xlsx_filename,
-                "data":     xlsx_data,
+                "data":     partial(_employer_excel, records),
+                "digest":   partial(_employer_digest, records),
                 "mimetype": _MIME_XLSX,
             }
         ],
@@ -255,66 +449,59 @@ def _dedup_records(records):
 
 
 def _employer_table(records):
-    rows_html = ""
+    esc   = _Escaper()
+    parts = [_EMPLOYER_TABLE_HEAD]
+    add   = parts.extend
+    td    = _EMPLOYER_TD
     for i, r in enumerate(_dedup_records(records)):
-        tr_bg  = _TR_EVEN if i % 2 else _TR_ODD
-        emp_id    = r.get("employee_id") or ""
-        name      = r.get("full_name") or "---"
-        fund_name = r.get("fund_institution_name") or "---"
-        fund_type = r.get("fund_institution_type") or "---"
-        desc      = r.get("error_description") or ""
-        action    = r.get("explanation_employer") or ""
-        chodesh   = r.get("_raw", {}).get("CHODESH_MASKORET") or ""
-        rows_html += f"""
-        <tr style="{tr_bg}">
-          <td style="{_TD}">{emp_id}</td>
-          <td style="{_TD}">{name}</td>
-          <td style="{_TD}">{fund_name}</td>
-          <td style="{_TD}">{fund_type}</td>
-          <td style="{_TD}">{desc}</td>
-          <td style="{_TD}">{action}</td>
-          <td style="{_TD}">{chodesh}</td>
-        </tr>"""
+        add((
+            _EMPLOYER_TR, _TR_EVEN if i % 2 else _TR_ODD,
+            _EMPLOYER_TD1, esc[r.get("employee_id") or ""],
+            td, esc[r.get("full_name") or "---"],
+            td, esc[r.get("fund_institution_name") or "---"],
+            td, esc[r.get("fund_institution_type") or "---"],
+            td, esc[r.get("error_description") or ""],
+            td, esc[r.get("explanation_employer") or ""],
+            td, esc[r.get("_raw", {}).get("CHODESH_MASKORET") or ""],
+            _EMPLOYER_END,
+        ))
+    parts.append(_EMPLOYER_TABLE_TAIL)
+    return "".join(parts)
+
+
+EMPLOYER_EXCEL_COLUMNS = [
+    "מ.ז. עובד", "שם מלא", "שם קופה", "סוג קופה", "תיאור שגיאה", "טיפול נדרש", "חודש שכר",
+    "מס לקוח", "שם קובץ מקור", "תיק מסלקה",
+]
+
+
+def _employer_rows(records):
+    """שורות הקובץ המצורף למעסיק — tuple לכל רשומה (אחרי dedup), לפי EMPLOYER_EXCEL_COLUMNS."""
+    return [
+        (
+            r.get("employee_id"),
+            r.get("full_name"),
+            r.get("fund_institution_name"),
+            r.get("fund_institution_type"),
+            r.get("error_description"),
+            r.get("explanation_employer"),
+            r.get("_raw", {}).get("CHODESH_MASKORET"),
+            r.get("customer_number"),
+            r.get("original_file_name"),
+            r.get("tik_mislaka"),
+        )
+        for r in _dedup_records(records)
+    ]
 
-    return f"""
-<table style="{_TABLE}">
-  <thead>
-    <tr>
-      <th style="{_TH}">מ.ז. עובד</th>
-      <th style="{_TH}">שם מלא</th>
-      <th style="{_TH}">שם קופה</th>
-      <th style="{_TH}">סוג קופה</th>
-      <th style="{_TH}">תיאור שגיאה</th>
-      <th style="{_TH}">טיפול נדרש</th>
-      <th style="{_TH}">חודש שכר</th>
-    </tr>
-  </thead>
-  <tbody>{rows_html}
-  </tbody>
-</table>"""
+
+def _employer_digest(records):
+    """digest של הקובץ המצורף למעסיק — מאותן שורות שהקובץ נכתב מהן."""
+    return _rows_digest(_employer_rows(records))
 
 
 def _employer_excel(records):
-    rows = []
-    for r in _dedup_records(records):
-        rows.append({
-            "מ.ז. עובד":     r.get("employee_id"),
-            "שם מלא":        r.get("full_name"),
-            "שם קופה":       r.get("fund_institution_name"),
-            "סוג קופה":      r.get("fund_institution_type"),
-            "תיאור שגיאה":   r.get("error_description"),
-            "טיפול נדרש":    r.get("explanation_employer"),
-            "חודש שכר":      r.get("_raw", {}).get("CHODESH_MASKORET"),
-            "מס לקוח":       r.get("customer_number"),
-            "שם קובץ מקור":  r.get("original_file_name"),
-            "תיק מסלקה":     r.get("tik_mislaka"),
-        })
-
-    df  = pd.DataFrame(rows)
-    bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="שגיאות")
-    return bio.getvalue()
+    """קובץ XLSX למעסיק — גיליון "שגיאות" אחד (RTL), נכתב ישירות מהשורות ב-xlsx_writer."""
+    return table_xlsx(EMPLOYER_EXCEL_COLUMNS, _employer_rows(records), sheet_name="שגיאות")
 
 
 # =============================================================================
@@ -353,32 +540,23 @@ def _employees_table(employees, include_chodesh=False):
     """מחזיר טבלת HTML של עובדים — ת.ז + שם + תיאור + חודש שכר אם רלוונטי."""
     if not employees:
         return ""
-    rows = ""
+    esc   = _Escaper()
+    parts = [_EMPLOYEES_TABLE_HEAD_CHODESH if include_chodesh else _EMPLOYEES_TABLE_HEAD]
+    add   = parts.extend
+    td    = _EMPLOYEE_TD
     for i, e in enumerate(employees):
         tr_bg = _TR_EVEN if i % 2 else _TR_ODD
-        chodesh_td = f"<td style=\"{_TD}{tr_bg}\">{e.get('chodesh', '')}</td>" if include_chodesh else ""
-        rows += (
-            f"<tr style=\"{tr_bg}\">"
-            f"<td style=\"{_TD}\">{e['id']}</td>"
-            f"<td style=\"{_TD}\">{e['name']}</td>"
-            f"<td style=\"{_TD}\">{e.get('desc','')}</td>"
-            f"{chodesh_td}</tr>"
-        )
-
-    chodesh_th = f"<th style=\"{_TH}\">חודש שכר</th>" if include_chodesh else ""
-
-    return f"""
-<table style="{_TABLE}">
-  <thead>
-    <tr>
-      <th style="{_TH}">ת.ז. עובד</th>
-      <th style="{_TH}">שם עובד</th>
-      <th style="{_TH}">תיאור הבעיה</th>
-      {chodesh_th}
-    </tr>
-  </thead>
-  <tbody>{rows}</tbody>
-</table>"""
+        add((
+            _EMPLOYEE_TR, tr_bg,
+            _EMPLOYEE_TD1, esc[e["id"]],
+            td, esc[e["name"]],
+            td, esc[e.get("desc", "")],
+        ))
+        if include_chodesh:
+            add((_EMPLOYEE_CHODESH_TD, tr_bg, '">', esc[e.get("chodesh", "")]))
+        parts.append(_EMPLOYEE_END)
+    parts.append(_EMPLOYEES_TABLE_TAIL)
+    return "".join(parts)
 
 
 def _render_subject(template_str, meta):
@@ -393,13 +571,27 @@ def _render_subject(template_str, meta):
 
 
 def _ul_list(items, label=""):
+    """
+    רשימת <ul>. items הם טקסט גולמי (ערכי רשומה) ועוברים escape כאן — לא להעביר HTML מוכן.
+    label הוא טקסט קבוע מהקוד ולא עובר escape.
+    """
     if not items:
         return ""
-    lis = "".join(f"<li>{i}</li>" for i in items)
+    lis = "".join(f"<li>{_esc(i)}</li>" for i in items)
     header = f"<strong>{label}</strong>" if label else ""
     return f"<div>{header}<ul>{lis}</ul></div>"
 
 
+def _rows_digest(rows):
+    """sha256 של שורות קובץ מצורף — מזהה יציב לתוכן (ה-XLSX עצמו כולל זמן יצירה)."""
+    return hashlib.sha256(repr(rows).encode("utf-8")).hexdigest()
+
+
+def _esc(value):
+    """ערך רשומה לתוך HTML — escape של & < > ו-\"."""
+    return html.escape(str(value))
+
+
 def _nl2br(text):
     return (text or "").replace("\n", "<br>\n")
 
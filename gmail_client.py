@@ -0,0 +1,275 @@
+"""
+gmail_client.py
+---------------
+שכבת לקוח Gmail משותפת ל-gmail_sender.
+
+  - credentials לכל תיבה (service account + with_subject) נבנים פעם אחת ונשמרים —
+    ה-access token ממוחזר עד שפג תוקפו (google-auth מרענן לבד כשצריך).
+  - service לכל תיבה נבנה פעם אחת (build עם cache_discovery=False).
+  - httplib2 אינו thread-safe → כל thread מקבל AuthorizedHttp משלו לכל תיבה,
+    והבקשות מורצות עם execute(http=...).
+  - slot(mailbox): semaphore לכל תיבה — מגביל בקשות מקבילות לאותה תיבה.
+  - token bucket לכל תיבה (קצב בקשות/שנייה) — אדפטיבי: יורד בחצי על rate limit,
+    עולה בהדרגה בחזרה על הצלחות.
+  - execute() מנסה שוב על 429 / 403 rateLimitExceeded עם exponential backoff + jitter
+    (Retry-After מכובד אם נשלח). 5xx נוסה שוב רק בבקשה idempotent=True — drafts.create /
+    messages.send אינם idempotent: 5xx אחרי שהשרת כבר ביצע ייצור draft / מייל כפול. מונים: counters().
+
+הלקוחות נשמרים ברמת המודול (לפי service account + scopes), כך שריצות עוקבות
+באותו process ממחזרות tokens ו-services.
+
+שימוש:
+  clients = get_clients(service_account_info)
+  with clients.slot(mailbox):
+      created = clients.execute(mailbox, clients.service(mailbox).users().drafts().create(...))
+"""
+
+import time
+import random
+import threading
+
+GMAIL_SCOPES      = ["https://www.googleapis.com/auth/gmail.compose"]
+GMAIL_SCOPES_SEND = ["https://www.googleapis.com/auth/gmail.send"]
+
+MAILBOX_CONCURRENCY = 4      # בקשות מקבילות לכל תיבה
+MAILBOX_RATE        = 25.0   # בקשות/שנייה לתיבה (250 quota units/s למשתמש, drafts.create = 10)
+MAILBOX_RATE_MIN    = 1.0    # רצפת הקצב אחרי הורדות
+MAX_RETRIES         = 5
+BACKOFF_BASE        = 1.0    # שניות
+BACKOFF_MAX         = 32.0
+
+# סיבות שגיאה של Gmail שמצדיקות ניסיון חוזר
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+SERVER_STATUSES    = (500, 502, 503, 504)   # ניסיון חוזר רק בבקשה idempotent
+
+_clients      = {}
+_clients_lock = threading.Lock()
+
+
+def get_clients(service_account_info, send_scope=False, mailbox_concurrency=MAILBOX_CONCURRENCY):
+    """
+    מחזיר GmailClients משותף ל-service account + scope (נוצר בקריאה הראשונה).
+    mailbox_concurrency נקבע ביצירה בלבד — קריאות מאוחרות משתמשות בלקוח הקיים.
+    """
+    scopes = GMAIL_SCOPES_SEND if send_scope else GMAIL_SCOPES
+    key = (service_account_info.get("client_email"), service_account_info.get("private_key_id"), tuple(scopes))
+    with _clients_lock:
+        clients = _clients.get(key)
+        if clients is None:
+            clients = _clients[key] = GmailClients(service_account_info, scopes, mailbox_concurrency)
+        return clients
+
+
+def clear_clients():
+    """מנקה את כל הלקוחות השמורים (credentials / services)."""
+    with _clients_lock:
+        _clients.clear()
+
+
+class GmailClients:
+    """credentials / services / http / semaphores לכל תיבה מתחזה, עבור service account אחד."""
+
+    def __init__(self, service_account_info, scopes, mailbox_concurrency=MAILBOX_CONCURRENCY):
+        self._info        = service_account_info
+        self._scopes      = list(scopes)
+        self._concurrency = max(1, int(mailbox_concurrency))
+        self._lock        = threading.Lock()
+        self._base_creds  = None
+        self._creds       = {}   # mailbox → Credentials
+        self._services    = {}   # mailbox → Resource
+        self._slots       = {}   # mailbox → BoundedSemaphore
+        self._buckets     = {}   # mailbox → TokenBucket
+        self._local       = threading.local()
+        self._counters    = {"throttled": 0, "throttle_seconds": 0.0, "retries": 0, "retry_reasons": {}}
+        self.services_built = 0
+
+    def credentials(self, mailbox):
+        with self._lock:
+            creds = self._creds.get(mailbox)
+            if creds is None:
+                if self._base_creds is None:
+                    from google.oauth2 import service_account as sa_module
+                    self._base_creds = sa_module.Credentials.from_service_account_info(
+                        self._info, scopes=self._scopes
+                    )
+                creds = self._creds[mailbox] = self._base_creds.with_subject(mailbox)
+            return creds
+
+    def service(self, mailbox):
+        """Resource של Gmail לתיבה — לבניית בקשות בלבד; הרצה דרך execute()."""
+        with self._lock:
+            service = self._services.get(mailbox)
+        if service is not None:
+            return service
+
+        from googleapiclient.discovery import build
+        service = build("gmail", "v1", credentials=self.credentials(mailbox), cache_discovery=False)
+        with self._lock:
+            if mailbox not in self._services:
+                self._services[mailbox] = service
+                self.services_built += 1
+            return self._services[mailbox]
+
+    def http(self, mailbox):
+        """AuthorizedHttp של ה-thread הנוכחי לתיבה (משתמש ב-credentials המשותפים)."""
+        https = getattr(self._local, "https", None)
+        if https is None:
+            https = self._local.https = {}
+        http = https.get(mailbox)
+        if http is None:
+            from google_auth_httplib2 import AuthorizedHttp
+            from googleapiclient.http import build_http
+            http = https[mailbox] = AuthorizedHttp(self.credentials(mailbox), http=build_http())
+        return http
+
+    def slot(self, mailbox):
+        """semaphore של התיבה — `with clients.slot(mailbox): ...`"""
+        with self._lock:
+            slot = self._slots.get(mailbox)
+            if slot is None:
+                slot = self._slots[mailbox] = threading.BoundedSemaphore(self._concurrency)
+            return slot
+
+    def bucket(self, mailbox):
+        with self._lock:
+            bucket = self._buckets.get(mailbox)
+            if bucket is None:
+                bucket = self._buckets[mailbox] = TokenBucket(MAILBOX_RATE)
+            return bucket
+
+    def execute(self, mailbox, request, units=1, idempotent=False):
+        """
+        מריץ HttpRequest / BatchHttpRequest עם ה-http של ה-thread הנוכחי.
+        units      : מספר הבקשות שהקריאה מייצגת מול ה-token bucket (batch → מספר הפריטים).
+        idempotent : True → גם 5xx מנוסה שוב. ברירת מחדל False — רק rate limit (הבקשה נדחתה לפני ביצוע).
+        שגיאת quota (או שרת, בבקשה idempotent) → backoff וניסיון חוזר עד MAX_RETRIES; אחרת החריגה עולה.
+        """
+        bucket = self.bucket(mailbox)
+        for attempt in range(MAX_RETRIES + 1):
+            waited = bucket.acquire(units)
+            if waited > 0:
+                self._count(throttled=1, throttle_seconds=waited)
+            try:
+                result = request.execute(http=self.http(mailbox))
+            except Exception as e:
+                reason = retry_reason(e, idempotent=idempotent)
+                if reason is None or attempt == MAX_RETRIES:
+                    raise
+                bucket.penalize()
+                self._count(retries=1, reason=reason)
+                time.sleep(_backoff_delay(attempt, e))
+                continue
+            bucket.reward()
+            return result
+
+    def counters(self):
+        """עותק של המונים המצטברים (להשוואה לפני/אחרי ריצה)."""
+        with self._lock:
+            snapshot = dict(self._counters)
+            snapshot["retry_reasons"] = dict(self._counters["retry_reasons"])
+            return snapshot
+
+    def _count(self, throttled=0, throttle_seconds=0.0, retries=0, reason=None):
+        with self._lock:
+            self._counters["throttled"]        += throttled
+            self._counters["throttle_seconds"] += throttle_seconds
+            self._counters["retries"]          += retries
+            if reason:
+                reasons = self._counters["retry_reasons"]
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+
+def counters_delta(before, after):
+    """הפרש בין שני snapshots של counters() — המונים של ריצה אחת."""
+    reasons = {k: v - before["retry_reasons"].get(k, 0) for k, v in after["retry_reasons"].items()}
+    return {
+        "throttled":        after["throttled"] - before["throttled"],
+        "throttle_seconds": round(after["throttle_seconds"] - before["throttle_seconds"], 3),
+        "retries":          after["retries"] - before["retries"],
+        "retry_reasons":    {k: v for k, v in reasons.items() if v},
+    }
+
+
+# =============================================================================
+# Rate limiting / retry
+# =============================================================================
+
+class TokenBucket:
+    """
+    token bucket עם קצב אדפטיבי (AIMD): penalize() מחלק את הקצב ב-2 (עד MAILBOX_RATE_MIN),
+    reward() מעלה אותו בחזרה בהדרגה עד הקצב ההתחלתי.
+    acquire(n) שומר n tokens מראש (מותר להיכנס לחוב) וממתין עד שהחוב נפרע.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = float(rate)
+        self.rate     = float(rate)
+        self.burst    = float(burst if burst is not None else rate)
+        self._tokens  = self.burst
+        self._stamp   = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def acquire(self, n=1):
+        """מחזיר את זמן ההמתנה בשניות (0 אם היה token פנוי)."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp  = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self):
+        with self._lock:
+            self.rate = max(MAILBOX_RATE_MIN, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+def retry_reason(exc, idempotent=False):
+    """
+    סיבת ניסיון חוזר לחריגה של Gmail API, או None אם אין לנסות שוב.
+    429 / 403 עם rateLimitExceeded / userRateLimitExceeded — תמיד; 5xx — רק כש-idempotent.
+    """
+    status = _status(exc)
+    if status is None:
+        return None
+    reasons = [d.get("reason") for d in (getattr(exc, "error_details", None) or []) if isinstance(d, dict)]
+    limited = next((r for r in reasons if r in RATE_LIMIT_REASONS), None)
+    if status == 429:
+        return limited or "429"
+    if status == 403:
+        return limited
+    if idempotent and status in SERVER_STATUSES:
+        return limited or str(status)
+    return None
+
+
+def maybe_executed(exc):
+    """
+    True אם ייתכן שהבקשה בוצעה בשרת למרות החריגה — 5xx או שגיאת תעבורה בלי תשובה.
+    בקשה לא idempotent שנכשלה כך לא נשלחת שוב (draft / מייל כפול); 4xx — נדחתה לפני ביצוע.
+    """
+    status = _status(exc)
+    return status is None or status >= 500
+
+
+def _status(exc):
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+
+def _backoff_delay(attempt, exc=None):
+    """exponential backoff עם full jitter; Retry-After מהשרת גובר אם גדול יותר."""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    resp  = getattr(exc, "resp", None)
+    try:
+        retry_after = float(resp.get("retry-after")) if resp is not None and resp.get("retry-after") else 0.0
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    return min(BACKOFF_MAX, max(delay, retry_after))
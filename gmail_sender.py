@@ -19,39 +19,138 @@ gmail_sender.py
 }
 """
 
+import io
 import os
+import time
 import base64
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
+from email.generator import BytesGenerator
 from email import encoders
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from mapping_loader import FORMAT_CASE_MGR
+from gmail_client import get_clients, counters_delta, maybe_executed, GMAIL_SCOPES, GMAIL_SCOPES_SEND, MAILBOX_CONCURRENCY  # noqa: F401
+from draft_journal import content_hash
 
-GMAIL_SCOPES      = ["https://www.googleapis.com/auth/gmail.compose"]
-GMAIL_SCOPES_SEND = ["https://www.googleapis.com/auth/gmail.send"]
+GMAIL_BATCH_MAX = 100   # מקסימום בקשות ב-batch HTTP אחד של Gmail
+SEND_WINDOW     = 200   # משימות שנאספות מ-iterable (generator) לפני הגשה — interleave בין תיבות בתוך החלון
+
+_B64_CHUNK      = 3 * 16 * 1024   # כפולה של 3 — קידוד base64url בחלקים בלי padding באמצע
 
 
 # =============================================================================
 # Public API
 # =============================================================================
 
-def send_all_groups(email_results, service_account_info, default_impersonate, max_workers=20):
+def send_all_groups(email_results, service_account_info, default_impersonate, max_workers=20,
+                    mailbox_concurrency=MAILBOX_CONCURRENCY, batch_size=0, journal=None, stats=None,
+                    window=SEND_WINDOW):
     """
     מעבד את כל הקבוצות ויוצר drafts ב-Gmail.
 
-    email_results       : רשימת (group, email_content) tuples מ-email_builder
+    email_results       : (group, email_content) tuples מ-email_builder — רשימה, או iterable
+                          (email_builder.iter_emails) שנצרך תוך כדי שליחה
     service_account_info: dict של service account (מ-env var GMAIL_SERVICE_ACCOUNT_B64)
     default_impersonate : כתובת מייל ברירת מחדל לחיקוי (override ע"י TEST_GMAIL_IMPERSONATE)
-    max_workers         : מקבילות (ברירת מחדל 20)
-
-    מחזיר (send_results, skipped_count)
+    max_workers         : מקבילות כוללת (ברירת מחדל 20)
+    mailbox_concurrency : מקסימום בקשות מקבילות לאותה תיבה (ברירת מחדל 4)
+    batch_size          : >0 → drafts נשלחים ב-batch HTTP לפי תיבה (עד 100 לבקשה);
+                          פריט שנכשל ב-batch נשלח שוב כבקשה בודדת. 0 = בקשה לכל draft
+    journal             : DraftJournal אופציונלי — קבוצה שכבר יש לה draft ביומן (אותו group_key
+                          ואותו תוכן) לא נשלחת שוב ומקבלת את ה-draft_id הקיים; כל draft חדש נרשם מיד
+    stats               : dict אופציונלי — מתמלא במדדי תפוקה (ראה _send_stats)
+    window              : כש-email_results אינו רשימה (ובלי batch_size) — המשימות מוגשות בחלונות
+                          של window לפי סדר ההגעה, כך שה-drafts הראשונים נוצרים לפני שכל המיילים נבנו.
+                          רשימה מוגשת כחלון אחד.
+
+    מחזיר (send_results, skipped_count) — send_results לפי סדר email_results
     """
     # לשלב טסט: TEST_GMAIL_IMPERSONATE דורס את כל תיבות ה-to
     test_override = os.environ.get("TEST_GMAIL_IMPERSONATE", "").strip()
+    t0 = time.time()
+
+    tasks   = []
+    results = []
+    seconds = []
+    arrivals = _collect_tasks(email_results, test_override, default_impersonate, tasks, results, seconds)
+
+    if not service_account_info:
+        # מצב פיתוח / בדיקה בלי service account -- מחזיר stub
+        for idx in arrivals:
+            results[idx] = _stub_result(tasks[idx][0], tasks[idx][1])
+        if stats is not None:
+            stats.update(_send_stats(tasks, results, seconds, time.time() - t0, services_built=0))
+        return results, 0
+
+    clients = get_clients(service_account_info, mailbox_concurrency=mailbox_concurrency)
+    built_before    = clients.services_built
+    counters_before = clients.counters()
+
+    resume, on_result = list, None
+    if journal is not None:
+        resume, on_result = _journal_resume(journal, tasks, results)
+
+    if batch_size and batch_size > 0:
+        # batch לפי תיבה — צריך את כל המשימות
+        pending = resume(list(arrivals))
+        counts  = _send_batched(tasks, pending, clients, min(batch_size, GMAIL_BATCH_MAX), max_workers,
+                                results, seconds, on_result)
+        counts["journal_hits"] = len(tasks) - len(pending)
+        skipped = 0
+    else:
+        if isinstance(email_results, list):
+            window = max(len(email_results), 1)
+        counts, skipped = _send_streaming(arrivals, tasks, clients, max_workers, window,
+                                          results, seconds, resume, on_result)
+
+    if stats is not None:
+        stats.update(_send_stats(tasks, results, seconds, time.time() - t0,
+                                 services_built=clients.services_built - built_before,
+                                 **counts, **counters_delta(counters_before, clients.counters())))
+    return results, skipped
+
 
-    tasks = []
+# =============================================================================
+# Internal
+# =============================================================================
+
+def _journal_resume(journal, tasks, results):
+    """
+    מחזיר (resume, record):
+      resume(indices) — ממלא ב-results את המשימות שכבר יש להן draft ביומן ומחזיר את האינדקסים
+                        שעוד צריך לשלוח (נקרא לכל חלון משימות שהגיע)
+      record(idx)     — callback שרושם ביומן תוצאה מוצלחת
+    """
+    known  = journal.lookup()
+    hashes = {}
+
+    def _resume(indices):
+        pending = []
+        for idx in indices:
+            group, email_content, impersonate = tasks[idx]
+            hashes[idx] = content_hash(email_content, impersonate)
+            draft_id = known.get((group["group_key"], hashes[idx]))
+            if draft_id:
+                results[idx] = _ok_result(group, draft_id, impersonate)
+            else:
+                pending.append(idx)
+        return pending
+
+    def _record(idx):
+        result = results[idx]
+        if result and result.get("ok") and result.get("draft_id"):
+            journal.record(result["group_key"], hashes[idx], result["draft_id"], result.get("impersonate"))
+
+    return _resume, _record
+
+
+def _collect_tasks(email_results, test_override, default_impersonate, tasks, results, seconds):
+    """
+    צורך את email_results ומוסיף משימה (group, content, impersonate) לכל מייל; מחזיר (generator)
+    את האינדקס של כל משימה חדשה. קבוצות מנהלת תיק (content None) לא נשלחות.
+    """
     for group, email_content in email_results:
         if email_content is None:
             continue  # מנהלת תיק -- מטופל ב-report_builder, לא כאן
@@ -59,36 +158,78 @@ def send_all_groups(email_results, service_account_info, default_impersonate, ma
             or email_content.get("account_manager_email") \
             or _resolve_impersonate(email_content, default_impersonate)
         tasks.append((group, email_content, impersonate))
+        results.append(None)
+        seconds.append(0.0)
+        yield len(tasks) - 1
 
-    results = [None] * len(tasks)
-    skipped = 0
 
-    if not service_account_info:
-        # מצב פיתוח / בדיקה בלי service account -- מחזיר stub
-        return [_stub_result(g, ec) for g, ec, _ in tasks], 0
+def _windows(indices, size):
+    """רשימות של עד size אינדקסים, לפי סדר ההגעה."""
+    window = []
+    for idx in indices:
+        window.append(idx)
+        if len(window) >= size:
+            yield window
+            window = []
+    if window:
+        yield window
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_map = {
-            executor.submit(_process_one, group, email_content, impersonate, service_account_info): idx
-            for idx, (group, email_content, impersonate) in enumerate(tasks)
-        }
-        for future in as_completed(future_map):
-            idx = future_map[future]
+
+def _send_streaming(arrivals, tasks, clients, max_workers, window, results, seconds, resume, on_result=None):
+    """
+    בקשה לכל draft. המשימות נאספות בחלונות של window ומוגשות ל-thread pool (round-robin בין
+    תיבות בתוך החלון) בזמן שהחלון הבא עוד נבנה; תוצאות שהסתיימו נאספות בין חלונות.
+    מחזיר (counts, skipped).
+    """
+    counts     = {"http_requests": 0, "journal_hits": 0}
+    skipped    = 0
+    future_map = {}
+
+    def _collect(futures):
+        nonlocal skipped
+        for future in futures:
+            idx = future_map.pop(future)
             try:
-                results[idx] = future.result()
+                results[idx], seconds[idx] = future.result()
             except Exception as e:
-                group = tasks[idx][0]
-                results[idx] = _error_result(group, str(e))
+                results[idx] = _error_result(tasks[idx][0], str(e))
                 skipped += 1
+            if on_result:
+                on_result(idx)
 
-    return results, skipped
-
-
-# =============================================================================
-# Internal
-# =============================================================================
-
-def _process_one(group, email_content, impersonate, service_account_info):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for indices in _windows(arrivals, window):
+            pending = resume(indices)
+            counts["http_requests"] += len(pending)
+            counts["journal_hits"]  += len(indices) - len(pending)
+            # הגשה לסירוגין בין תיבות — threads לא נתקעים בהמתנה ל-semaphore של תיבה אחת
+            for idx in _interleave_by_mailbox(tasks, pending):
+                future = executor.submit(_timed_process_one, tasks[idx][0], tasks[idx][1], tasks[idx][2], clients)
+                future_map[future] = idx
+            _collect([f for f in future_map if f.done()])
+        _collect(as_completed(list(future_map)))
+    return counts, skipped
+
+
+def _interleave_by_mailbox(tasks, indices):
+    """האינדקסים בסדר round-robin בין תיבות (סדר פנימי נשמר)."""
+    by_mailbox = {}
+    for idx in indices:
+        by_mailbox.setdefault(tasks[idx][2], []).append(idx)
+    queues = list(by_mailbox.values())
+    order  = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        order.extend(q[i] for q in queues if i < len(q))
+    return order
+
+
+def _timed_process_one(group, email_content, impersonate, clients):
+    t0 = time.time()
+    result = _process_one(group, email_content, impersonate, clients)
+    return result, time.time() - t0
+
+
+def _process_one(group, email_content, impersonate, clients):
     """יוצר draft אחד ב-Gmail. מחזיר SendResult."""
     if not impersonate:
         return _error_result(group, "impersonate_email חסר -- לא ניתן ליצור draft")
@@ -98,39 +239,156 @@ def _process_one(group, email_content, impersonate, service_account_info):
         to_email = impersonate
 
     try:
-        service = _get_gmail_service(service_account_info, impersonate)
-        raw     = _build_mime(email_content)
-        created = service.users().drafts().create(
-            userId="me",
-            body={"message": {"raw": raw}},
-        ).execute()
-        return {
-            "group_key":    group["group_key"],
-            "email_format": group["email_format"],
-            "ok":           True,
-            "draft_id":     created.get("id"),
-            "impersonate":  impersonate,
-            "record_ids":   [r["record_id"] for r in group.get("records", [])],
-            "error":        None,
-        }
-
+        raw = _build_mime(email_content)
+        return _create_draft(group, raw, impersonate, clients)
     except Exception as e:
         return _error_result(group, str(e), impersonate=impersonate)
 
 
-def _get_gmail_service(service_account_info, impersonate_email, send_scope=False):
-    from google.oauth2 import service_account as sa_module
-    from googleapiclient.discovery import build
+def _draft_request(clients, impersonate, raw):
+    return clients.service(impersonate).users().drafts().create(
+        userId="me",
+        body={"message": {"raw": raw}},
+    )
+
+
+def _create_draft(group, raw, impersonate, clients):
+    """בקשת drafts.create בודדת עם MIME מוכן. מחזיר SendResult (חריגה עולה למעלה)."""
+    with clients.slot(impersonate):
+        created = clients.execute(impersonate, _draft_request(clients, impersonate, raw))
+    return _ok_result(group, created.get("id"), impersonate)
+
 
-    scopes = GMAIL_SCOPES_SEND if send_scope else GMAIL_SCOPES
-    creds = sa_module.Credentials.from_service_account_info(
-        service_account_info, scopes=scopes
-    ).with_subject(impersonate_email)
-    return build("gmail", "v1", credentials=creds)
+# --- batch HTTP ---
+
+def _send_batched(tasks, indices, clients, batch_size, max_workers, results, seconds, on_result=None):
+    """
+    מקבץ את המשימות indices לפי impersonate ל-batches של batch_size ושולח אותם ב-pool.
+    ממלא results / seconds במקום (on_result(idx) אחרי כל תוצאה).
+    מחזיר {"batches", "fallbacks", "http_requests"}.
+    """
+    by_mailbox = {}
+    for idx in indices:
+        impersonate = tasks[idx][2]
+        if not impersonate:
+            results[idx] = _error_result(tasks[idx][0], "impersonate_email חסר -- לא ניתן ליצור draft")
+            continue
+        by_mailbox.setdefault(impersonate, []).append(idx)
+
+    # batches לסירוגין בין תיבות (כמו _interleave_by_mailbox)
+    chunked = [[idxs[i:i + batch_size] for i in range(0, len(idxs), batch_size)]
+               for idxs in by_mailbox.values()]
+    batches = [chunks[i] for i in range(max((len(c) for c in chunked), default=0))
+               for chunks in chunked if i < len(chunks)]
+
+    counts = {"batches": len(batches), "fallbacks": 0, "http_requests": len(batches)}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_batch, batch, tasks, clients) for batch in batches]
+        for batch, future in zip(batches, futures):
+            try:
+                done, fallbacks = future.result()
+            except Exception as e:
+                done, fallbacks = [(idx, _error_result(tasks[idx][0], str(e), impersonate=tasks[idx][2]), 0.0)
+                                   for idx in batch], 0
+            for idx, result, sec in done:
+                results[idx], seconds[idx] = result, sec
+                if on_result:
+                    on_result(idx)
+            counts["fallbacks"]     += fallbacks
+            counts["http_requests"] += fallbacks
+    return counts
+
+
+def _process_batch(batch, tasks, clients):
+    """
+    batch HTTP אחד ל-drafts של תיבה אחת. פריט שנדחה (4xx — למשל rate limit, או batch שנדחה כולו)
+    נשלח שוב כבקשה בודדת. פריט שנכשל ב-5xx / שגיאת תעבורה לא נשלח שוב — ייתכן שה-draft כבר
+    נוצר — ומדווח כשגיאה. מחזיר ([(idx, SendResult, seconds)], fallbacks).
+    """
+    t0 = time.time()
+    impersonate = tasks[batch[0]][2]
+    done, raws, errors = [], {}, {}
+
+    def _callback(request_id, response, exception):
+        idx = int(request_id)
+        if exception is None:
+            done.append((idx, _ok_result(tasks[idx][0], response.get("id"), impersonate)))
+        else:
+            errors[idx] = exception
+
+    request = clients.service(impersonate).new_batch_http_request(callback=_callback)
+    for idx in batch:
+        group, email_content, _ = tasks[idx]
+        try:
+            raws[idx] = _build_mime(email_content)
+        except Exception as e:
+            done.append((idx, _error_result(group, str(e), impersonate=impersonate)))
+            continue
+        request.add(_draft_request(clients, impersonate, raws[idx]), request_id=str(idx))
+
+    if raws:
+        try:
+            with clients.slot(impersonate):
+                clients.execute(impersonate, request, units=len(raws))
+        except Exception as e:
+            answered = {idx for idx, _ in done}
+            errors.update({idx: e for idx in raws if idx not in answered})
+
+    # fallback — בקשה בודדת לכל פריט שנדחה ב-batch
+    fallbacks = 0
+    for idx, exc in errors.items():
+        group = tasks[idx][0]
+        if maybe_executed(exc):
+            done.append((idx, _error_result(group, f"{exc} (ייתכן שה-draft נוצר — לא נשלח שוב)",
+                                            impersonate=impersonate)))
+            continue
+        fallbacks += 1
+        try:
+            done.append((idx, _create_draft(group, raws[idx], impersonate, clients)))
+        except Exception as e:
+            done.append((idx, _error_result(group, str(e), impersonate=impersonate)))
+
+    per_item = (time.time() - t0) / len(batch)
+    return [(idx, result, per_item) for idx, result in done], fallbacks
+
+
+def _send_stats(tasks, results, seconds, elapsed, services_built, **counts):
+    """
+    מדדי תפוקה של send_all_groups:
+    {"drafts", "ok", "failed", "seconds", "drafts_per_second", "services_built",
+     "mailboxes": {mailbox: {"drafts", "ok", "failed", "task_seconds"}},
+     + counts: "journal_hits", "http_requests", "throttled", "throttle_seconds", "retries",
+               "retry_reasons" ובמצב batch גם "batches" / "fallbacks"}
+    """
+    mailboxes = {}
+    for (_, _, impersonate), result, sec in zip(tasks, results, seconds):
+        mb = mailboxes.setdefault(impersonate or "", {"drafts": 0, "ok": 0, "failed": 0, "task_seconds": 0.0})
+        mb["drafts"] += 1
+        mb["ok" if result and result.get("ok") else "failed"] += 1
+        mb["task_seconds"] += sec
+    for mb in mailboxes.values():
+        mb["task_seconds"] = round(mb["task_seconds"], 3)
+
+    ok = sum(1 for r in results if r and r.get("ok"))
+    return {
+        "drafts":            len(tasks),
+        "ok":                ok,
+        "failed":            len(tasks) - ok,
+        "seconds":           round(elapsed, 3),
+        "drafts_per_second": round(len(tasks) / elapsed, 2) if elapsed > 0 else None,
+        "services_built":    services_built,
+        **counts,
+        "mailboxes":         mailboxes,
+    }
 
 
 def _build_mime(email_content):
-    """בונה MIME message מ-EmailContent ומחזיר base64url string."""
+    """
+    בונה MIME message מ-EmailContent ומחזיר base64url string.
+    ההודעה נכתבת ישירות ל-buffer ומקודדת ל-base64url ממנו, בלי העתקות as_bytes() / getvalue().
+    קובץ מצורף שה-data שלו callable (producer מ-email_builder) נבנה כאן —
+    ה-bytes משתחררים כשהפונקציה חוזרת, וה-MIME כש-draft נוצר.
+    """
     msg = MIMEMultipart()
     msg["to"]      = email_content.get("to_email", "")
     msg["subject"] = email_content.get("subject", "")
@@ -143,8 +401,12 @@ def _build_mime(email_content):
 
     for att in email_content.get("attachments", []):
         part = MIMEBase(*att["mimetype"].split("/", 1))
-        part.set_payload(att["data"])
-        encoders.encode_base64(part)
+        data = att["data"]
+        if callable(data):
+            data = data()
+        # זהה ל-encoders.encode_base64, בלי להחזיק את ה-bytes בתוך ה-part
+        part.set_payload(base64.encodebytes(data).decode("ascii"))
+        part["Content-Transfer-Encoding"] = "base64"
         part.add_header(
             "Content-Disposition",
             "attachment",
@@ -152,7 +414,14 @@ def _build_mime(email_content):
         )
         msg.attach(part)
 
-    return base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
+    buf = io.BytesIO()
+    BytesGenerator(buf, mangle_from_=False, policy=msg.policy).flatten(msg)
+    with buf.getbuffer() as view:
+        encoded = bytearray()
+        for i in range(0, len(view), _B64_CHUNK):
+            encoded += base64.urlsafe_b64encode(view[i:i + _B64_CHUNK])
+    buf.close()
+    return encoded.decode("ascii")
 
 
 def _resolve_impersonate(email_content, default_impersonate):
@@ -160,6 +429,18 @@ def _resolve_impersonate(email_content, default_impersonate):
     return default_impersonate or email_content.get("to_email")
 
 
+def _ok_result(group, draft_id, impersonate):
+    return {
+        "group_key":    group["group_key"],
+        "email_format": group["email_format"],
+        "ok":           True,
+        "draft_id":     draft_id,
+        "impersonate":  impersonate,
+        "record_ids":   [r["record_id"] for r in group.get("records", [])],
+        "error":        None,
+    }
+
+
 def _stub_result(group, email_content):
     """מצב פיתוח -- מחזיר תוצאה עם draft_id=None."""
     return {
@@ -208,7 +489,7 @@ def send_dev_report(report_bytes, run_date, sender, recipient, service_account_i
     TO:   recipient (niravivi@spring-ai.co.il)
     """
     try:
-        service = _get_gmail_service(service_account_info, sender, send_scope=True)
+        clients = get_clients(service_account_info, send_scope=True)
 
         msg = MIMEMultipart()
         msg["Subject"] = f"[DEV] דו\"ח ריצה — {run_date.strftime('%d/%m/%Y %H:%M')} UTC"
@@ -232,7 +513,7 @@ def send_dev_report(report_bytes, run_date, sender, recipient, service_account_i
         msg.attach(part)
 
         raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        service.users().messages().send(userId=sender, body={"raw": raw}).execute()
+        clients.execute(sender, clients.service(sender).users().messages().send(userId=sender, body={"raw": raw}))
         return True
 
     except Exception as e:
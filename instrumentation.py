@@ -0,0 +1,304 @@
+"""
+instrumentation.py
+------------------
+מדידה מובנית לכל שלב ב-pipeline + רישום metrics בפורמט Prometheus.
+
+לכל שלב (mapping, fetch, classify, routing, group, build, send, payload, submit, report):
+  - seconds           : זמן קיר (perf_counter)
+  - cpu_seconds       : זמן CPU של ה-process (process_time — כל ה-threads, כולל jobs מקבילים)
+  - rss_peak_delta_mb : כמה השלב העלה את שיא ה-RSS של ה-process (ru_maxrss; לא כולל process pool)
+  - rss_delta_mb      : שינוי ה-RSS הנוכחי בין תחילת השלב לסופו (/proc/self/statm)
+  - records_in / records_out
+
+StageRecorder עובד בסגנון "סמן": stage(name) סוגר את השלב הקודם ופותח חדש, כך
+שהחזרה מוקדמת בשלב שנכשל לא משאירה מדידה פתוחה — finish() סוגר אותה.
+כל שלב שנסגר מתווסף גם ל-REGISTRY (מונים מצטברים לאורך חיי ה-process),
+שמוצג ב-GET /metrics דרך render_metrics().
+
+שימוש:
+  rec = StageRecorder()
+  rec.stage("group", records_in=len(classified))
+  groups = group_records(classified)
+  rec.records(out=len(groups))
+  ...
+  rec.finish()
+  rec.stages()   # [{"stage", "seconds", "cpu_seconds", ...}, ...]
+"""
+
+import os
+import sys
+import time
+import threading
+
+try:
+    import resource
+except ImportError:   # לא קיים ב-Windows
+    resource = None
+
+# זמני שלבים ב-histogram (שניות)
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+# =============================================================================
+# זיכרון
+# =============================================================================
+
+def current_rss():
+    """RSS נוכחי של ה-process בבתים, או None אם לא זמין (לא Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    """שיא ה-RSS של ה-process בבתים (ru_maxrss), או None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024   # Linux: KB
+
+
+def _mb(delta):
+    return None if delta is None else round(delta / (1024 * 1024), 1)
+
+
+def _diff(after, before):
+    return None if after is None or before is None else after - before
+
+
+# =============================================================================
+# Stage recorder
+# =============================================================================
+
+class StageRecorder:
+    """מדידות השלבים של ריצה אחת. thread-safe לקריאה (snapshot) בזמן ריצה."""
+
+    def __init__(self, registry=None):
+        self._registry = registry if registry is not None else REGISTRY
+        self._lock     = threading.Lock()
+        self._current  = None   # dict של השלב הפתוח
+        self._stages   = []
+
+    def stage(self, name, records_in=None):
+        """סוגר את השלב הקודם (אם יש) ופותח את name."""
+        start = {
+            "stage":      name,
+            "records_in": records_in,
+            "records_out": None,
+            "_wall":      time.perf_counter(),
+            "_cpu":       time.process_time(),
+            "_rss":       current_rss(),
+            "_peak":      peak_rss(),
+        }
+        with self._lock:
+            closed = self._close()
+            self._current = start
+        self._publish(closed)
+
+    def records(self, in_=None, out=None):
+        """מעדכן records_in / records_out של השלב הפתוח."""
+        with self._lock:
+            if self._current is None:
+                return
+            if in_ is not None:
+                self._current["records_in"] = in_
+            if out is not None:
+                self._current["records_out"] = out
+
+    def finish(self):
+        """סוגר את השלב הפתוח (אם יש)."""
+        with self._lock:
+            closed = self._close()
+        self._publish(closed)
+
+    def stages(self):
+        """רשימת השלבים שהסתיימו (עותק)."""
+        with self._lock:
+            return [dict(s) for s in self._stages]
+
+    def snapshot(self):
+        """(שלב נוכחי, [שלבים שהסתיימו], שניות בשלב הנוכחי) — ל-GET /jobs/<id>."""
+        with self._lock:
+            current = self._current
+            running = round(time.perf_counter() - current["_wall"], 2) if current else None
+            return (current["stage"] if current else None), [dict(s) for s in self._stages], running
+
+    def _close(self):
+        """מחשב את מדידות השלב הפתוח ומעביר אותו לרשימה. נקרא תחת lock."""
+        cur = self._current
+        if cur is None:
+            return None
+        self._current = None
+        done = {
+            "stage":             cur["stage"],
+            "seconds":           round(time.perf_counter() - cur["_wall"], 3),
+            "cpu_seconds":       round(time.process_time() - cur["_cpu"], 3),
+            "rss_peak_delta_mb": _mb(_diff(peak_rss(), cur["_peak"])),
+            "rss_delta_mb":      _mb(_diff(current_rss(), cur["_rss"])),
+            "records_in":        cur["records_in"],
+            "records_out":       cur["records_out"],
+        }
+        self._stages.append(done)
+        return done
+
+    def _publish(self, done):
+        if done is None:
+            return
+        reg, stage = self._registry, done["stage"]
+        reg.inc("pipeline_stage_runs_total", 1, stage=stage)
+        reg.inc("pipeline_stage_seconds_total", done["seconds"], stage=stage)
+        reg.inc("pipeline_stage_cpu_seconds_total", done["cpu_seconds"], stage=stage)
+        reg.observe("pipeline_stage_duration_seconds", done["seconds"], stage=stage)
+        if done["rss_peak_delta_mb"] is not None:
+            reg.set("pipeline_stage_rss_peak_delta_bytes", done["rss_peak_delta_mb"] * 1024 * 1024, stage=stage)
+        if done["records_in"] is not None:
+            reg.inc("pipeline_stage_records_in_total", done["records_in"], stage=stage)
+        if done["records_out"] is not None:
+            reg.inc("pipeline_stage_records_out_total", done["records_out"], stage=stage)
+
+
+# =============================================================================
+# Prometheus registry
+# =============================================================================
+
+class MetricsRegistry:
+    """מונים / gauges / histograms עם labels, ו-render() בפורמט הטקסט של Prometheus."""
+
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._meta   = {}   # name → (kind, help, buckets)
+        self._values = {}   # name → {labels: value}   (histogram: {labels: [counts, sum, count]})
+
+    def describe(self, name, kind, help_text, buckets=None):
+        """מגדיר metric (counter / gauge / histogram). חובה לפני שימוש."""
+        with self._lock:
+            self._meta[name] = (kind, help_text, tuple(buckets or ()))
+            self._values.setdefault(name, {})
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            buckets = self._meta[name][2]
+            series  = self._values[name]
+            entry   = series.get(key)
+            if entry is None:
+                entry = series[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        """כל ה-metrics בפורמט text exposition 0.0.4."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self._values[name].items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+                        continue
+                    counts, total, count = value
+                    for bound, n in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{_fmt_labels(key + (('le', _fmt_value(bound)),))} {n}")
+                    lines.append(f"{name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(key):
+    if not key:
+        return ""
+    parts = []
+    for k, v in key:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _fmt_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+REGISTRY = MetricsRegistry()
+
+REGISTRY.describe("pipeline_stage_runs_total",        "counter",   "Completed pipeline stages")
+REGISTRY.describe("pipeline_stage_seconds_total",     "counter",   "Wall time spent per stage")
+REGISTRY.describe("pipeline_stage_cpu_seconds_total", "counter",   "Process CPU time spent per stage")
+REGISTRY.describe("pipeline_stage_duration_seconds",  "histogram", "Stage wall time", STAGE_BUCKETS)
+REGISTRY.describe("pipeline_stage_rss_peak_delta_bytes", "gauge",  "Peak RSS growth during the last run of the stage")
+REGISTRY.describe("pipeline_stage_records_in_total",  "counter",   "Records entering each stage")
+REGISTRY.describe("pipeline_stage_records_out_total", "counter",   "Records leaving each stage")
+REGISTRY.describe("pipeline_runs_total",              "counter",   "Pipeline runs by outcome")
+REGISTRY.describe("pipeline_run_seconds_total",       "counter",   "Wall time of finished pipeline runs")
+REGISTRY.describe("pipeline_fetch_pages_total",       "counter",   "GetFeedbackData pages fetched")
+REGISTRY.describe("pipeline_fetch_attempts_total",    "counter",   "GetFeedbackData HTTP attempts")
+REGISTRY.describe("pipeline_gmail_drafts_total",      "counter",   "Gmail drafts by result")
+REGISTRY.describe("pipeline_gmail_retries_total",     "counter",   "Gmail API retries")
+REGISTRY.describe("pipeline_gmail_throttled_total",   "counter",   "Gmail requests delayed by the per-mailbox rate limiter")
+REGISTRY.describe("pipeline_status_chunks_total",     "counter",   "SetFeedbackStatusBatch chunks by result")
+REGISTRY.describe("process_resident_memory_bytes",    "gauge",     "Resident memory size in bytes")
+REGISTRY.describe("process_peak_resident_memory_bytes", "gauge",   "Peak resident memory size in bytes")
+REGISTRY.describe("process_cpu_seconds_total",        "counter",   "Total user and system CPU time spent in seconds")
+
+
+# =============================================================================
+# מונים מתוך ה-stats של מודולי ה-engine
+# =============================================================================
+
+def record_fetch_stats(fetch_stats):
+    """עמודים / ניסיונות HTTP מ-fetch_stats של record_fetcher (סכום על כל המנהלות)."""
+    for mgr_stats in (fetch_stats or {}).get("managers", {}).values():
+        REGISTRY.inc("pipeline_fetch_pages_total", mgr_stats.get("pages", 0))
+        REGISTRY.inc("pipeline_fetch_attempts_total", mgr_stats.get("attempts", 0))
+
+
+def record_gmail_stats(gmail_stats):
+    """drafts / retries / throttling מ-stats של send_all_groups."""
+    if not gmail_stats:
+        return
+    REGISTRY.inc("pipeline_gmail_drafts_total", gmail_stats.get("ok", 0), result="ok")
+    REGISTRY.inc("pipeline_gmail_drafts_total", gmail_stats.get("failed", 0), result="failed")
+    for reason, n in (gmail_stats.get("retry_reasons") or {}).items():
+        REGISTRY.inc("pipeline_gmail_retries_total", n, reason=reason)
+    REGISTRY.inc("pipeline_gmail_throttled_total", gmail_stats.get("throttled", 0))
+
+
+def record_submit_report(report):
+    """chunks שנקלטו / נכשלו מדו"ח submit_chunks."""
+    REGISTRY.inc("pipeline_status_chunks_total", report["ok_chunks"], result="ok")
+    REGISTRY.inc("pipeline_status_chunks_total", len(report["failed_chunks"]), result="failed")
+
+
+def render_metrics():
+    """REGISTRY.render() אחרי עדכון ה-gauges של ה-process."""
+    rss, peak = current_rss(), peak_rss()
+    if rss is not None:
+        REGISTRY.set("process_resident_memory_bytes", rss)
+    if peak is not None:
+        REGISTRY.set("process_peak_resident_memory_bytes", peak)
+    REGISTRY.set("process_cpu_seconds_total", round(time.process_time(), 3))
+    return REGISTRY.render()
@@ -2,11 +2,26 @@
 mapping_loader.py
 -----------------
 קורא את error_code_mapping_v2.xlsx ומחזיר lookup structures לשאר המודולים.
+
+load_mapping_cached — מטמון לפי SHA-256 של תוכן הקובץ:
+  1. LRU בזיכרון התהליך (MAPPING_CACHE_SIZE קבצים)
+  2. אופציונלי: pickle בתיקייה מקומית (cache_dir) — שורד restart של ה-worker
+  3. miss → load_mapping רגיל (openpyxl)
 """
 
 import io
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
 import pandas as pd
 
+log = logging.getLogger(__name__)
+
 
 # שמות גיליונות
 SHEET_ERRORS       = "קודי שגיאה"
@@ -55,6 +70,13 @@ DEFAULT_FUND_MAP = {
 
 PENSION_FUND_PRODUCT_CODE = None  # stub — לא בשימוש (הוחלף ב-DEFAULT_FUND_MAP)
 
+# מטמון mapping מקומפל (load_mapping_cached)
+MAPPING_CACHE_SIZE    = 8
+_MAPPING_CACHE_FORMAT = 1   # להעלות כשמבנה ה-dict של load_mapping משתנה — מבטל pickles ישנים
+
+_mapping_cache      = OrderedDict()   # sha256 → mapping
+_mapping_cache_lock = threading.Lock()
+
 
 def _clean(val):
     """מחזיר string נקי, או None אם ריק/NaN."""
@@ -96,6 +118,85 @@ def load_mapping(mapping_source):
     }
 
 
+def load_mapping_cached(mapping_bytes, cache_dir=None):
+    """
+    כמו load_mapping, עם מטמון לפי hash של תוכן הקובץ.
+
+    mapping_bytes : תוכן קובץ ה-XLSX (bytes)
+    cache_dir     : תיקייה לשמירת pickle (optional). None → זיכרון בלבד
+
+    ה-mapping המוחזר משותף בין ריצות — אסור לשנות אותו במקום.
+
+    מחזיר (mapping, info):
+      info = {"sha256": str, "cache": "memory" | "disk" | "miss", "seconds": float}
+    """
+    t0     = time.time()
+    digest = hashlib.sha256(mapping_bytes).hexdigest()
+
+    with _mapping_cache_lock:
+        mapping = _mapping_cache.get(digest)
+        if mapping is not None:
+            _mapping_cache.move_to_end(digest)
+    source = "memory"
+
+    if mapping is None and cache_dir:
+        mapping = _read_pickle(_pickle_path(cache_dir, digest))
+        source  = "disk"
+
+    if mapping is None:
+        mapping = load_mapping(mapping_bytes)
+        source  = "miss"
+        if cache_dir:
+            _write_pickle(_pickle_path(cache_dir, digest), mapping)
+
+    if source != "memory":
+        with _mapping_cache_lock:
+            _mapping_cache[digest] = mapping
+            _mapping_cache.move_to_end(digest)
+            while len(_mapping_cache) > MAPPING_CACHE_SIZE:
+                _mapping_cache.popitem(last=False)
+
+    return mapping, {
+        "sha256":  digest,
+        "cache":   source,
+        "seconds": round(time.time() - t0, 3),
+    }
+
+
+def clear_mapping_cache():
+    """מרוקן את מטמון הזיכרון (לבדיקות / אחרי עדכון קוד הטעינה)."""
+    with _mapping_cache_lock:
+        _mapping_cache.clear()
+
+
+def _pickle_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"mapping_v{_MAPPING_CACHE_FORMAT}_{digest}.pkl")
+
+
+def _read_pickle(path):
+    """קורא mapping מ-pickle מקומי. None אם לא קיים או פגום."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        log.warning(f"mapping cache פגום ({path}): {e}")
+        return None
+
+
+def _write_pickle(path, mapping):
+    """כתיבה אטומית (tmp + rename) — כשל בכתיבה לא מפיל את הריצה."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(mapping, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning(f"שמירת mapping cache נכשלה ({path}): {e}")
+
+
 def _load_error_codes(xl):
     df = xl.parse(SHEET_ERRORS, dtype=str)
     df.columns = df.columns.str.strip()
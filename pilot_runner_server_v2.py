@@ -6,12 +6,15 @@ Flask server — engine v2.
 Endpoints:
   GET  /health             — בריאות השרת
   POST /run-pilot/from-api-v2 — pipeline מלא: fetch → classify → group → build → send → payload
+                                (background=true → מחזיר job_id מיד, הריצה ברקע)
+  GET  /jobs/<job_id>      — סטטוס / שלבים / תוצאה של job ברקע
+  GET  /metrics            — מדידות שלבים (זמן, CPU, זיכרון, רשומות) בפורמט Prometheus
 
-Auth: X-API-Key header (env var API_SECRET_KEY)
+Auth: X-API-Key header (env var API_SECRET_KEY) — כל ה-endpoints חוץ מ-/health;
+      /metrics פתוח רק אם METRICS_PUBLIC=true
 """
 
 import os
-import io
 import base64
 import json
 import sys
@@ -21,8 +24,7 @@ import logging
 from datetime import datetime
 from pathlib import Path
 
-import requests
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 
 # =============================================================================
 # Logging — stdout עם timestamps (נקרא ב-Cloud Run Logs)
@@ -40,16 +42,28 @@ APP_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(APP_DIR))
 
 # engine v2 modules
-from mapping_loader    import load_mapping
-from record_classifier import classify_all, apply_employer_max_counter_routing, apply_cross_error_inheritance
+from record_fetcher    import fetch_all_managers, stream_all_managers, FetchError
+from mapping_loader    import load_mapping_cached
+from record_classifier import classify_all, apply_post_routing, CLASSIFY_ENGINES
 from record_grouper    import group_records, summarize_groups
-from email_builder     import build_all_emails
+from email_builder     import build_all_emails, iter_emails
 from gmail_sender      import send_all_groups, summarize_results, send_dev_report
+from draft_journal     import DraftJournal, journal_path, DEFAULT_JOURNAL_PATH
+from status_submitter  import submit_chunks, failed_chunks
 from payload_builder   import build_payload, summarize_payload
-from report_builder    import build_run_report, build_case_manager_reports
+from report_builder    import build_run_report, build_case_manager_reports, summarize_run
+from pipeline_jobs     import PipelineJobs, DEFAULT_JOB_WORKERS, DEFAULT_JOB_KEEP
+from instrumentation   import (StageRecorder, REGISTRY, render_metrics,
+                               record_fetch_stats, record_gmail_stats, record_submit_report)
 
 app = Flask(__name__)
 
+# jobs ברקע — ה-worker היחיד של gunicorn נשאר פנוי ל-/health ולהגשות נוספות
+_jobs = PipelineJobs(
+    max_workers=int(os.environ.get("PIPELINE_JOB_WORKERS", DEFAULT_JOB_WORKERS)),
+    keep=int(os.environ.get("PIPELINE_JOB_KEEP", DEFAULT_JOB_KEEP)),
+)
+
 
 # =============================================================================
 # Helpers
@@ -111,44 +125,6 @@ def _check_api_key():
     return None
 
 
-def _fetch_david_records(api_base, access_token, start_date, top, acct_mgr,
-                         max_retries=3, retry_delay=15):
-    """קורא GetFeedbackData מ-API של דוד. מחזיר list. מנסה עד max_retries פעמים."""
-    body = {"StartDate": start_date, "top": int(top)}
-    if acct_mgr:
-        body["AccountManagerEmail"] = acct_mgr
-
-    last_exc = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            if attempt > 1:
-                log.warning(f"  retry {attempt}/{max_retries} עבור {acct_mgr or 'all'} (ממתין {retry_delay}s)")
-                time.sleep(retry_delay)
-
-            resp = requests.post(
-                f"{api_base}/services/AutomationFeedback/GetFeedbackData",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type":  "application/json",
-                },
-                json=body,
-                timeout=300,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            if not isinstance(data, list):
-                raise ValueError("תגובת API של דוד אינה JSON array")
-            if attempt > 1:
-                log.info(f"  הצליח בניסיון {attempt}")
-            return data
-
-        except Exception as e:
-            last_exc = e
-            log.warning(f"  ניסיון {attempt}/{max_retries} נכשל: {e}")
-
-    raise last_exc
-
-
 # =============================================================================
 # Endpoints
 # =============================================================================
@@ -158,6 +134,19 @@ def health():
     return jsonify({"ok": True, "version": "v2", "time": datetime.utcnow().isoformat() + "Z"})
 
 
+@app.get("/metrics")
+def metrics():
+    """
+    מדידות השלבים (מצטבר לאורך חיי ה-process) בפורמט Prometheus text.
+    דורש X-API-Key כמו שאר ה-endpoints; METRICS_PUBLIC=true פותח אותו ל-scraper בלי headers.
+    """
+    if os.environ.get("METRICS_PUBLIC", "").strip().lower() != "true":
+        err = _check_api_key()
+        if err:
+            return err
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
 @app.post("/run-pilot/from-api-v2")
 def run_pilot_from_api_v2():
     """
@@ -170,6 +159,26 @@ def run_pilot_from_api_v2():
       start_date            : (optional) ברירת מחדל 2022-01-01
       top                   : (optional) מקסימום רשומות, ברירת מחדל 10000
       account_manager_email : (optional) פילטר + כתובת מנהלת תיק
+      fetch_workers         : (optional) מקבילות שליפה בין מנהלות, ברירת מחדל 4
+      page_size             : (optional) גודל עמוד ב-GetFeedbackData, 0 = ללא דפדוף (ברירת מחדל)
+      stream                : (optional) "true" → פענוח JSON הדרגתי + classify תוך כדי הורדה
+      classify_engine       : (optional) "rows" (ברירת מחדל) / "columnar" — מנוע הסיווג, פלט זהה
+      classify_processes    : (optional) >1 → סיווג ב-process pool (chunks), 0 = באותו process (ברירת מחדל)
+      report_processes      : (optional) >1 → דוחות מנהלות התיק נבנים ב-process pool, 0 = באותו process (ברירת מחדל)
+      build_processes       : (optional) >1 → המיילים נבנים ב-process pool (chunks) ויצירת ה-drafts מתחילה
+                              תוך כדי הבנייה (pipeline), 0 = בנייה מלאה ואז שליחה (ברירת מחדל)
+      gmail_batch_size      : (optional) >0 → יצירת drafts ב-batch HTTP לפי תיבה (עד 100), 0 = בקשה לכל draft
+      run_id                : (optional) מזהה ריצה — מפעיל יומן drafts (DRAFT_JOURNAL_PATH); ריצה חוזרת
+                              עם אותו run_id יוצרת רק drafts חסרים וממחזרת את ה-draft_id הקיימים
+                              (ברירת המחדל /tmp — באותו instance בלבד; ראה draft_journal)
+      submit_status         : (optional) "true" → ה-runner שולח את ה-chunks ל-SetFeedbackStatusBatch בעצמו;
+                              update_payload / update_chunks מכילים אז רק את ה-chunks שנכשלו סופית,
+                              ו-rejected את הרשומות שהשרת דחה (success=false)
+      submit_workers        : (optional) מקבילות השליחה ל-SetFeedbackStatusBatch, ברירת מחדל 4
+      background            : (optional) "true" → ה-pipeline רץ ב-executor ברקע; התגובה מיידית (202):
+                              {"ok": true, "job_id": str, "status_url": "/jobs/<job_id>"}
+                              והפלט שלהלן מתקבל ב-GET /jobs/<job_id> תחת "result".
+                              מצב ה-job בזיכרון ה-instance בלבד — restart מוחק אותו (ראה pipeline_jobs)
 
     פלט (JSON):
     {
@@ -184,36 +193,208 @@ def run_pilot_from_api_v2():
             "emails_fail":int,
             "payload_total": int,
             "payload_chunks": int,
+            "fetch":      {"seconds": float, "managers": {mgr: {...}}},
+            "mapping":    {"sha256": str, "cache": "memory" | "disk" | "miss", "seconds": float},
+            "classify_engine": "rows" | "columnar",
+            "classify_processes": int,
+            "build":      {"processes", "built", "skipped", "seconds"}  (seconds = זמן הבנייה עצמה; עם build_processes>1
+                           הבנייה חופפת לשליחה והשלב ב-stages הוא "build+send"),
+            "run_id":     str | None,
+            "gmail":      {"drafts", "ok", "failed", "seconds", "drafts_per_second", "services_built", "journal_hits",
+                           "http_requests", "batches", "fallbacks", "throttled", "retries", "retry_reasons", "mailboxes": {...}},
+            "summary":    {"fetched", "treated", "skipped", "top", "truncation_warning", "skip_reasons", "formats",
+                           "weeks", "weeks_by_side", "case_managers", "top_employers"}  (טבלאות הדשבורד — summarize_run; null אם החישוב נכשל),
+            "stages":     [ {"stage", "seconds", "cpu_seconds", "rss_peak_delta_mb", "rss_delta_mb",
+                             "records_in", "records_out"}, ... ],
         },
         "send_results":   [ SendResult, ... ],
         "update_payload": [ {MISPAR_MEZAHE_RESHUMA, Responsibility, EmailDraftId}, ... ],
         "update_chunks":  [ [chunk], ... ],
+        "rejected":       [ {MISPAR_MEZAHE_RESHUMA, Responsibility, EmailDraftId}, ... ],   # submit_status בלבד
+        "status_submit":  None | {"chunks", "ok_chunks", "records", "attempts", "seconds",
+                                  "failed_chunks": [...], "record_failures": [...], "rejected": [...]},
     }
     """
-    run_start = time.time()
-    log.info("=== pipeline v2 התחיל ===")
-
-    # --- auth ---
     err = _check_api_key()
     if err:
         return err
 
-    # --- קלט ---
-    access_token = request.form.get("access_token", "").strip().lstrip("=")
-    api_base      = request.form.get("api_base", "").strip().lstrip("=")
-    if not access_token or not api_base:
-        return jsonify({"ok": False, "message": "חסרים שדות access_token ו/או api_base"}), 400
-
-    start_date    = request.form.get("start_date", "2022-01-01").strip().lstrip("=")
-    top           = request.form.get("top", "10000").strip().lstrip("=")
-    acct_mgr_raw  = request.form.get("account_manager_email", "").strip().lstrip("=")
-    acct_mgr_list = [m.strip() for m in acct_mgr_raw.split(",") if m.strip()]
-    dry_run         = request.form.get("dry_run", "false").strip().lower() == "true"
-    dev_impersonate = request.form.get("dev_impersonate", "").strip()
+    params, err_msg = _read_form(request.form)
+    if err_msg:
+        return jsonify({"ok": False, "message": err_msg}), 400
 
     mapping_file = request.files.get("mapping")
     if mapping_file is None:
         return jsonify({"ok": False, "message": "חסר קובץ mapping בבקשה"}), 400
+    mapping_bytes = mapping_file.read()
+
+    if params["background"]:
+        job_id = _jobs.submit(
+            lambda recorder: run_pipeline_v2(params, mapping_bytes, recorder),
+            meta={"managers": params["acct_mgr_list"], "run_id": params["run_id"], "dry_run": params["dry_run"]},
+        )
+        return jsonify({"ok": True, "job_id": job_id, "status_url": f"/jobs/{job_id}"}), 202
+
+    body, status = run_pipeline_v2(params, mapping_bytes)
+    return jsonify(body), status
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id):
+    """
+    סטטוס של job ברקע (POST /run-pilot/from-api-v2 עם background=true).
+
+    פלט (JSON):
+    {
+        "job_id", "status": "queued" | "running" | "done" | "failed",
+        "stage":         str | None,          # השלב שרץ כרגע
+        "stage_seconds": float | None,        # כמה זמן השלב הנוכחי רץ
+        "stages":        [ {"stage", "seconds", "cpu_seconds", "rss_peak_delta_mb", ...}, ... ],   # שלבים שהסתיימו
+        "submitted_at", "started_at", "finished_at", "seconds",
+        "http_status":   int | None,          # הסטטוס שהריצה הסינכרונית הייתה מחזירה
+        "error":         str | None,          # חריגה לא צפויה
+        "result":        dict | None,         # גוף התגובה של ה-pipeline, בסיום
+    }
+    404 — job לא קיים: מזהה שגוי, נמחק (keep), או שה-instance עבר restart (ה-jobs בזיכרון בלבד).
+    """
+    err = _check_api_key()
+    if err:
+        return err
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"ok": False, "message": f"job לא קיים: {job_id}"}), 404
+    return jsonify(job)
+
+
+# =============================================================================
+# Pipeline
+# =============================================================================
+
+def _form_str(form, name, default=""):
+    """שדה טקסט מהטופס — בלי רווחים ו-"=" מובילים (n8n שולח לפעמים "=value")."""
+    return form.get(name, default).strip().lstrip("=").strip()
+
+
+def _form_bool(form, name):
+    """שדה בוליאני — "true" (גם "=true") → True, כל ערך אחר → False."""
+    return _form_str(form, name, "false").lower() == "true"
+
+
+def _form_int(form, name, default):
+    """שדה מספרי — מחזיר (ערך, None) או (None, הודעת שגיאה). ריק → default; שלילי או לא-מספר → שגיאה."""
+    raw = _form_str(form, name)
+    if not raw:
+        return default, None
+    try:
+        value = int(raw)
+    except ValueError:
+        return None, f"{name} must be an integer"
+    if value < 0:
+        return None, f"{name} must be a non-negative integer"
+    return value, None
+
+
+# שם הפרמטר ב-params → (שדה הטופס, ברירת מחדל)
+_INT_FIELDS = {
+    "fetch_workers":  ("fetch_workers",      4),
+    "page_size":      ("page_size",          0),
+    "classify_procs": ("classify_processes", 0),
+    "report_procs":   ("report_processes",   0),
+    "build_procs":    ("build_processes",    0),
+    "gmail_batch":    ("gmail_batch_size",   0),
+    "submit_workers": ("submit_workers",     4),
+}
+
+
+def _read_form(form):
+    """קורא ומנרמל את שדות הטופס. מחזיר (params, None) או (None, הודעת שגיאה)."""
+    access_token = _form_str(form, "access_token")
+    api_base     = _form_str(form, "api_base")
+    if not access_token or not api_base:
+        return None, "חסרים שדות access_token ו/או api_base"
+
+    engine = _form_str(form, "classify_engine", "rows").lower() or "rows"
+    if engine not in CLASSIFY_ENGINES:
+        return None, f"classify_engine לא מוכר: {engine}"
+
+    acct_mgr_raw = _form_str(form, "account_manager_email")
+    params = {
+        "access_token":    access_token,
+        "api_base":        api_base,
+        "start_date":      _form_str(form, "start_date", "2022-01-01"),
+        "top":             _form_str(form, "top", "10000"),
+        "acct_mgr_list":   [m.strip() for m in acct_mgr_raw.split(",") if m.strip()],
+        "stream":          _form_bool(form, "stream"),
+        "engine":          engine,
+        "run_id":          _form_str(form, "run_id") or None,
+        "submit_status":   _form_bool(form, "submit_status"),
+        "dry_run":         _form_bool(form, "dry_run"),
+        "dev_impersonate": _form_str(form, "dev_impersonate"),
+        "background":      _form_bool(form, "background"),
+    }
+    for key, (field, default) in _INT_FIELDS.items():
+        params[key], err = _form_int(form, field, default)
+        if err:
+            return None, err
+    return params, None
+
+
+def _dev_emails(email_results, dev_impersonate):
+    """DEV mode: [DEV] בתחילת ה-subject + תיבת impersonate אחת (אם צוינה). רשימה נשארת רשימה."""
+    def _mark(content):
+        if content:
+            content["subject"] = f"[DEV] {content['subject']}"
+            if dev_impersonate:
+                content["account_manager_email"] = dev_impersonate
+        return content
+
+    marked = ((g, _mark(content)) for g, content in email_results)
+    return list(marked) if isinstance(email_results, list) else marked
+
+
+def run_pipeline_v2(params, mapping_bytes, recorder=None):
+    """
+    מריץ את ה-pipeline המלא (mapping → fetch → classify → ... → report).
+    params : פלט _read_form;  mapping_bytes : תוכן קובץ ה-mapping.
+    recorder : StageRecorder (אופציונלי) — מדידות לכל שלב; ב-job ברקע הוא גם ה-progress של GET /jobs/<id>.
+    מחזיר (body, http_status) — body הוא גוף ה-JSON של run_pilot_from_api_v2;
+    stats["stages"] מכיל את מדידות השלבים.
+    """
+    recorder = recorder or StageRecorder()
+    t0 = time.perf_counter()
+    try:
+        body, status = _run_pipeline(params, mapping_bytes, recorder)
+    finally:
+        recorder.finish()
+    REGISTRY.inc("pipeline_runs_total", 1, outcome="ok" if status < 400 else "error")
+    REGISTRY.inc("pipeline_run_seconds_total", round(time.perf_counter() - t0, 3))
+    if "stats" in body:
+        body["stats"]["stages"] = recorder.stages()
+    return body, status
+
+
+def _run_pipeline(params, mapping_bytes, recorder):
+    run_start = time.time()
+    log.info("=== pipeline v2 התחיל ===")
+
+    access_token    = params["access_token"]
+    api_base        = params["api_base"]
+    start_date      = params["start_date"]
+    top             = params["top"]
+    acct_mgr_list   = params["acct_mgr_list"]
+    fetch_workers   = params["fetch_workers"]
+    page_size       = params["page_size"]
+    stream          = params["stream"]
+    engine          = params["engine"]
+    classify_procs  = params["classify_procs"]
+    report_procs    = params["report_procs"]
+    build_procs     = params["build_procs"]
+    gmail_batch     = params["gmail_batch"]
+    run_id          = params["run_id"]
+    submit_status   = params["submit_status"]
+    submit_workers  = params["submit_workers"]
+    dry_run         = params["dry_run"]
+    dev_impersonate = params["dev_impersonate"]
 
     service_account_info = _load_service_account()
     alert_sender = acct_mgr_list[0] if acct_mgr_list else None
@@ -222,63 +403,101 @@ def run_pilot_from_api_v2():
         log.error(f"[FAIL] {step}: {err_msg}")
         _send_failure_alert(step, err_msg, service_account_info, sender=alert_sender)
 
-    # --- שלב 1: fetch ---
-    log.info(f"שלב 1: fetch — managers={acct_mgr_list}, start_date={start_date}, top={top}")
+    # --- שלב 1: load mapping (לפני fetch — נדרש ל-classify תוך כדי streaming) ---
+    recorder.stage("mapping")
+    log.info("שלב 1: טעינת mapping")
     t0 = time.time()
     try:
-        if acct_mgr_list:
-            merged = {}
-            for mgr in acct_mgr_list:
-                log.info(f"  קורא GetFeedbackData עבור {mgr}")
-                recs = _fetch_david_records(api_base, access_token, start_date, top, mgr)
-                log.info(f"  {mgr} → {len(recs)} רשומות")
-                for r in recs:
-                    rid = r.get("MISPAR_MEZAHE_RESHUMA")
-                    if rid:
-                        merged[rid] = r
-            records_list = list(merged.values())
-        else:
-            records_list = _fetch_david_records(api_base, access_token, start_date, top, "")
-    except Exception as e:
-        err_msg = f"{e}\n{traceback.format_exc()}"
-        _alert("fetch מ-API של דוד", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בקריאת API של דוד: {e}"}), 502
-
-    fetched = len(records_list)
-    log.info(f"שלב 1 הסתיים: fetched={fetched} ({time.time()-t0:.1f}s)")
-
-    # --- שלב 2: load mapping ---
-    log.info("שלב 2: טעינת mapping")
-    t0 = time.time()
-    try:
-        mapping = load_mapping(io.BytesIO(mapping_file.read()))
+        mapping, mapping_stats = load_mapping_cached(
+            mapping_bytes,
+            cache_dir=os.environ.get("MAPPING_CACHE_DIR") or None,
+        )
     except Exception as e:
         err_msg = f"{e}\n{traceback.format_exc()}"
         _alert("טעינת mapping", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בטעינת mapping: {e}"}), 400
-    log.info(f"שלב 2 הסתיים ({time.time()-t0:.1f}s)")
+        return {"ok": False, "message": f"שגיאה בטעינת mapping: {e}"}, 400
+    log.info(f"שלב 1 הסתיים: cache={mapping_stats['cache']} ({time.time()-t0:.1f}s)")
+
+    if stream:
+        # --- שלב 2+3: fetch + classify בזרם אחד ---
+        recorder.stage("fetch+classify")
+        log.info(f"שלב 2+3: fetch+classify (streaming) — managers={acct_mgr_list}, start_date={start_date}, top={top}")
+        t0 = time.time()
+        records_list = []   # הפניות בלבד — נדרש לדו"ח pipeline
+        fetch_stats  = {}
+
+        def _tee(stream_iter):
+            for r in stream_iter:
+                records_list.append(r)
+                yield r
 
-    # --- שלב 3: classify ---
-    log.info("שלב 3: classify")
-    t0 = time.time()
-    try:
-        classified, skipped_list = classify_all(records_list, mapping)
-    except Exception as e:
-        err_msg = f"{e}\n{traceback.format_exc()}"
-        _alert("סיווג רשומות", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בסיווג רשומות: {e}"}), 500
-    log.info(f"שלב 3 הסתיים: classified={len(classified)} skipped={len(skipped_list)} ({time.time()-t0:.1f}s)")
-
-    # --- שלב 3.5: employer max-counter routing ---
+        try:
+            classified, skipped_list = classify_all(
+                _tee(stream_all_managers(api_base, access_token, start_date, top, acct_mgr_list,
+                                         max_workers=fetch_workers, stats=fetch_stats)),
+                mapping,
+                engine=engine,
+                processes=classify_procs,
+            )
+        except FetchError as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("fetch מ-API של דוד", err_msg)
+            return {"ok": False, "message": f"שגיאה בקריאת API של דוד: {e}"}, 502
+        except Exception as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("סיווג רשומות", err_msg)
+            return {"ok": False, "message": f"שגיאה בסיווג רשומות: {e}"}, 500
+        fetched = len(records_list)
+        recorder.records(in_=fetched, out=len(classified))
+        record_fetch_stats(fetch_stats)
+        log.info(f"שלב 2+3 הסתיים: fetched={fetched} classified={len(classified)} "
+                 f"skipped={len(skipped_list)} ({time.time()-t0:.1f}s)")
+    else:
+        # --- שלב 2: fetch ---
+        recorder.stage("fetch")
+        log.info(f"שלב 2: fetch — managers={acct_mgr_list}, start_date={start_date}, top={top}")
+        t0 = time.time()
+        try:
+            records_list, fetch_stats = fetch_all_managers(
+                api_base, access_token, start_date, top, acct_mgr_list,
+                max_workers=fetch_workers, page_size=page_size,
+            )
+        except Exception as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("fetch מ-API של דוד", err_msg)
+            return {"ok": False, "message": f"שגיאה בקריאת API של דוד: {e}"}, 502
+
+        fetched = len(records_list)
+        recorder.records(out=fetched)
+        record_fetch_stats(fetch_stats)
+        log.info(f"שלב 2 הסתיים: fetched={fetched} ({time.time()-t0:.1f}s)")
+
+        # --- שלב 3: classify ---
+        recorder.stage("classify", records_in=fetched)
+        log.info(f"שלב 3: classify — engine={engine}, processes={classify_procs}")
+        t0 = time.time()
+        try:
+            classified, skipped_list = classify_all(records_list, mapping, engine=engine,
+                                                    processes=classify_procs)
+        except Exception as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("סיווג רשומות", err_msg)
+            return {"ok": False, "message": f"שגיאה בסיווג רשומות: {e}"}, 500
+        recorder.records(out=len(classified))
+        log.info(f"שלב 3 הסתיים: classified={len(classified)} skipped={len(skipped_list)} ({time.time()-t0:.1f}s)")
+
+    recorder.stage("routing", records_in=len(classified))
+    # --- שלב 3.5: employer max-counter routing + cross-error inheritance (מעבר אחד) ---
     try:
-        classified = apply_employer_max_counter_routing(classified)
-        classified = apply_cross_error_inheritance(classified)
+        classified = apply_post_routing(classified)
     except Exception as e:
         err_msg = f"{e}\n{traceback.format_exc()}"
         _alert("employer max-counter routing", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה ב-employer routing override: {e}"}), 500
+        return {"ok": False, "message": f"שגיאה ב-employer routing override: {e}"}, 500
+    recorder.records(out=len(classified))
 
     # --- שלב 4: group ---
+    recorder.stage("group", records_in=len(classified))
     log.info("שלב 4: group")
     t0 = time.time()
     try:
@@ -286,54 +505,92 @@ def run_pilot_from_api_v2():
     except Exception as e:
         err_msg = f"{e}\n{traceback.format_exc()}"
         _alert("קיבוץ רשומות", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בקיבוץ: {e}"}), 500
+        return {"ok": False, "message": f"שגיאה בקיבוץ: {e}"}, 500
+    recorder.records(out=len(groups))
     log.info(f"שלב 4 הסתיים: groups={len(groups)} ({time.time()-t0:.1f}s)")
 
     # --- שלב 5: build emails ---
     log.info("שלב 5: build emails")
     t0 = time.time()
-    try:
-        email_results, build_skipped = build_all_emails(groups, mapping)
-    except Exception as e:
-        err_msg = f"{e}\n{traceback.format_exc()}"
-        _alert("בניית מיילים", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בבניית מיילים: {e}"}), 500
-    log.info(f"שלב 5 הסתיים ({time.time()-t0:.1f}s)")
+    build_stats = {}
+    if build_procs > 1:
+        # pipeline: generator — המיילים נבנים ב-process pool בזמן ש-send_all_groups יוצר drafts,
+        # ולכן שלב אחד "build+send"; זמן הבנייה עצמה ב-stats["build"]
+        recorder.stage("build+send", records_in=len(groups))
+        email_results = iter_emails(groups, mapping, processes=build_procs, stats=build_stats)
+        send_in = len(groups)
+        log.info(f"שלב 5: בנייה ב-{build_procs} processes, צורכים תוך כדי שלב 6")
+    else:
+        recorder.stage("build", records_in=len(groups))
+        try:
+            email_results, _ = build_all_emails(groups, mapping, stats=build_stats)
+        except Exception as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("בניית מיילים", err_msg)
+            return {"ok": False, "message": f"שגיאה בבניית מיילים: {e}"}, 500
+        send_in = build_stats["built"]
+        recorder.records(out=send_in)
+        log.info(f"שלב 5 הסתיים ({time.time()-t0:.1f}s)")
 
     # --- DEV mode: prefix subjects with [DEV] + override impersonation ---
     if dry_run:
-        for _, content in email_results:
-            if content:
-                content["subject"] = f"[DEV] {content['subject']}"
-                if dev_impersonate:
-                    content["account_manager_email"] = dev_impersonate
-        log.info(f"[DEV] prefix [DEV] הוחל | impersonate → {dev_impersonate or 'כל מנהלת בנפרד'}")
+        email_results = _dev_emails(email_results, dev_impersonate)
+        log.info(f"[DEV] prefix [DEV] מוחל | impersonate → {dev_impersonate or 'כל מנהלת בנפרד'}")
 
     # --- שלב 6: send / create drafts ---
+    if build_procs <= 1:
+        recorder.stage("send", records_in=send_in)
     log.info("שלב 6: יצירת drafts ב-Gmail")
     t0 = time.time()
     default_impersonate = os.environ.get("TEST_GMAIL_IMPERSONATE", acct_mgr_list[0] if acct_mgr_list else "")
+    gmail_stats = {}
+    journal     = None
     try:
+        if run_id and service_account_info:
+            if journal_path() == DEFAULT_JOURNAL_PATH:
+                log.warning("יומן ה-drafts ב-%s — מגן רק באותו instance; DRAFT_JOURNAL_PATH לא הוגדר",
+                            DEFAULT_JOURNAL_PATH)
+            journal = DraftJournal(journal_path(), run_id)
         send_results, send_skipped = send_all_groups(
             email_results,
             service_account_info,
             default_impersonate,
+            batch_size=gmail_batch,
+            journal=journal,
+            stats=gmail_stats,
         )
     except Exception as e:
         err_msg = f"{e}\n{traceback.format_exc()}"
         _alert("יצירת Gmail drafts", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה ביצירת drafts: {e}"}), 500
+        return {"ok": False, "message": f"שגיאה ביצירת drafts: {e}"}, 500
+    finally:
+        if journal is not None:
+            journal.close()
+    build_summary = {
+        "processes": build_procs,
+        "built":     build_stats.get("built", 0),
+        "skipped":   build_stats.get("skipped", 0),
+        "seconds":   round(build_stats.get("seconds", 0.0), 3),
+    }
+    if build_procs > 1:
+        log.info(f"שלב 5 (pipeline): {build_summary['built']} מיילים נבנו, {build_summary['skipped']} קבוצות "
+                 f"דולגו ({build_summary['seconds']:.1f}s בנייה ב-workers)")
 
     gmail_summary = summarize_results(send_results)
-    log.info(f"שלב 6 הסתיים: {gmail_summary} ({time.time()-t0:.1f}s)")
+    recorder.records(out=gmail_summary["ok"])
+    record_gmail_stats(gmail_stats)
+    log.info(f"שלב 6 הסתיים: {gmail_summary} — {gmail_stats.get('drafts_per_second')} drafts/s ({time.time()-t0:.1f}s)")
 
     # --- DEV mode: סיום מוקדם — לא מעדכנים SetFeedbackStatus ---
     if dry_run:
         dev_mailbox = dev_impersonate or "תיבות מנהלות תיקים"
 
         # בניית דו"ח ריצה ושליחה למייל
+        recorder.stage("report", records_in=len(groups))
         run_dt = datetime.utcnow()
+        run_summary = None
         try:
+            run_summary = summarize_run(groups, skipped_list, top=top)
             truncation_warning = len(records_list) >= int(int(top) * 0.75)
             report_bytes = build_run_report(
                 groups, send_results,
@@ -341,6 +598,7 @@ def run_pilot_from_api_v2():
                 raw_records=records_list,
                 run_date=run_dt,
                 top=top,
+                summary=run_summary,
             )
             if dev_impersonate and service_account_info:
                 sent_ok = send_dev_report(
@@ -357,13 +615,15 @@ def run_pilot_from_api_v2():
 
         # דוחות למנהלות תיק
         try:
-            cm_reports = build_case_manager_reports(groups, send_results, skipped_records=skipped_list, run_date=run_dt)
+            cm_reports = build_case_manager_reports(groups, send_results, skipped_records=skipped_list, run_date=run_dt,
+                                                    processes=report_procs)
         except Exception as _e:
             log.warning(f"[DEV] בניית דוחות CM נכשלה: {_e}")
             cm_reports = []
+        recorder.records(out=len(cm_reports))
 
         log.info(f"=== [DEV] pipeline הסתיים — {gmail_summary['ok']} drafts נוצרו ב-{dev_mailbox}. SetFeedbackStatus לא עודכן. ===")
-        return jsonify({
+        return {
             "ok":      True,
             "message": f"[DEV] pipeline הסתיים — {gmail_summary['ok']} drafts נוצרו ב-{dev_mailbox}. SetFeedbackStatus לא עודכן.",
             "dry_run": True,
@@ -374,12 +634,21 @@ def run_pilot_from_api_v2():
                 "groups":        len(groups),
                 "emails_ok":     gmail_summary["ok"],
                 "emails_fail":   gmail_summary["failed"],
+                "fetch":         fetch_stats,
+                "mapping":       mapping_stats,
+                "classify_engine": engine,
+                "classify_processes": classify_procs,
+                "build":         build_summary,
+                "run_id":        run_id,
+                "gmail":         gmail_stats,
+                "summary":       run_summary,
                 "total_seconds": round(time.time() - run_start, 1),
             },
             "cm_reports": cm_reports,
-        })
+        }, 200
 
     # --- שלב 7: build payload ---
+    recorder.stage("payload", records_in=len(send_results))
     log.info("שלב 7: build payload")
     t0 = time.time()
     try:
@@ -387,14 +656,43 @@ def run_pilot_from_api_v2():
     except Exception as e:
         err_msg = f"{e}\n{traceback.format_exc()}"
         _alert("בניית payload", err_msg)
-        return jsonify({"ok": False, "message": f"שגיאה בבניית payload: {e}"}), 500
+        return {"ok": False, "message": f"שגיאה בבניית payload: {e}"}, 500
+    recorder.records(out=payload_result["total"])
     log.info(f"שלב 7 הסתיים: {summarize_payload(payload_result)} ({time.time()-t0:.1f}s)")
 
+    # --- שלב 8 (optional): SetFeedbackStatusBatch ישירות מה-runner ---
+    update_payload = payload_result["payload"]
+    update_chunks  = payload_result["chunks"]
+    submit_report  = None
+    rejected       = []
+    if submit_status:
+        recorder.stage("submit", records_in=len(update_payload))
+        log.info(f"שלב 8: SetFeedbackStatusBatch — {len(update_chunks)} chunks")
+        t0 = time.time()
+        try:
+            submit_report = submit_chunks(api_base, access_token, update_chunks, max_workers=submit_workers)
+        except Exception as e:
+            err_msg = f"{e}\n{traceback.format_exc()}"
+            _alert("SetFeedbackStatusBatch", err_msg)
+            return {"ok": False, "message": f"שגיאה בעדכון SetFeedbackStatusBatch: {e}"}, 502
+        # ל-caller נשארים רק ה-chunks שלא נקלטו
+        update_chunks  = failed_chunks(update_chunks, submit_report)
+        update_payload = [rec for chunk in update_chunks for rec in chunk]
+        rejected       = submit_report["rejected"]
+        recorder.records(out=submit_report["records"] - len(update_payload) - len(submit_report["record_failures"]))
+        record_submit_report(submit_report)
+        log.info(f"שלב 8 הסתיים: {submit_report['ok_chunks']}/{submit_report['chunks']} chunks, "
+                 f"{len(submit_report['record_failures'])} רשומות נדחו ({time.time()-t0:.1f}s)")
+
+    recorder.stage("report", records_in=len(groups))
     # --- דו"ח סיכום ---
     import base64 as _b64
     run_dt = datetime.utcnow()
+    run_summary = None
     try:
-        report_bytes = build_run_report(groups, send_results, skipped_records=skipped_list, raw_records=records_list, run_date=run_dt, top=top)
+        run_summary = summarize_run(groups, skipped_list, top=top)
+        report_bytes = build_run_report(groups, send_results, skipped_records=skipped_list, raw_records=records_list,
+                                        run_date=run_dt, top=top, summary=run_summary)
         report_b64 = _b64.b64encode(report_bytes).decode("utf-8")
     except Exception as e:
         log.warning(f"report build failed: {e}")
@@ -402,15 +700,17 @@ def run_pilot_from_api_v2():
 
     # --- דוחות למנהלות תיק ---
     try:
-        cm_reports = build_case_manager_reports(groups, send_results, skipped_records=skipped_list, run_date=run_dt)
+        cm_reports = build_case_manager_reports(groups, send_results, skipped_records=skipped_list, run_date=run_dt,
+                                                processes=report_procs)
     except Exception as e:
         log.warning(f"case manager reports failed: {e}")
         cm_reports = []
+    recorder.records(out=len(cm_reports))
 
     total_time = time.time() - run_start
     log.info(f"=== pipeline v2 הסתיים בהצלחה — {total_time:.1f}s כולל ===")
 
-    return jsonify({
+    return {
         "ok":      True,
         "message": "pipeline v2 הסתיים בהצלחה",
         "stats": {
@@ -422,14 +722,24 @@ def run_pilot_from_api_v2():
             "emails_fail":    gmail_summary["failed"],
             "payload_total":  payload_result["total"],
             "payload_chunks": len(payload_result["chunks"]),
+            "fetch":          fetch_stats,
+            "mapping":        mapping_stats,
+            "classify_engine": engine,
+            "classify_processes": classify_procs,
+            "build":          build_summary,
+            "run_id":         run_id,
+            "gmail":          gmail_stats,
+            "summary":        run_summary,
             "total_seconds":  round(total_time, 1),
         },
         "send_results":       send_results,
-        "update_payload":     payload_result["payload"],
-        "update_chunks":      payload_result["chunks"],
+        "update_payload":     update_payload,
+        "update_chunks":      update_chunks,
+        "rejected":           rejected,
+        "status_submit":      submit_report,
         "report_xlsx_b64":    report_b64,
         "cm_reports":         cm_reports,
-    })
+    }, 200
 
 
 # =============================================================================
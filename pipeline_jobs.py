@@ -0,0 +1,128 @@
+"""
+pipeline_jobs.py
+----------------
+ריצת pipeline ברקע — executor + רישום jobs בזיכרון ה-process.
+
+  - submit(fn) מחזיר job_id מיד; fn(progress) רץ ב-ThreadPoolExecutor ומחזיר (body, http_status)
+  - progress הוא StageRecorder (instrumentation) — progress.stage(name) מסמן תחילת שלב
+  - get(job_id) מחזיר snapshot: סטטוס, שלב נוכחי, מדידות לכל שלב, ותוצאה בסיום
+
+ה-jobs נשמרים בזיכרון בלבד (gunicorn -w 1) — restart / recycle של ה-instance מוחק אותם, כולל
+jobs שרצו באותו רגע (GET /jobs/<id> מחזיר אז 404). לכן ה-deploy מחייב:
+  --max-instances=1     — כל בקשות ה-/jobs מגיעות ל-instance שמחזיק את ה-job
+  --no-cpu-throttling   — ה-job רץ אחרי תגובת ה-202; בלי זה Cloud Run מקצה לו CPU רק בזמן בקשות
+נשמרים עד keep jobs שהסתיימו; הישנים ביותר נמחקים ראשונים.
+
+שימוש:
+  jobs = PipelineJobs()
+  job_id = jobs.submit(lambda progress: run_pipeline(params, mapping_bytes, progress))
+  jobs.get(job_id)   # {"job_id", "status", "stage", "stages", ..., "result"}
+"""
+
+import time
+import uuid
+import logging
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import StageRecorder
+
+log = logging.getLogger(__name__)
+
+# job אחד בכל פעם: ריצה מחזיקה את כל הרשומות בזיכרון (ועוד process pools לסיווג / בנייה / דוחות),
+# ושתי ריצות במקביל על instance יחיד מכפילות את שיא ה-RSS. jobs נוספים ממתינים ב-queued.
+DEFAULT_JOB_WORKERS = 1
+DEFAULT_JOB_KEEP    = 20
+
+# סטטוסים של job
+QUEUED  = "queued"
+RUNNING = "running"
+DONE    = "done"
+FAILED  = "failed"
+
+
+def _now():
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+class PipelineJobs:
+    """executor + jobs לפי job_id (uuid4 hex)."""
+
+    def __init__(self, max_workers=DEFAULT_JOB_WORKERS, keep=DEFAULT_JOB_KEEP):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="pipeline-job")
+        self._keep     = max(1, int(keep))
+        self._lock     = threading.Lock()
+        self._jobs     = {}   # job_id → dict (סדר הכנסה = סדר הגשה)
+
+    def submit(self, fn, meta=None):
+        """מגיש fn(progress) → (body, http_status) לריצה ברקע. מחזיר job_id."""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id":       job_id,
+            "status":       QUEUED,
+            "meta":         dict(meta or {}),
+            "submitted_at": _now(),
+            "started_at":   None,
+            "finished_at":  None,
+            "seconds":      None,
+            "http_status":  None,
+            "error":        None,
+            "result":       None,
+            "_progress":    StageRecorder(),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, fn)
+        log.info(f"job {job_id} הוגש")
+        return job_id
+
+    def get(self, job_id):
+        """snapshot של job (dict חדש), או None אם לא קיים / נמחק."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snap = {k: v for k, v in job.items() if not k.startswith("_")}
+            progress = job["_progress"]
+        stage, stages, stage_seconds = progress.snapshot()
+        snap["stage"]         = stage
+        snap["stage_seconds"] = stage_seconds
+        snap["stages"]        = stages
+        return snap
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, fn):
+        progress = job["_progress"]
+        t0 = time.perf_counter()
+        with self._lock:
+            job["status"], job["started_at"] = RUNNING, _now()
+        try:
+            body, http_status = fn(progress)
+            status, error = (DONE if http_status < 400 else FAILED), None
+        except Exception as e:
+            log.error(f"job {job['job_id']} נכשל: {e}\n{traceback.format_exc()}")
+            body, http_status = None, 500
+            status, error = FAILED, str(e)
+        progress.finish()
+        with self._lock:
+            job.update(
+                status=status,
+                finished_at=_now(),
+                seconds=round(time.perf_counter() - t0, 1),
+                http_status=http_status,
+                error=error,
+                result=body,
+            )
+            self._evict()
+        log.info(f"job {job['job_id']} הסתיים: {status} ({job['seconds']}s)")
+
+    def _evict(self):
+        """מוחק jobs שהסתיימו מעבר ל-keep (הישנים קודם). jobs פעילים לא נמחקים."""
+        finished = [jid for jid, j in self._jobs.items() if j["status"] in (DONE, FAILED)]
+        for jid in finished[:max(0, len(finished) - self._keep)]:
+            del self._jobs[jid]
@@ -13,6 +13,12 @@ record_classifier.py
        3. Default (fallback אחרון)
 """
 
+import gc
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain, islice
+
 import pandas as pd
 from mapping_loader import (
     FORMAT_EXCLUDED, FORMAT_CASE_MGR, FORMAT_MOSADI_3,
@@ -369,6 +375,22 @@ def apply_cross_error_inheritance(classified_records):
 
     return classified_records
 
+@contextmanager
+def _gc_paused():
+    """
+    משבית את ה-GC המחזורי בזמן מעבר שמקצה עשרות אלפי dicts / tuples שנשארים חיים.
+    בלי זה כל כמה אלפי הקצאות נסרק גם gen2 — כולל כל הרשומות הגולמיות החיות — בלי
+    שיש מעגלים לשחרר. ביציאה ה-GC חוזר למצב הקודם.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
 def _infer_format_from_role(role, default_format):
     if role in ('רו"ח', "סוכן", "מעסיק", "איש קשר 1 מעסיק"):
         from mapping_loader import FORMAT_EMPLOYER
@@ -420,11 +442,38 @@ def _build_result(record, record_id, customer, error_code, counter,
         "pre_mail_condition_field":  condition_field,
         "pre_mail_condition_value":  _get(record, condition_field) if condition_field else None,
         "counter_weeks":    escalation_level,
-        "_raw": dict(record),
+        "_raw": record,   # הפניה לרשומה המקורית (לא עותק) — לקריאה בלבד
     }
 
 
-def classify_all(records, mapping):
+CLASSIFY_ENGINES     = ("rows", "columnar")
+CLASSIFY_CHUNK_SIZE  = 2000   # רשומות לכל משימה ב-process pool
+
+
+def classify_all(records, mapping, engine="rows", processes=0, chunk_size=CLASSIFY_CHUNK_SIZE):
+    """
+    מסווג את כל הרשומות. מחזיר (classified, skipped).
+
+    engine     : "rows"     — classify_record לכל רשומה (ברירת מחדל)
+                 "columnar" — columnar_classifier: אותו פלט, מחושב כ-masks על עמודות
+    processes  : >1 → סיווג ב-ProcessPoolExecutor בחלוקה ל-chunks של chunk_size רשומות.
+                 ה-mapping נשלח פעם אחת לכל worker, והתוצאות מורכבות מחדש לפי סדר הקלט.
+                 records נקרא chunk אחרי chunk — כשהוא generator (stream) הסיווג רץ תוך כדי ההורדה.
+                 קלט שנכנס ב-chunk אחד מסווג באותו process.
+    """
+    if engine not in CLASSIFY_ENGINES:
+        raise ValueError(f"engine לא מוכר: {engine} (אפשרויות: {', '.join(CLASSIFY_ENGINES)})")
+    if processes and processes > 1:
+        chunks = _iter_chunks(records, chunk_size)
+        first  = next(chunks, [])
+        if len(first) < chunk_size:
+            records = first
+        else:
+            return _classify_sharded(chain([first], chunks), mapping, engine, processes)
+    if engine == "columnar":
+        from columnar_classifier import classify_all_columnar
+        return classify_all_columnar(records, mapping)
+
     classified = []
     skipped = []
     for rec in records:
@@ -436,6 +485,76 @@ def classify_all(records, mapping):
     return classified, skipped
 
 
+# --- process pool ---
+
+_worker_mapping = None
+_worker_engine  = "rows"
+
+
+def _init_classify_worker(mapping, engine):
+    """initializer של ה-pool — ה-mapping נשמר ב-worker ולא נשלח שוב עם כל chunk."""
+    global _worker_mapping, _worker_engine
+    _worker_mapping = mapping
+    _worker_engine  = engine
+
+
+def _classify_chunk(chunk):
+    """
+    מסווג chunk ב-worker. skipped מוחזר כ-(אינדקס ב-chunk, סיבה) ו-_raw מוסר מהתוצאות —
+    ה-process הראשי מצמיד את הרשומות המקוריות במקום עותקים שעברו pickle.
+    """
+    classified, skipped = classify_all(chunk, _worker_mapping, engine=_worker_engine)
+    positions = {id(rec): i for i, rec in enumerate(chunk)}
+    for result in classified:
+        del result["_raw"]
+    return classified, [(positions[id(rec)], reason) for rec, reason in skipped]
+
+
+def _iter_chunks(records, chunk_size):
+    """lists של עד chunk_size רשומות, בלי לקרוא את כל ה-iterable מראש."""
+    it = iter(records)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _classify_sharded(chunks, mapping, engine, processes):
+    """
+    chunk מוגש ל-pool ברגע שנקרא מהקלט; עד 2*processes chunks בטיפול בו-זמנית, כדי שקלט
+    מהיר לא ייצבר כולו בתור. התוצאות נאספות לפי סדר ההגשה → אותו סדר כמו classify_all הרגיל.
+    forkserver — ה-workers לא יורשים (fork) את ה-threads ואת הזיכרון של ה-process הראשי.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    classified = []
+    skipped = []
+
+    def _collect(chunk, future):
+        part_classified, part_skipped = future.result()
+        # כל רשומה שלא דולגה סווגה, לפי הסדר — כך יודעים לאיזו רשומה שייכת כל תוצאה
+        skipped_at = {i for i, _ in part_skipped}
+        kept = (rec for i, rec in enumerate(chunk) if i not in skipped_at)
+        for result, rec in zip(part_classified, kept):
+            result["_raw"] = rec
+        classified.extend(part_classified)
+        skipped.extend((chunk[i], reason) for i, reason in part_skipped)
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=processes,
+                             mp_context=multiprocessing.get_context("forkserver"),
+                             initializer=_init_classify_worker,
+                             initargs=(mapping, engine)) as pool:
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_classify_chunk, chunk)))
+            if len(pending) >= 2 * processes:
+                _collect(*pending.popleft())
+        while pending:
+            _collect(*pending.popleft())
+    return classified, skipped
+
+
 def apply_employer_max_counter_routing(classified_records):
     from mapping_loader import FORMAT_EMPLOYER, FORMAT_CASE_MGR
 
@@ -478,3 +597,94 @@ def apply_employer_max_counter_routing(classified_records):
                 classified_records[i]["routing_path"]   = f"employer_max_counter_{max_counter}"
 
     return classified_records
+
+
+def apply_post_routing(classified_records):
+    """
+    apply_employer_max_counter_routing + apply_cross_error_inheritance במעבר אחד.
+
+    מעבר יחיד על הרשומות בונה את שני האינדקסים:
+      (employee_id, fund_institution_id, error_code)                      → max counter + אינדקסי מעסיק
+      (employee_id, customer_number, fund_institution_id, base_resp)      → אינדקסים + max counter
+    ואז מחיל את שני הכללים באותו סדר כמו הפונקציות הנפרדות — התוצאה זהה להרצתן ברצף.
+    המעבר רץ כש-GC המחזורי מושבת (_gc_paused): האינדקסים מקצים מפתח ורשימה לכל קבוצה,
+    וכל gen2 שהיה נסרק בדרך עובר על כל ה-dicts של classified והרשומות הגולמיות.
+    """
+    with _gc_paused():
+        return _apply_post_routing(classified_records)
+
+
+def _apply_post_routing(classified_records):
+    from mapping_loader import FORMAT_EMPLOYER
+
+    emp_max     = {}   # key1 → max counter (כל הרשומות עם המפתח)
+    emp_indices = {}   # key1 → אינדקסים של רשומות בפורמט מעסיק
+    inh_groups  = {}   # key2 → [max counter, אינדקסים]
+    deferred    = []   # רשומות בלי base_responsibility — המפתח תלוי ב-responsibility אחרי כלל 1
+
+    for i, rec in enumerate(classified_records):
+        emp_id  = str(rec.get("employee_id") or "")
+        fund_id = str(rec.get("fund_institution_id") or "")
+        if not emp_id or not fund_id:
+            continue
+        c = rec.get("counter_weeks") or 0
+
+        ec = str(rec.get("error_code") or "")
+        if ec:
+            key1 = (emp_id, fund_id, ec)
+            if c > emp_max.get(key1, 0):
+                emp_max[key1] = c
+            else:
+                emp_max.setdefault(key1, 0)
+            if rec.get("email_format") == FORMAT_EMPLOYER:
+                emp_indices.setdefault(key1, []).append(i)
+
+        base_resp = rec.get("base_responsibility")
+        if not base_resp:
+            deferred.append((i, emp_id, fund_id, c))
+            continue
+        key2  = (emp_id, str(rec.get("customer_number") or ""), fund_id, str(base_resp))
+        entry = inh_groups.get(key2)
+        if entry is None:
+            inh_groups[key2] = [c, [i]]
+        else:
+            if c > entry[0]:
+                entry[0] = c
+            entry[1].append(i)
+
+    # כלל 1 — employer max-counter
+    for key1, indices in emp_indices.items():
+        max_counter = emp_max[key1]
+        if max_counter >= 2:
+            for i in indices:
+                rec = classified_records[i]
+                rec["email_format"]   = FORMAT_CASE_MGR
+                rec["responsibility"] = RESP_CASE_MANAGER
+                rec["to_role"]        = "מנהלת תיק"
+                rec["cc_role"]        = None
+                rec["routing_path"]   = f"employer_max_counter_{max_counter}"
+
+    for i, emp_id, fund_id, c in deferred:
+        rec   = classified_records[i]
+        key2  = (emp_id, str(rec.get("customer_number") or ""), fund_id, str(rec.get("responsibility") or ""))
+        entry = inh_groups.setdefault(key2, [0, []])
+        if c > entry[0]:
+            entry[0] = c
+        entry[1].append(i)
+
+    # כלל 2 — cross-error inheritance
+    for max_counter, indices in inh_groups.values():
+        if len(indices) < 2 or max_counter < 1:
+            continue
+        for i in indices:
+            rec = classified_records[i]
+            if (rec.get("counter_weeks") or 0) < max_counter:
+                rec["counter_weeks"] = max_counter
+            if max_counter >= 2 and rec.get("email_format") != FORMAT_CASE_MGR:
+                rec["email_format"]   = FORMAT_CASE_MGR
+                rec["responsibility"] = RESP_CASE_MANAGER
+                rec["to_role"]        = "מנהלת תיק"
+                rec["cc_role"]        = None
+                rec["routing_path"]   = f"cross_error_inheritance_c{max_counter}"
+
+    return classified_records
@@ -0,0 +1,465 @@
+"""
+record_fetcher.py
+-----------------
+שליפת רשומות GetFeedbackData מ-API של דוד.
+
+  - קריאה מקבילית לכל מנהלת תיק (pool חסום, ברירת מחדל 4)
+  - דפדוף אופציונלי (page_size) במקום גוף אחד ענק של top=10000
+  - מיזוג הדרגתי ל-dict לפי MISPAR_MEZAHE_RESHUMA, לפי סדר המנהלות שהתקבל
+  - זמן, מספר עמודים וניסיונות לכל מנהלת (ל-stats של הריצה)
+  - מצב streaming: פענוח הדרגתי של ה-JSON array מה-response ו-yield רשומה-רשומה,
+    כך ש-classify_all רץ תוך כדי הורדה ואין עותק מלא של הגוף בזיכרון
+
+שימוש:
+  from record_fetcher import fetch_all_managers, stream_all_managers
+  records, fetch_stats = fetch_all_managers(api_base, token, "2022-01-01", 10000, ["a@x.co.il"])
+
+  fetch_stats = {}
+  classified, skipped = classify_all(
+      stream_all_managers(api_base, token, "2022-01-01", 10000, ["a@x.co.il"], stats=fetch_stats),
+      mapping,
+  )
+"""
+
+import json
+import time
+import queue
+import codecs
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+log = logging.getLogger(__name__)
+
+FETCH_PATH       = "/services/AutomationFeedback/GetFeedbackData"
+FIELD_RECORD_ID  = "MISPAR_MEZAHE_RESHUMA"
+
+DEFAULT_WORKERS     = 4
+DEFAULT_TIMEOUT     = 300
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 15
+
+# שם שדה ה-offset בגוף הבקשה בדפדוף. דפדוף כבוי כברירת מחדל (page_size=0)
+# עד שדוד יאשר תמיכה — אם השרת מתעלם מהשדה, עמוד חוזר על עצמו והרשומות נשלפות
+# מחדש בקריאה אחת בלי דפדוף (stats["unpaged_refetch"]).
+PAGE_SKIP_FIELD = "skip"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_QUEUE_SIZE = 2000   # רשומות ממתינות בין threads השליפה ל-classify (גבול זיכרון)
+
+_session_local = threading.local()
+_decoder       = json.JSONDecoder()
+
+
+class FetchError(Exception):
+    """שליפה נכשלה במצב streaming — מאפשר לרנר להבדיל בין כשל fetch לכשל classify."""
+
+
+# =============================================================================
+# Public API
+# =============================================================================
+
+def fetch_all_managers(api_base, access_token, start_date, top, managers,
+                       max_workers=DEFAULT_WORKERS, page_size=0,
+                       max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    שולף רשומות לכל מנהלות התיק במקביל וממזג לפי MISPAR_MEZAHE_RESHUMA.
+
+    managers    : רשימת כתובות מנהלות תיק. רשימה ריקה → קריאה אחת ללא פילטר וללא מיזוג
+    max_workers : מקסימום קריאות HTTP במקביל
+    page_size   : גודל עמוד. 0 → קריאה אחת עם top (התנהגות קודמת)
+
+    מיזוג: כמו בריצה הסדרתית — מנהלת מאוחרת ברשימה דורסת רשומה זהה של מוקדמת,
+    וסדר הרשומות נקבע לפי סדר המנהלות (לא לפי סדר סיום הקריאות).
+
+    מחזיר (records_list, fetch_stats):
+      fetch_stats = {
+          "seconds":  float,
+          "managers": { mgr: {"records": int, "pages": int, "attempts": int, "seconds": float}, ... },
+      }
+    """
+    t0 = time.time()
+    managers = list(managers)
+    if not managers:
+        recs, stats = fetch_records(api_base, access_token, start_date, top, "",
+                                    page_size=page_size, max_retries=max_retries,
+                                    retry_delay=retry_delay)
+        return recs, {"seconds": round(time.time() - t0, 2), "managers": {"all": stats}}
+
+    merged      = {}
+    per_manager = {}
+    done        = {}   # idx → records, ממתינים למיזוג לפי הסדר
+    next_idx    = 0
+
+    workers = max(1, min(int(max_workers or 1), len(managers)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        future_map = {
+            executor.submit(fetch_records, api_base, access_token, start_date, top, mgr,
+                            page_size=page_size, max_retries=max_retries,
+                            retry_delay=retry_delay): idx
+            for idx, mgr in enumerate(managers)
+        }
+        for future in as_completed(future_map):
+            idx = future_map[future]
+            recs, stats = future.result()   # חריגה → כל ה-fetch נכשל (כמו קודם)
+            mgr = managers[idx]
+            per_manager[mgr] = stats
+            log.info(f"  {mgr} → {len(recs)} רשומות ({stats['seconds']:.1f}s, "
+                     f"pages={stats['pages']}, attempts={stats['attempts']})")
+
+            # מיזוג הדרגתי: ממזגים כל קידומת רציפה של מנהלות שסיימו
+            done[idx] = recs
+            while next_idx in done:
+                for r in done.pop(next_idx):
+                    rid = r.get(FIELD_RECORD_ID)
+                    if rid:
+                        merged[rid] = r
+                next_idx += 1
+
+    return list(merged.values()), {
+        "seconds":  round(time.time() - t0, 2),
+        "managers": {mgr: per_manager[mgr] for mgr in managers if mgr in per_manager},
+    }
+
+
+def fetch_records(api_base, access_token, start_date, top, acct_mgr, page_size=0,
+                  max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    שולף רשומות עבור מנהלת תיק אחת (או הכל אם acct_mgr ריק).
+
+    מחזיר (records, stats) — stats: records / pages / attempts / seconds,
+    ו-unpaged_refetch=True אם השרת התעלם מ-skip והרשומות נשלפו מחדש בלי דפדוף.
+    """
+    t0    = time.time()
+    top   = int(top)
+    stats = _new_stats()
+
+    if not page_size or int(page_size) >= top:
+        records = _fetch_page(api_base, access_token, start_date, top, acct_mgr, None,
+                              max_retries, retry_delay, stats)
+    else:
+        page_size = int(page_size)
+        records   = []
+        seen_ids  = set()
+        skip      = 0
+        while skip < top:
+            size = min(page_size, top - skip)
+            page = _fetch_page(api_base, access_token, start_date, size, acct_mgr, skip,
+                               max_retries, retry_delay, stats)
+            new = [r for r in page
+                   if r.get(FIELD_RECORD_ID) is None or r.get(FIELD_RECORD_ID) not in seen_ids]
+            if page and not new:
+                # השרת מתעלם מ-skip — מה שנאסף עד כאן הוא רק העמוד הראשון. לא מחזירים
+                # חלק מהנתונים: שליפה אחת מחדש בלי דפדוף, כמו page_size=0.
+                log.warning(f"  {acct_mgr or 'all'}: עמוד skip={skip} חוזר על עצמו — "
+                            f"ה-API כנראה לא תומך ב-{PAGE_SKIP_FIELD}, שולף מחדש בלי דפדוף")
+                records = _fetch_page(api_base, access_token, start_date, top, acct_mgr, None,
+                                      max_retries, retry_delay, stats)
+                stats["unpaged_refetch"] = True
+                break
+            seen_ids.update(r.get(FIELD_RECORD_ID) for r in new)
+            records.extend(new)
+            if len(page) < size:
+                break
+            skip += size
+
+    stats["records"] = len(records)
+    stats["seconds"] = round(time.time() - t0, 2)
+    return records, stats
+
+
+def stream_all_managers(api_base, access_token, start_date, top, managers,
+                        max_workers=DEFAULT_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                        retry_delay=DEFAULT_RETRY_DELAY, stats=None):
+    """
+    Generator — מחזיר רשומות אחת-אחת תוך כדי הורדה, מכל המנהלות במקביל.
+
+    stats : dict אופציונלי שמתמלא באותו מבנה כמו fetch_stats של fetch_all_managers.
+
+    הבדלים ממצב fetch_all_managers:
+      - סדר הרשומות לפי סדר ההגעה, לא לפי סדר המנהלות
+      - רשומה שמופיעה אצל כמה מנהלות — המופע הראשון נשמר
+      - כשל בשליפה נזרק כ-FetchError מתוך האיטרציה
+    """
+    t0 = time.time()
+    stats = stats if stats is not None else {}
+    stats["managers"] = {}
+    managers = list(managers)
+
+    if not managers:
+        mgr_stats = _new_stats()
+        stats["managers"]["all"] = mgr_stats
+        try:
+            yield from stream_records(api_base, access_token, start_date, top, "",
+                                      max_retries=max_retries, retry_delay=retry_delay,
+                                      stats=mgr_stats)
+        except Exception as e:
+            raise FetchError(str(e)) from e
+        finally:
+            stats["seconds"] = round(time.time() - t0, 2)
+        return
+
+    out       = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop      = threading.Event()
+    done_mark = object()
+    for mgr in managers:
+        stats["managers"][mgr] = _new_stats()
+
+    def _produce(mgr):
+        try:
+            for rec in stream_records(api_base, access_token, start_date, top, mgr,
+                                      max_retries=max_retries, retry_delay=retry_delay,
+                                      stats=stats["managers"][mgr]):
+                if not _put(out, rec, stop):
+                    return
+            _put(out, done_mark, stop)
+        except Exception as e:
+            _put(out, FetchError(f"{mgr}: {e}"), stop)
+
+    workers  = max(1, min(int(max_workers or 1), len(managers)))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    seen     = set()
+    try:
+        for mgr in managers:
+            executor.submit(_produce, mgr)
+        remaining = len(managers)
+        while remaining:
+            item = out.get()
+            if item is done_mark:
+                remaining -= 1
+                continue
+            if isinstance(item, FetchError):
+                raise item
+            rid = item.get(FIELD_RECORD_ID)
+            if rid and rid not in seen:
+                seen.add(rid)
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+        stats["seconds"] = round(time.time() - t0, 2)
+
+
+def stream_records(api_base, access_token, start_date, top, acct_mgr,
+                   max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY, stats=None):
+    """
+    Generator — קריאת GetFeedbackData אחת במצב streaming, עם retry.
+
+    כשל באמצע הזרם → ניסיון חוזר מההתחלה; רשומות שכבר הוחזרו (לפי מזהה) מדולגות.
+    """
+    t0 = time.time()
+    stats = stats if stats is not None else _new_stats()
+    body  = _request_body(start_date, top, acct_mgr, None)
+    seen  = set()
+
+    last_exc = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            if attempt > 1:
+                log.warning(f"  retry {attempt}/{max_retries} עבור {acct_mgr or 'all'} (ממתין {retry_delay}s)")
+                time.sleep(retry_delay)
+
+            stats["attempts"] += 1
+            with _session().post(
+                f"{api_base}{FETCH_PATH}",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type":  "application/json",
+                },
+                json=body,
+                timeout=DEFAULT_TIMEOUT,
+                stream=True,
+            ) as resp:
+                resp.raise_for_status()
+                chunks = resp.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+                for rec in iter_json_array(chunks):
+                    if not isinstance(rec, dict):
+                        raise ValueError("תגובת API של דוד אינה JSON array של אובייקטים")
+                    rid = rec.get(FIELD_RECORD_ID)
+                    if rid is not None:
+                        if rid in seen:
+                            continue
+                        seen.add(rid)
+                    stats["records"] += 1
+                    yield rec
+
+            if attempt > 1:
+                log.info(f"  הצליח בניסיון {attempt}")
+            stats["pages"] += 1
+            stats["seconds"] = round(time.time() - t0, 2)
+            return
+
+        except Exception as e:
+            last_exc = e
+            log.warning(f"  ניסיון {attempt}/{max_retries} נכשל: {e}")
+
+    stats["seconds"] = round(time.time() - t0, 2)
+    raise last_exc
+
+
+_JSON_DELIMS = ",] \t\r\n"
+
+
+def iter_json_array(chunks, encoding="utf-8"):
+    """
+    מפענח JSON array מזרם של chunks (bytes או str) ומחזיר איבר-איבר.
+
+    רק איבר אחד (ועוד chunk פתוח) מוחזק בזיכרון בכל רגע.
+    זורק ValueError אם הזרם אינו JSON array תקין.
+    """
+    text_decoder = codecs.getincrementaldecoder(encoding)()
+    buf    = ""
+    pos    = 0
+    state  = "start"   # start → item → sep → end
+    chunks = iter(chunks)
+    eof    = False
+
+    def _more():
+        nonlocal buf, pos, eof
+        for chunk in chunks:
+            if not chunk:
+                continue
+            text = text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if not text:
+                continue
+            buf = buf[pos:] + text
+            pos = 0
+            return True
+        tail = text_decoder.decode(b"", final=True)
+        if tail:
+            buf = buf[pos:] + tail
+            pos = 0
+            return True
+        eof = True
+        return False
+
+    while True:
+        # דילוג על רווחים
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf) or not _more():
+                break
+
+        if pos >= len(buf):
+            if state == "end":
+                return
+            raise ValueError("תגובת API של דוד אינה JSON array (זרם נקטע)")
+
+        ch = buf[pos]
+        if state == "start":
+            if ch == "\ufeff":
+                pos += 1
+                continue
+            if ch != "[":
+                raise ValueError("תגובת API של דוד אינה JSON array")
+            pos  += 1
+            state = "first"
+        elif state in ("first", "item"):
+            if state == "first" and ch == "]":
+                pos  += 1
+                state = "end"
+                continue
+            while True:
+                try:
+                    value, end = _decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if not _more():
+                        raise ValueError("תגובת API של דוד אינה JSON תקין (זרם נקטע)")
+                    continue
+                # מספר שנחתך בגבול chunk ("2." / "1.5e") מפוענח כמספר קצר יותר — מקבלים אותו רק
+                # כשאחריו מפריד (או בסוף הזרם); מחרוזת / אובייקט / מערך נסגרים בעצמם
+                if (not eof and type(value) in (int, float)
+                        and (end >= len(buf) or buf[end] not in _JSON_DELIMS) and _more()):
+                    continue
+                break
+            pos   = end
+            state = "sep"
+            yield value
+        elif state == "sep":
+            pos += 1
+            if ch == ",":
+                state = "item"
+            elif ch == "]":
+                state = "end"
+            else:
+                raise ValueError(f"תו לא צפוי ב-JSON array: {ch!r}")
+        else:
+            raise ValueError("תוכן נוסף אחרי סוף ה-JSON array")
+
+
+# =============================================================================
+# Internal
+# =============================================================================
+
+def _new_stats():
+    return {"records": 0, "pages": 0, "attempts": 0, "seconds": 0.0}
+
+
+def _put(q, item, stop):
+    """put עם בדיקת עצירה — producer לא נתקע אם הצרכן הפסיק לקרוא."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _session():
+    """requests.Session אחד לכל thread — שימוש חוזר בחיבורי TCP/TLS בין עמודים."""
+    s = getattr(_session_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        _session_local.session = s
+    return s
+
+
+def _request_body(start_date, top, acct_mgr, skip):
+    body = {"StartDate": start_date, "top": int(top)}
+    if acct_mgr:
+        body["AccountManagerEmail"] = acct_mgr
+    if skip is not None:
+        body[PAGE_SKIP_FIELD] = int(skip)
+    return body
+
+
+def _fetch_page(api_base, access_token, start_date, top, acct_mgr, skip,
+                max_retries, retry_delay, stats):
+    """קריאת GetFeedbackData אחת עם retry. מחזיר list."""
+    body = _request_body(start_date, top, acct_mgr, skip)
+
+    last_exc = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            if attempt > 1:
+                log.warning(f"  retry {attempt}/{max_retries} עבור {acct_mgr or 'all'} (ממתין {retry_delay}s)")
+                time.sleep(retry_delay)
+
+            stats["attempts"] += 1
+            resp = _session().post(
+                f"{api_base}{FETCH_PATH}",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type":  "application/json",
+                },
+                json=body,
+                timeout=DEFAULT_TIMEOUT,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+            if not isinstance(data, list):
+                raise ValueError("תגובת API של דוד אינה JSON array")
+            if attempt > 1:
+                log.info(f"  הצליח בניסיון {attempt}")
+            stats["pages"] += 1
+            return data
+
+        except Exception as e:
+            last_exc = e
+            log.warning(f"  ניסיון {attempt}/{max_retries} נכשל: {e}")
+
+    raise last_exc
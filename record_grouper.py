@@ -9,7 +9,6 @@ record_grouper.py
   מנהלת תיק                    : קבוצה אחת כוללת (מייל אחד עם Excel של הכל)
 """
 
-from collections import defaultdict
 from mapping_loader import (
     FORMAT_MOSADI_1, FORMAT_MOSADI_2, FORMAT_MOSADI_3,
     FORMAT_EMPLOYER, FORMAT_CASE_MGR,
@@ -17,42 +16,55 @@ from mapping_loader import (
 )
 
 
+_MOSADI_FORMATS = (FORMAT_MOSADI_1, FORMAT_MOSADI_2, FORMAT_MOSADI_3)
+
+
 def group_records(classified_records):
-    buckets_mosadi   = defaultdict(list)
-    buckets_employer = defaultdict(list)
+    """
+    מקבץ במעבר אחד לפי מפתחות tuple ומחזיר list של קבוצות:
+    מוסדי (לפי סדר הופעה), מעסיק, ואז קבוצת מנהלת התיק (אם יש).
+
+    group_key נשאר המחרוזת "fmt|fund|customer" / "מעסיק|customer|to_role" —
+    payload_builder ו-report_builder ממפים לפיו.
+
+    אין גרסת generator: קבוצה אוספת רשומות מכל מקום בקלט, ואף קבוצה לא שלמה לפני הרשומה
+    האחרונה. החפיפה בין בנייה לשליחה נעשית אחרי הקיבוץ (email_builder.iter_emails).
+    """
+    buckets_mosadi   = {}   # (fmt, fund_id, customer) → records
+    buckets_employer = {}   # (customer, to_role)      → records
     case_mgr_records = []
 
     for rec in classified_records:
         fmt = rec.get("email_format", "")
 
-        if fmt in (FORMAT_MOSADI_1, FORMAT_MOSADI_2, FORMAT_MOSADI_3):
-            fund_id  = rec.get("fund_institution_id") or "UNKNOWN_FUND"
-            customer = rec.get("customer_number") or "UNKNOWN_CUSTOMER"
-            key = f"{fmt}|{fund_id}|{customer}"
-            buckets_mosadi[key].append(rec)
+        if fmt in _MOSADI_FORMATS:
+            key = (fmt,
+                   str(rec.get("fund_institution_id") or "UNKNOWN_FUND"),
+                   str(rec.get("customer_number") or "UNKNOWN_CUSTOMER"))
+            records = buckets_mosadi.get(key)
+            if records is None:
+                buckets_mosadi[key] = [rec]
+            else:
+                records.append(rec)
 
         elif fmt == FORMAT_EMPLOYER or rec.get("responsibility") in ("employer", "accountant", "agent"):
-            customer = rec.get("customer_number") or "UNKNOWN_CUSTOMER"
-            to_role  = rec.get("to_role") or "default"
-            key = f"{FORMAT_EMPLOYER}|{customer}|{to_role}"
-            buckets_employer[key].append(rec)
-
-        elif fmt == FORMAT_CASE_MGR or rec.get("responsibility") == RESP_CASE_MANAGER:
-            case_mgr_records.append(rec)
+            key = (str(rec.get("customer_number") or "UNKNOWN_CUSTOMER"),
+                   str(rec.get("to_role") or "default"))
+            records = buckets_employer.get(key)
+            if records is None:
+                buckets_employer[key] = [rec]
+            else:
+                records.append(rec)
 
         else:
+            # FORMAT_CASE_MGR / RESP_CASE_MANAGER / כל השאר → מייל אחד למנהלת תיק
             case_mgr_records.append(rec)
 
     groups = []
-
-    for key, records in buckets_mosadi.items():
-        parts = key.split("|", 2)
-        email_format = parts[0]
-        fund_id      = parts[1] if len(parts) > 1 else ""
-        customer     = parts[2] if len(parts) > 2 else ""
+    for (email_format, fund_id, customer), records in buckets_mosadi.items():
         sample = records[0]
         groups.append({
-            "group_key":    key,
+            "group_key":    f"{email_format}|{fund_id}|{customer}",
             "email_format": email_format,
             "records":      records,
             "meta": {
@@ -68,13 +80,10 @@ def group_records(classified_records):
             },
         })
 
-    for key, records in buckets_employer.items():
-        parts = key.split("|", 2)
-        customer = parts[1] if len(parts) > 1 else ""
-        to_role  = parts[2] if len(parts) > 2 else ""
+    for (customer, to_role), records in buckets_employer.items():
         sample = records[0]
         groups.append({
-            "group_key":    key,
+            "group_key":    f"{FORMAT_EMPLOYER}|{customer}|{to_role}",
             "email_format": FORMAT_EMPLOYER,
             "records":      records,
             "meta": {
@@ -101,7 +110,6 @@ def group_records(classified_records):
                 "cc_email": None,
             },
         })
-
     return groups
 
 
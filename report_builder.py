@@ -13,23 +13,35 @@ report_builder.py
   xlsx_bytes = build_run_report(groups, send_results, skipped_records, run_date)
 """
 
-import io
 from collections import Counter, defaultdict
 from datetime import datetime
 
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
+from xlsx_writer import StreamingWorkbook, column_widths
 
+# רוחב עמודות מוערך מ-header + השורות הראשונות (כתיבה זורמת — הרוחב נקבע לפני הכתיבה)
+WIDTH_SAMPLE_ROWS = 500
 
-def build_run_report(groups, send_results, skipped_records=None, raw_records=None, run_date=None, top=None):
+SUMMARY_COLUMNS = [
+    "פורמט", "מפתח קבוצה", "גוף מוסדי / מעסיק", "ח.פ / מזהה", "מס' רשומות",
+    "שבועות (מינ)", "שבועות (מקס)", "draft_id", "נשלח בהצלחה", "שגיאה",
+]
+DETAIL_COLUMNS = [
+    "פורמט", "מפתח קבוצה", "draft_id", "record_id", "ח.פ מעסיק", "שם מעסיק", "מ.ז. עובד", "שם עובד",
+    "קוד שגיאה", "תיאור שגיאה", "שבועות", "אחריות", "נתיב ניתוב", "גוף מוסדי", "שם קובץ מקור",
+    "חודש שכר", "מנהלת תיק", "מייל מנהלת תיק",
+]
+SKIPPED_COLUMNS = ["record_id", "ח.פ מעסיק", "קוד שגיאה", "שבועות", "סיבה"]
+
+
+def build_run_report(groups, send_results, skipped_records=None, raw_records=None, run_date=None, top=None,
+                     summary=None):
     """
     groups          : מ-group_records()
     send_results    : מ-send_all_groups()  [רשימת SendResult dicts]
     skipped_records : רשימת (record, reason) שנסוננו ב-classify_all (optional)
     raw_records     : רשימת הרשומות הגולמיות מה-API (optional) — לגיליון מעקב pipeline
     run_date        : datetime או None → now()
+    summary         : פלט summarize_run (optional) — אם כבר חושב (למשל ל-stats של הריצה), לא מחושב שוב
 
     מחזיר bytes של Excel.
     """
@@ -42,548 +54,491 @@ def build_run_report(groups, send_results, skipped_records=None, raw_records=Non
     summary_rows = []
     for g in groups:
         key    = g["group_key"]
-        fmt    = g["email_format"]
         recs   = g["records"]
         meta   = g.get("meta", {})
         sr     = draft_map.get(key, {})
 
         counters = [r.get("_raw", {}).get("OnlyOnStatusChange_DatesDiffInWeeks") for r in recs]
         counters = [int(float(c)) for c in counters if c is not None]
-        c_min = min(counters) if counters else None
-        c_max = max(counters) if counters else None
-
-        summary_rows.append({
-            "פורמט":           fmt,
-            "מפתח קבוצה":      key,
-            "גוף מוסדי / מעסיק": (
-                meta.get("fund_institution_name") or
-                meta.get("customer_name") or
-                meta.get("customer_number") or ""
-            ),
-            "ח.פ / מזהה":      meta.get("customer_number") or meta.get("fund_institution_id") or "",
-            "מס' רשומות":      len(recs),
-            "שבועות (מינ)":    c_min,
-            "שבועות (מקס)":    c_max,
-            "draft_id":        sr.get("draft_id"),
-            "נשלח בהצלחה":     "כן" if sr.get("ok") else ("לא" if sr else "—"),
-            "שגיאה":           sr.get("error") or "",
-        })
-
-    # === גיליון 2: פירוט ===
+
+        summary_rows.append((
+            g["email_format"],
+            key,
+            meta.get("fund_institution_name") or meta.get("customer_name") or meta.get("customer_number") or "",
+            meta.get("customer_number") or meta.get("fund_institution_id") or "",
+            len(recs),
+            min(counters) if counters else None,
+            max(counters) if counters else None,
+            sr.get("draft_id"),
+            "כן" if sr.get("ok") else ("לא" if sr else "—"),
+            sr.get("error") or "",
+        ))
+
+    # === גיליון 2: פירוט (+ lookup לגיליון מעקב pipeline באותו מעבר) ===
+    # record_id → (email_format, group_key, draft_id, classified_record)
+    classified_lookup = {}
     detail_rows = []
     for g in groups:
         key = g["group_key"]
         fmt = g["email_format"]
-        sr  = draft_map.get(key, {})
+        did = draft_map.get(key, {}).get("draft_id")
         for r in g["records"]:
-            detail_rows.append({
-                "פורמט":              fmt,
-                "מפתח קבוצה":         key,
-                "draft_id":           sr.get("draft_id"),
-                "record_id":          r.get("record_id"),
-                "ח.פ מעסיק":          r.get("customer_number"),
-                "שם מעסיק":           r.get("customer_name"),
-                "מ.ז. עובד":          r.get("employee_id"),
-                "שם עובד":            r.get("full_name"),
-                "קוד שגיאה":          r.get("error_code"),
-                "תיאור שגיאה":        r.get("error_description"),
-                "שבועות":             r.get("_raw", {}).get("OnlyOnStatusChange_DatesDiffInWeeks"),
-                "אחריות":             r.get("responsibility"),
-                "נתיב ניתוב":         r.get("routing_path"),
-                "גוף מוסדי":          r.get("fund_institution_name"),
-                "שם קובץ מקור":       r.get("original_file_name"),
-                "חודש שכר":           r.get("_raw", {}).get("CHODESH_MASKORET"),
-                "מנהלת תיק":          r.get("_raw", {}).get("CustomerAccountManagerName"),
-                "מייל מנהלת תיק":     r.get("_raw", {}).get("CustomerAccountManagerEmail"),
-            })
-
-    # === גיליון 3: מוחרגות ===
-    skipped_rows = []
+            classified_lookup[r["record_id"]] = (fmt, key, did, r)
+            raw = r.get("_raw", {})
+            detail_rows.append((
+                fmt, key, did,
+                r.get("record_id"),
+                r.get("customer_number"),
+                r.get("customer_name"),
+                r.get("employee_id"),
+                r.get("full_name"),
+                r.get("error_code"),
+                r.get("error_description"),
+                raw.get("OnlyOnStatusChange_DatesDiffInWeeks"),
+                r.get("responsibility"),
+                r.get("routing_path"),
+                r.get("fund_institution_name"),
+                r.get("original_file_name"),
+                raw.get("CHODESH_MASKORET"),
+                raw.get("CustomerAccountManagerName"),
+                raw.get("CustomerAccountManagerEmail"),
+            ))
+
+    # === גיליון 3: מוחרגות (+ lookup לגיליון מעקב pipeline באותו מעבר) ===
+    skipped_pairs  = []   # (record, reason) — גם לדשבורד
+    skipped_lookup = {}   # record_id → reason
+    skipped_rows   = []
     for item in (skipped_records or []):
         if isinstance(item, tuple) and len(item) == 2:
             rec, reason = item
         else:
             rec, reason = item, "סונן"
-        skipped_rows.append({
-            "record_id":   rec.get("MISPAR_MEZAHE_RESHUMA") or rec.get("record_id"),
-            "ח.פ מעסיק":  rec.get("CustomerNumber") or rec.get("customer_number"),
-            "קוד שגיאה":  rec.get("ErrorCodeV4Id") or rec.get("error_code"),
-            "שבועות":     rec.get("OnlyOnStatusChange_DatesDiffInWeeks"),
-            "סיבה":       reason,
-        })
-
-    # === בניית Excel ===
-    bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="openpyxl") as writer:
-        pd.DataFrame(summary_rows).to_excel(writer, sheet_name="סיכום",   index=False)
-        pd.DataFrame(detail_rows).to_excel(writer,  sheet_name="פירוט",   index=False)
-        pd.DataFrame(skipped_rows).to_excel(writer, sheet_name="מוחרגות", index=False)
-
-    bio.seek(0)
-    wb = load_workbook(bio)
-    _style_workbook(wb, run_date)
-    _build_dashboard_sheet(wb, groups, skipped_records or [], run_date, top=top)
+        skipped_pairs.append((rec, reason))
+        rid = rec.get("MISPAR_MEZAHE_RESHUMA") or rec.get("record_id")
+        if rid:
+            skipped_lookup[str(rid)] = reason or "סונן"
+        skipped_rows.append((
+            rid,
+            rec.get("CustomerNumber") or rec.get("customer_number"),
+            rec.get("ErrorCodeV4Id") or rec.get("error_code"),
+            rec.get("OnlyOnStatusChange_DatesDiffInWeeks"),
+            reason,
+        ))
+
+    # === בניית Excel — xlsx_writer, גיליון אחרי גיליון בסדר התצוגה ===
+    wb = StreamingWorkbook()
+    if summary is None:
+        summary = summarize_run(groups, skipped_pairs, top=top)
+    _build_dashboard_sheet(wb, summary, run_date)
+    _write_table(wb, "סיכום",   SUMMARY_COLUMNS, summary_rows)
+    _write_table(wb, "פירוט",   DETAIL_COLUMNS,  detail_rows)
+    _write_table(wb, "מוחרגות", SKIPPED_COLUMNS, skipped_rows)
     if raw_records:
-        _build_pipeline_sheet(wb, raw_records, groups, skipped_records or [], draft_map)
-
-    # הזזת דשבורד להיות הגיליון הראשון
-    wb.move_sheet("דשבורד", offset=-wb.sheetnames.index("דשבורד"))
-
-    out = io.BytesIO()
-    wb.save(out)
-    return out.getvalue()
-
-
-def _style_workbook(wb, run_date):
-    header_fill = PatternFill("solid", start_color="1F4E79", end_color="1F4E79")
-    header_font = Font(bold=True, color="FFFFFF", name="Arial", size=10)
-    data_font   = Font(name="Arial", size=10)
-    center      = Alignment(horizontal="center", vertical="center", wrap_text=False)
-    right       = Alignment(horizontal="right",  vertical="center", wrap_text=False)
-
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-
-        # כותרת גיליון
-        ws.sheet_view.rightToLeft = True
-
-        # עיצוב header
-        for cell in ws[1]:
-            cell.font      = header_font
-            cell.fill      = header_fill
-            cell.alignment = center
-
-        # עיצוב data
-        for row in ws.iter_rows(min_row=2):
-            for cell in row:
-                cell.font      = data_font
-                cell.alignment = right
-
-        # רוחב עמודות אוטומטי
-        for col_cells in ws.columns:
-            max_len = max((len(str(c.value or "")) for c in col_cells), default=10)
-            ws.column_dimensions[get_column_letter(col_cells[0].column)].width = min(max_len + 4, 50)
-
-        ws.freeze_panes = "A2"
-
-
-def _build_dashboard_sheet(wb, groups, skipped_records, run_date, top=None):
-    """מוסיף גיליון דשבורד עם 4 טבלאות סיכום."""
-    ws = wb.create_sheet("דשבורד")
-    ws.sheet_view.rightToLeft = True
-
-    H_FILL  = PatternFill("solid", start_color="1F4E79", end_color="1F4E79")
-    H_FONT  = Font(bold=True, color="FFFFFF", name="Arial", size=10)
-    T_FILL  = PatternFill("solid", start_color="D6E4F0", end_color="D6E4F0")  # כותרת טבלה
-    T_FONT  = Font(bold=True, name="Arial", size=10)
-    D_FONT  = Font(name="Arial", size=10)
-    RIGHT   = Alignment(horizontal="right", vertical="center")
-    CENTER  = Alignment(horizontal="center", vertical="center")
-
-    def _hcell(ws, row, col, value):
-        c = ws.cell(row=row, column=col, value=value)
-        c.font = H_FONT; c.fill = H_FILL; c.alignment = CENTER
-
-    def _tcell(ws, row, col, value):
-        c = ws.cell(row=row, column=col, value=value)
-        c.font = T_FONT; c.fill = T_FILL; c.alignment = RIGHT
-
-    def _dcell(ws, row, col, value):
-        c = ws.cell(row=row, column=col, value=value)
-        c.font = D_FONT; c.alignment = RIGHT
-
-    ws.column_dimensions["A"].width = 35
-    ws.column_dimensions["B"].width = 14
-    ws.column_dimensions["C"].width = 14
-    ws.column_dimensions["D"].width = 14
-    ws.column_dimensions["E"].width = 14
-    ws.column_dimensions["F"].width = 14
-    ws.column_dimensions["G"].width = 14
-    ws.column_dimensions["H"].width = 14
-
-    # ---- נתונים גולמיים ----
-    all_records = [r for g in groups for r in g["records"]]
-    total_treated = len(all_records)
-    skipped_list  = list(skipped_records)
-    total_skipped = len(skipped_list)
-    total_fetched = total_treated + total_skipped
-
-    # ספירת סיבות סינון
+        _build_pipeline_sheet(wb, raw_records, classified_lookup, skipped_lookup)
+
+    return wb.save()
+
+
+# =============================================================================
+# כתיבה זורמת (xlsx_writer)
+# =============================================================================
+
+class _Styles:
+    """
+    אינדקסי הסגנונות של ה-workbook (header / title / data / warn). add_style לא משכפל סגנון
+    קיים — בנייה לכל גיליון מחזירה את אותם אינדקסים.
+    """
+
+    def __init__(self, wb):
+        self.header = wb.add_style(bold=True, color="FFFFFF", fill="1F4E79", horizontal="center")
+        self.title  = wb.add_style(bold=True, fill="D6E4F0", horizontal="right")
+        self.data   = wb.add_style(horizontal="right")
+        self.warn   = wb.add_style(bold=True, color="FF0000", fill="FFF2CC", size=11, horizontal="center")
+
+
+def _write_table(wb, name, columns, rows, max_width=50):
+    """
+    גיליון טבלה: header + שורות (iterable של tuples/lists) בכתיבה זורמת.
+    רוחב עמודה = הערך הארוך ביותר ב-header + WIDTH_SAMPLE_ROWS השורות הראשונות (+4, עד max_width).
+    תאים ריקים (None / "" / NaN) לא נכתבים — כמו to_excel של pandas.
+    """
+    rows = iter(rows)
+    sample = []
+    for row in rows:
+        sample.append(row)
+        if len(sample) >= WIDTH_SAMPLE_ROWS:
+            break
+
+    ws = wb.create_sheet(name, widths=column_widths(columns, sample, max_width=max_width),
+                         freeze_header=True)
+    st = _Styles(wb)
+    data, append = st.data, ws.append
+    append(columns, st.header)
+    for row in sample:
+        append(row, data)
+    for row in rows:
+        append(row, data)
+
+
+# =============================================================================
+# סיכום ריצה (דשבורד)
+# =============================================================================
+
+WEEK_BUCKETS      = ["1", "2", "3", "4", "5+"]
+SKIP_REASON_LABELS = [
+    "Counter=0 (שגיאה חדשה)", "קוד שגיאה 1/2 (מוחרג)", "רשומה מבוטלת", "מוחרג בקובץ מיפוי", "אחר",
+]
+TOP_EMPLOYERS = 20
+
+
+def summarize_run(groups, skipped_records=None, top=None):
+    """
+    כל טבלאות הדשבורד במעבר אחד על הרשומות (ואחד על המוחרגות).
+    התוצאה היא dict שמיש ל-JSON — משמש את גיליון הדשבורד ואת stats["summary"] של ה-runner:
+    {
+        "fetched", "treated", "skipped": int,
+        "top": int | None, "truncation_warning": bool,
+        "skip_reasons":  {label: int}                      (לפי SKIP_REASON_LABELS),
+        "formats":       [{"email_format", "records", "mails"}, ...]   (לפי שם פורמט),
+        "weeks":         {bucket: int}                     (לפי OnlyOnStatusChange_DatesDiffInWeeks),
+        "weeks_by_side": {"external": {bucket: int}, "internal": {bucket: int}}   (לפי counter_weeks),
+        "case_managers": [{"email", "name", "total", "weeks"}, ...]   (מהגדול לקטן),
+        "top_employers": [{"customer_number", "name", "total", "weeks"}, ...]   (TOP_EMPLOYERS הגדולים),
+    }
+    """
+    from mapping_loader import FORMAT_CASE_MGR
+
     skip_counts = Counter()
-    for _, reason in skipped_list:
-        r = reason or "אחר"
-        if "Counter=0" in r:
-            skip_counts["Counter=0 (שגיאה חדשה)"] += 1
-        elif "קוד שגיאה 1" in r or "קוד שגיאה 2" in r:
-            skip_counts["קוד שגיאה 1/2 (מוחרג)"] += 1
-        elif "מבוטלת" in r:
-            skip_counts["רשומה מבוטלת"] += 1
-        elif "מוחרג בקובץ מיפוי" in r:
-            skip_counts["מוחרג בקובץ מיפוי"] += 1
+    n_skipped = 0
+    for item in (skipped_records or []):
+        reason = item[1] if isinstance(item, tuple) and len(item) == 2 else "סונן"
+        skip_counts[_skip_reason_label(reason or "אחר")] += 1
+        n_skipped += 1
+
+    format_records = Counter()
+    format_groups  = Counter()
+    cm_mail_emails = set()
+    weeks          = Counter()
+    external       = Counter()
+    internal       = Counter()
+    cm_weeks, cm_names   = defaultdict(Counter), {}
+    emp_weeks, emp_names = defaultdict(Counter), {}
+    n_treated = 0
+
+    for g in groups:
+        fmt = g["email_format"]
+        format_groups[fmt] += 1
+        format_records[fmt] += len(g["records"])
+        for r in g["records"]:
+            n_treated += 1
+            raw    = r.get("_raw", {})
+            bucket = _week_bucket(_raw_weeks(raw.get("OnlyOnStatusChange_DatesDiffInWeeks")))
+            weeks[bucket] += 1
+
+            cm_email = raw.get("CustomerAccountManagerEmail")
+            if fmt == FORMAT_CASE_MGR and cm_email:
+                cm_mail_emails.add(cm_email)
+            cm_email = cm_email or "—"
+            cm_names[cm_email] = raw.get("CustomerAccountManagerName") or cm_email
+            cm_weeks[cm_email][bucket] += 1
+
+            cnum = str(r.get("customer_number") or "—")
+            emp_names[cnum] = r.get("customer_name") or r.get("employer_name") or cnum
+            emp_weeks[cnum][bucket] += 1
+
+            side = internal if r.get("email_format") == FORMAT_CASE_MGR else external
+            side[_week_bucket(_int_or_zero(r.get("counter_weeks")))] += 1
+
+    fetched = n_treated + n_skipped
+    top = int(top) if top else None
+
+    def _weeks(counter):
+        return {b: counter.get(b, 0) for b in WEEK_BUCKETS}
+
+    formats = []
+    for fmt in sorted(format_groups):
+        if fmt == FORMAT_CASE_MGR:
+            # ספירת מנהלות תיק ייחודיות לפי CustomerAccountManagerEmail
+            mails = len(cm_mail_emails) or 1
         else:
-            skip_counts["אחר"] += 1
+            mails = format_groups[fmt]
+        formats.append({"email_format": fmt, "records": format_records[fmt], "mails": mails})
+
+    case_managers = sorted(cm_weeks.items(), key=lambda x: -sum(x[1].values()))
+    employers     = sorted(emp_weeks.items(), key=lambda x: sum(x[1].values()), reverse=True)[:TOP_EMPLOYERS]
+
+    return {
+        "fetched":            fetched,
+        "treated":            n_treated,
+        "skipped":            n_skipped,
+        "top":                top,
+        "truncation_warning": bool(top and fetched >= int(top * 0.75)),
+        "skip_reasons":       {label: skip_counts.get(label, 0) for label in SKIP_REASON_LABELS},
+        "formats":            formats,
+        "weeks":              _weeks(weeks),
+        "weeks_by_side":      {"external": _weeks(external), "internal": _weeks(internal)},
+        "case_managers": [
+            {"email": em, "name": cm_names[em], "total": sum(c.values()), "weeks": _weeks(c)}
+            for em, c in case_managers
+        ],
+        "top_employers": [
+            {"customer_number": cnum, "name": emp_names[cnum], "total": sum(c.values()), "weeks": _weeks(c)}
+            for cnum, c in employers
+        ],
+    }
+
+
+def _skip_reason_label(reason):
+    if "Counter=0" in reason:
+        return "Counter=0 (שגיאה חדשה)"
+    if "קוד שגיאה 1" in reason or "קוד שגיאה 2" in reason:
+        return "קוד שגיאה 1/2 (מוחרג)"
+    if "מבוטלת" in reason:
+        return "רשומה מבוטלת"
+    if "מוחרג בקובץ מיפוי" in reason:
+        return "מוחרג בקובץ מיפוי"
+    return "אחר"
+
+
+def _raw_weeks(value):
+    """OnlyOnStatusChange_DatesDiffInWeeks כ-int (ערך חסר / לא מספרי → 0)."""
+    try:
+        return int(float(value)) if value is not None else 0
+    except (ValueError, TypeError):
+        return 0
+
+
+def _int_or_zero(value):
+    try:
+        return int(value or 0)
+    except (ValueError, TypeError):
+        return 0
+
+
+def _week_bucket(weeks):
+    return str(weeks) if weeks <= 4 else "5+"
+
+
+def _build_dashboard_sheet(wb, summary, run_date):
+    """מוסיף גיליון דשבורד מתוך summarize_run (כתיבה זורמת — שורה אחרי שורה)."""
+    ws = wb.create_sheet("דשבורד", widths=[35] + [14] * 7)
+    st = _Styles(wb)
+
+    def _row(*cells, merge_to=None):
+        """שורה חדשה מ-(value, style); merge_to = עמודה אחרונה למיזוג מ-A."""
+        ws.append([v for v, _ in cells], [style for _, style in cells])
+        if merge_to:
+            ws.merge(ws.max_row, 1, merge_to)
+
+    def _blank():
+        ws.append([])
+
+    def _titles(*values):
+        _row(*((v, st.title) for v in values))
+
+    def _data(*values):
+        _row(*((v, st.data) for v in values))
+
+    total_fetched = summary["fetched"]
+    total_treated = summary["treated"]
 
     # ---- טבלה 1: סיכום כללי (שורה 1) ----
-    row = 1
-    _hcell(ws, row, 1, f"דשבורד — ריצה {run_date.strftime('%d/%m/%Y %H:%M')} UTC")
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=3)
-    row += 1
+    _row((f"דשבורד — ריצה {run_date.strftime('%d/%m/%Y %H:%M')} UTC", st.header), merge_to=3)
 
     # אזהרת truncation
-    _top = int(top) if top else None
-    _truncation_warning = _top and (total_fetched >= int(_top * 0.75))
-    if _truncation_warning:
-        warn_cell = ws.cell(row=row, column=1,
-            value=f"⚠️ אזהרה: נשלפו {total_fetched} רשומות מתוך TOP={_top} ({total_fetched/_top*100:.0f}%). קיים סיכון לחיתוך נתונים!")
-        warn_cell.font = Font(bold=True, color="FF0000", name="Arial", size=11)
-        warn_cell.fill = PatternFill("solid", start_color="FFF2CC", end_color="FFF2CC")
-        warn_cell.alignment = CENTER
-        ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=3)
-        row += 1
-
-    row += 1
-
-    _tcell(ws, row, 1, "קטגוריה"); _tcell(ws, row, 2, "כמות"); _tcell(ws, row, 3, "אחוז")
-    row += 1
+    if summary["truncation_warning"]:
+        _top = summary["top"]
+        _row((f"⚠️ אזהרה: נשלפו {total_fetched} רשומות מתוך TOP={_top} ({total_fetched/_top*100:.0f}%). קיים סיכון לחיתוך נתונים!",
+              st.warn), merge_to=3)
+
+    _blank()
+
+    _titles("קטגוריה", "כמות", "אחוז")
     for label, val in [
         ("סה\"כ רשומות שהתקבלו",  total_fetched),
         ("רשומות לטיפול",         total_treated),
-        ("רשומות לא לטיפול",      total_skipped),
-        ("  — Counter=0 (שגיאה חדשה)",      skip_counts.get("Counter=0 (שגיאה חדשה)", 0)),
-        ("  — קוד שגיאה 1/2 (מוחרג)",       skip_counts.get("קוד שגיאה 1/2 (מוחרג)", 0)),
-        ("  — רשומה מבוטלת",                 skip_counts.get("רשומה מבוטלת", 0)),
-        ("  — מוחרג בקובץ מיפוי",            skip_counts.get("מוחרג בקובץ מיפוי", 0)),
-        ("  — אחר",                           skip_counts.get("אחר", 0)),
+        ("רשומות לא לטיפול",      summary["skipped"]),
+        *((f"  — {reason}", n) for reason, n in summary["skip_reasons"].items()),
     ]:
         pct = f"{val/total_fetched*100:.1f}%" if total_fetched else "—"
-        _dcell(ws, row, 1, label); _dcell(ws, row, 2, val); _dcell(ws, row, 3, pct)
-        row += 1
-    row += 1
-
-    # ---- טבלה 2: לפי גורם אחראי (שורה row) ----
-    _tcell(ws, row, 1, "גורם אחראי"); _tcell(ws, row, 2, "כמות רשומות"); _tcell(ws, row, 3, "כמות מיילים")
-    row += 1
-    by_format = defaultdict(list)
-    for g in groups:
-        by_format[g["email_format"]].append(g)
-    from mapping_loader import FORMAT_CASE_MGR as _FCM
-    for fmt, grps in sorted(by_format.items()):
-        rec_count  = sum(len(g["records"]) for g in grps)
-        if fmt == _FCM:
-            # ספירת מנהלות תיק ייחודיות לפי CustomerAccountManagerEmail
-            cm_emails = {
-                r.get("_raw", {}).get("CustomerAccountManagerEmail")
-                for g in grps for r in g["records"]
-                if r.get("_raw", {}).get("CustomerAccountManagerEmail")
-            }
-            mail_count = len(cm_emails) if cm_emails else 1
-        else:
-            mail_count = len(grps)
-        _dcell(ws, row, 1, fmt); _dcell(ws, row, 2, rec_count); _dcell(ws, row, 3, mail_count)
-        row += 1
-    row += 1
+        _data(label, val, pct)
+    _blank()
+
+    # ---- טבלה 2: לפי גורם אחראי ----
+    _titles("גורם אחראי", "כמות רשומות", "כמות מיילים")
+    for f in summary["formats"]:
+        _data(f["email_format"], f["records"], f["mails"])
+    _blank()
 
     # ---- טבלה 3: לפי מדיניות הסלמה (counter) ----
-    _tcell(ws, row, 1, "שבועות (Counter)"); _tcell(ws, row, 2, "כמות רשומות"); _tcell(ws, row, 3, "אחוז מטופלים")
-    row += 1
-    counter_counts = Counter()
-    for r in all_records:
-        c = r.get("_raw", {}).get("OnlyOnStatusChange_DatesDiffInWeeks")
-        try:
-            c = int(float(c)) if c is not None else 0
-        except (ValueError, TypeError):
-            c = 0
-        bucket = str(c) if c <= 4 else "5+"
-        counter_counts[bucket] += 1
-    for bucket in ["1", "2", "3", "4", "5+"]:
-        val = counter_counts.get(bucket, 0)
+    _titles("שבועות (Counter)", "כמות רשומות", "אחוז מטופלים")
+    for bucket, val in summary["weeks"].items():
         pct = f"{val/total_treated*100:.1f}%" if total_treated else "—"
-        _dcell(ws, row, 1, f"שבוע {bucket}"); _dcell(ws, row, 2, val); _dcell(ws, row, 3, pct)
-        row += 1
-    row += 1
+        _data(f"שבוע {bucket}", val, pct)
+    _blank()
 
     # ---- טבלה 4: רשומות לפי שבועות — פנימי vs חיצוני ----
-    _hcell(ws, row, 1, "רשומות לטיפול לפי שבועות הסלמה")
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=4)
-    row += 1
-    _tcell(ws, row, 1, "שבועות"); _tcell(ws, row, 2, "חיצוני (מוסדי/מעסיק)"); _tcell(ws, row, 3, "פנימי (מנהלת תיק)"); _tcell(ws, row, 4, "סה\"כ")
-    row += 1
-    from mapping_loader import FORMAT_CASE_MGR
-    ext_counts = Counter()
-    int_counts = Counter()
-    for r in all_records:
-        c = r.get("counter_weeks") or 0
-        try:
-            c = int(c)
-        except (ValueError, TypeError):
-            c = 0
-        bucket = str(c) if c <= 4 else "5+"
-        if r.get("email_format") == FORMAT_CASE_MGR:
-            int_counts[bucket] += 1
-        else:
-            ext_counts[bucket] += 1
-    for bucket in ["1", "2", "3", "4", "5+"]:
-        e = ext_counts.get(bucket, 0)
-        i = int_counts.get(bucket, 0)
-        _dcell(ws, row, 1, f"שבוע {bucket}"); _dcell(ws, row, 2, e); _dcell(ws, row, 3, i); _dcell(ws, row, 4, e + i)
-        row += 1
-    row += 1
+    _row(("רשומות לטיפול לפי שבועות הסלמה", st.header), merge_to=4)
+    _titles("שבועות", "חיצוני (מוסדי/מעסיק)", "פנימי (מנהלת תיק)", "סה\"כ")
+    ext, internal = summary["weeks_by_side"]["external"], summary["weeks_by_side"]["internal"]
+    for bucket in WEEK_BUCKETS:
+        e, i = ext[bucket], internal[bucket]
+        _data(f"שבוע {bucket}", e, i, e + i)
+    _blank()
 
     # ---- טבלה 5: רשומות לפי מנהלת תיק + שבועות ----
-    _hcell(ws, row, 1, "רשומות לטיפול לפי מנהלת תיק")
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=8)
-    row += 1
-    cm_headers = ["מנהלת תיק", "סה\"כ", "שבוע 1", "שבוע 2", "שבוע 3", "שבוע 4", "שבוע 5+"]
-    for i, h in enumerate(cm_headers, 1):
-        _tcell(ws, row, i, h)
-    row += 1
-
-    cm_data = defaultdict(lambda: Counter())
-    cm_display_names = {}
-    for r in all_records:
-        raw = r.get("_raw", {})
-        cm_email = raw.get("CustomerAccountManagerEmail") or "—"
-        cm_name  = raw.get("CustomerAccountManagerName") or cm_email
-        cm_display_names[cm_email] = cm_name
-        c = raw.get("OnlyOnStatusChange_DatesDiffInWeeks")
-        try:
-            c = int(float(c)) if c is not None else 0
-        except (ValueError, TypeError):
-            c = 0
-        bucket = str(c) if c <= 4 else "5+"
-        cm_data[cm_email][bucket] += 1
-
-    # שורת סיכום כללי
-    total_buckets = Counter()
-    for buckets in cm_data.values():
-        for b, v in buckets.items():
-            total_buckets[b] += v
-    total_all = sum(total_buckets.values())
-    _tcell(ws, row, 1, "סה\"כ כולל")
-    _dcell(ws, row, 2, total_all)
-    for bi, bucket in enumerate(["1", "2", "3", "4", "5+"], 3):
-        _dcell(ws, row, bi, total_buckets.get(bucket, 0))
-    row += 1
-
-    for cm_email, buckets in sorted(cm_data.items(), key=lambda x: -sum(x[1].values())):
-        total = sum(buckets.values())
-        name  = cm_display_names.get(cm_email, cm_email)
-        _dcell(ws, row, 1, name)
-        _dcell(ws, row, 2, total)
-        for bi, bucket in enumerate(["1", "2", "3", "4", "5+"], 3):
-            _dcell(ws, row, bi, buckets.get(bucket, 0))
-        row += 1
-    row += 1
+    _row(("רשומות לטיפול לפי מנהלת תיק", st.header), merge_to=8)
+    _titles("מנהלת תיק", "סה\"כ", "שבוע 1", "שבוע 2", "שבוע 3", "שבוע 4", "שבוע 5+")
+
+    # שורת סיכום כללי — כל הרשומות המטופלות
+    _row(("סה\"כ כולל", st.title), (total_treated, st.data),
+         *((n, st.data) for n in summary["weeks"].values()))
+
+    for cm in summary["case_managers"]:
+        _data(cm["name"], cm["total"], *cm["weeks"].values())
+    _blank()
 
     # ---- טבלה 6: טופ 20 מעסיקים לפי הסלמה ----
-    headers = ["מעסיק", "ח.פ", "סה\"כ", "שבוע 1", "שבוע 2", "שבוע 3", "שבוע 4", "שבוע 5+"]
-    for i, h in enumerate(headers, 1):
-        _tcell(ws, row, i, h)
-    row += 1
-
-    employer_data = defaultdict(lambda: Counter())
-    employer_names = {}
-    for r in all_records:
-        cnum = str(r.get("customer_number") or "—")
-        employer_names[cnum] = r.get("customer_name") or r.get("employer_name") or cnum
-        c = r.get("_raw", {}).get("OnlyOnStatusChange_DatesDiffInWeeks")
-        try:
-            c = int(float(c)) if c is not None else 0
-        except (ValueError, TypeError):
-            c = 0
-        bucket = str(c) if c <= 4 else "5+"
-        employer_data[cnum][bucket] += 1
-
-    top20 = sorted(employer_data.items(), key=lambda x: sum(x[1].values()), reverse=True)[:20]
-    for cnum, buckets in top20:
-        total = sum(buckets.values())
-        row_vals = [
-            employer_names.get(cnum, cnum), cnum, total,
-            buckets.get("1", 0), buckets.get("2", 0),
-            buckets.get("3", 0), buckets.get("4", 0), buckets.get("5+", 0),
-        ]
-        for i, v in enumerate(row_vals, 1):
-            _dcell(ws, row, i, v)
-        row += 1
-
-
-def _build_pipeline_sheet(wb, raw_records, groups, skipped_records, draft_map):
-    """גיליון מעקב pipeline — שורה לכל רשומה גולמית מה-API עם גורל הרשומה."""
-
-    # --- בניית lookups ---
-    # record_id → (classified_record, group_key, draft_id)
-    classified_lookup = {}
-    for g in groups:
-        gk  = g["group_key"]
-        fmt = g["email_format"]
-        sr  = draft_map.get(gk, {})
-        did = sr.get("draft_id")
-        for r in g["records"]:
-            classified_lookup[r["record_id"]] = {
-                "email_format":              fmt,
-                "responsibility":            r.get("responsibility"),
-                "group_key":                 gk,
-                "draft_id":                  did,
-                "routing_path":              r.get("routing_path"),
-                "pre_mail_condition_result": r.get("pre_mail_condition_result"),
-                "pre_mail_condition_field":  r.get("pre_mail_condition_field"),
-                "pre_mail_condition_value":  r.get("pre_mail_condition_value"),
-            }
-
-    # record_id → reason (סונן)
-    skipped_lookup = {}
-    for raw_rec, reason in skipped_records:
-        rid = raw_rec.get("MISPAR_MEZAHE_RESHUMA") or raw_rec.get("record_id")
-        if rid:
-            skipped_lookup[str(rid)] = reason or "סונן"
+    _titles("מעסיק", "ח.פ", "סה\"כ", "שבוע 1", "שבוע 2", "שבוע 3", "שבוע 4", "שבוע 5+")
+    for emp in summary["top_employers"]:
+        _data(emp["name"], emp["customer_number"], emp["total"], *emp["weeks"].values())
 
-    # --- בניית שורות ---
-    rows = []
-    for raw in raw_records:
-        rid = str(raw.get("MISPAR_MEZAHE_RESHUMA") or "")
-        cl  = classified_lookup.get(rid)
-        sk  = skipped_lookup.get(rid)
-
-        if cl:
-            action = "טופל"
-            reason = ""
-            fmt    = cl["email_format"]
-            resp   = cl["responsibility"]
-            gk     = cl["group_key"]
-            did    = cl["draft_id"]
-            path   = cl["routing_path"]
-        elif sk is not None:
-            action = "סונן"
-            reason = sk
-            fmt = resp = gk = did = path = ""
-        else:
-            action = "לא ידוע"
-            reason = fmt = resp = gk = did = path = ""
-
-        row_dict = dict(raw)  # כל שדות ה-API כפי שהגיעו
-        pmc_result = cl.get("pre_mail_condition_result") if cl else None
-        row_dict.update({
-            "פעולה":                       action,
-            "סיבת סינון":                  reason,
-            "email_format":                fmt,
-            "אחריות":                      resp,
-            "group_key":                   gk,
-            "draft_id":                    did,
-            "routing_path":                path,
-            "pre_mail_condition_field":    cl.get("pre_mail_condition_field") if cl else None,
-            "pre_mail_condition_result":   ("TRUE" if pmc_result is True else "FALSE" if pmc_result is False else None),
-            "pre_mail_condition_value":    cl.get("pre_mail_condition_value") if cl else None,
-        })
-        rows.append(row_dict)
-
-    ws_name = "מעקב pipeline"
-    df = pd.DataFrame(rows)
-
-    # כתיבה זמנית דרך BytesIO כדי להוסיף לחוברת הקיימת
-    tmp = io.BytesIO()
-    with pd.ExcelWriter(tmp, engine="openpyxl") as w:
-        df.to_excel(w, sheet_name=ws_name, index=False)
-    tmp.seek(0)
-    src_wb = load_workbook(tmp)
-    src_ws = src_wb[ws_name]
-
-    # העברת הגיליון לחוברת הראשית
-    tgt_ws = wb.create_sheet(ws_name)
-    tgt_ws.sheet_view.rightToLeft = True
-    for row in src_ws.iter_rows(values_only=True):
-        tgt_ws.append(list(row))
-
-    # עיצוב בסיסי
-    H_FILL = PatternFill("solid", start_color="1F4E79", end_color="1F4E79")
-    H_FONT = Font(bold=True, color="FFFFFF", name="Arial", size=10)
-    D_FONT = Font(name="Arial", size=10)
-    RIGHT  = Alignment(horizontal="right", vertical="center")
-    CENTER = Alignment(horizontal="center", vertical="center")
-
-    for cell in tgt_ws[1]:
-        cell.font = H_FONT; cell.fill = H_FILL; cell.alignment = CENTER
-    for row in tgt_ws.iter_rows(min_row=2):
-        for cell in row:
-            cell.font = D_FONT; cell.alignment = RIGHT
-
-    for col_cells in tgt_ws.columns:
-        max_len = max((len(str(c.value or "")) for c in col_cells), default=10)
-        tgt_ws.column_dimensions[get_column_letter(col_cells[0].column)].width = min(max_len + 4, 40)
-
-    tgt_ws.freeze_panes = "A2"
-
-
-def build_case_manager_reports(groups, send_results, skipped_records=None, run_date=None):
+
+PIPELINE_COLUMNS = [
+    "פעולה", "סיבת סינון", "email_format", "אחריות", "group_key", "draft_id", "routing_path",
+    "pre_mail_condition_field", "pre_mail_condition_result", "pre_mail_condition_value",
+]
+
+
+def _build_pipeline_sheet(wb, raw_records, classified_lookup, skipped_lookup):
+    """
+    גיליון מעקב pipeline — שורה לכל רשומה גולמית מה-API עם גורל הרשומה.
+    עמודות: כל שדות ה-API לפי סדר הופעה, ואחריהן PIPELINE_COLUMNS.
+    השורות נכתבות ישירות לגיליון (generator) — בלי DataFrame ובלי רשימת שורות בזיכרון.
+    """
+    fields  = list(dict.fromkeys(k for raw in raw_records for k in raw if k not in PIPELINE_COLUMNS))
+    columns = fields + PIPELINE_COLUMNS
+
+    def _rows():
+        for raw in raw_records:
+            rid = str(raw.get("MISPAR_MEZAHE_RESHUMA") or "")
+            cl  = classified_lookup.get(rid)
+
+            if cl:
+                fmt, gk, did, r = cl
+                pmc_result = r.get("pre_mail_condition_result")
+                track = (
+                    "טופל", "", fmt, r.get("responsibility"), gk, did, r.get("routing_path"),
+                    r.get("pre_mail_condition_field"),
+                    "TRUE" if pmc_result is True else "FALSE" if pmc_result is False else None,
+                    r.get("pre_mail_condition_value"),
+                )
+            else:
+                sk = skipped_lookup.get(rid)
+                if sk is not None:
+                    track = ("סונן", sk, "", "", "", "", "", None, None, None)
+                else:
+                    track = ("לא ידוע", "", "", "", "", "", "", None, None, None)
+
+            yield [raw.get(k) for k in fields] + list(track)
+
+    _write_table(wb, "מעקב pipeline", columns, _rows(), max_width=40)
+
+
+def build_case_manager_reports(groups, send_results, skipped_records=None, run_date=None, processes=0):
     """
     מייצר Excel נפרד לכל מנהלת תיק עם אותם גיליונות כמו build_run_report אבל מסונן.
-    מחזיר רשימת dicts: [{"email": str, "name": str, "report_b64": str}, ...]
+    processes : >1 → כל workbook נבנה ב-ProcessPoolExecutor (עד processes workers), 0 = באותו process.
+    מחזיר רשימת dicts: [{"email": str, "name": str, "report_b64": str, "summary": dict}, ...]  (אותו סדר בשני המצבים)
+    summary — פלט summarize_run על הנתונים של המנהלת (אותו סיכום שבגיליון הדשבורד שלה).
     """
     import base64
-    run_date   = run_date or datetime.now()
-    draft_map  = {r["group_key"]: r for r in (send_results or [])}
+    run_date  = run_date or datetime.now()
+    draft_map = {r["group_key"]: r for r in (send_results or [])}
+    parts     = _partition_by_case_manager(groups, skipped_records or [])
+
+    # לכל מנהלת תיק: (groups מסוננות, send_results של הקבוצות שלה, skipped, raw, run_date)
+    tasks = [
+        (cm_groups,
+         [draft_map[g["group_key"]] for g in cm_groups if g["group_key"] in draft_map],
+         cm_skipped, cm_raw, run_date)
+        for cm_groups, cm_skipped, cm_raw, _ in parts.values()
+    ]
+
+    if processes and processes > 1 and len(tasks) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # forkserver — ה-workers לא יורשים (fork) את ה-threads ואת הזיכרון של ה-process הראשי
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks)),
+                                 mp_context=multiprocessing.get_context("forkserver")) as pool:
+            reports = list(pool.map(_build_case_manager_report, tasks))
+    else:
+        reports = [_build_case_manager_report(t) for t in tasks]
+
+    return [
+        {
+            "email":      cm_email,
+            "name":       name,
+            "report_b64": base64.b64encode(report_bytes).decode("utf-8"),
+            "summary":    summary,
+        }
+        for (cm_email, (_, _, _, name)), (report_bytes, summary) in zip(parts.items(), reports)
+    ]
+
+
+def _partition_by_case_manager(groups, skipped_records):
+    """
+    אינדקס לפי CustomerAccountManagerEmail — מעבר אחד על הרשומות ומעבר אחד על המוחרגות.
+    מחזיר {email: (groups, skipped, raw_records, name)} לפי סדר ההופעה הראשונה של המנהלת:
+      groups  — כל קבוצה שיש בה רשומה של המנהלת (פעם אחת לכל group_key); קבוצת מנהלת תיק
+                מצומצמת לרשומות של המנהלת בלבד, קבוצה חיצונית נשארת מלאה
+      raw     — _raw של רשומות המנהלת בקבוצות האלה (לגיליון מעקב pipeline)
+    """
+    from mapping_loader import FORMAT_CASE_MGR
 
-    # קיבוץ לפי מנהלת תיק (לפי email)
-    cm_groups  = defaultdict(list)
-    cm_names   = {}
+    cm_groups = {}   # email → {group_key: group}
+    cm_raw    = {}   # email → [raw]
+    cm_names  = {}
     for g in groups:
+        by_email = defaultdict(list)
         for r in g["records"]:
             raw = r.get("_raw", {})
             cm_email = raw.get("CustomerAccountManagerEmail") or ""
-            cm_name  = raw.get("CustomerAccountManagerName") or cm_email
             if cm_email:
-                cm_groups[cm_email].append(g)
-                cm_names[cm_email] = cm_name
-
-    # הסר כפילויות קבוצות לכל מנהלת תיק
-    for em in cm_groups:
-        seen = set()
-        unique = []
-        for g in cm_groups[em]:
-            if g["group_key"] not in seen:
-                seen.add(g["group_key"])
-                unique.append(g)
-        cm_groups[em] = unique
+                by_email[cm_email].append(r)
+                cm_names[cm_email] = raw.get("CustomerAccountManagerName") or cm_email
 
-    from mapping_loader import FORMAT_CASE_MGR
+        for cm_email, recs in by_email.items():
+            keyed = cm_groups.setdefault(cm_email, {})
+            if g["group_key"] in keyed:
+                continue
+            keyed[g["group_key"]] = {**g, "records": recs} if g.get("email_format") == FORMAT_CASE_MGR else g
+            cm_raw.setdefault(cm_email, []).extend(r.get("_raw", {}) for r in recs)
 
-    results = []
-    for cm_email, cm_grps in cm_groups.items():
-        # סינון קבוצת מנהלת תיק — רק רשומות של מנהלת תיק זו בלבד
-        filtered_grps = []
-        for g in cm_grps:
-            if g.get("email_format") == FORMAT_CASE_MGR:
-                filtered_records = [
-                    r for r in g["records"]
-                    if (r.get("_raw", {}).get("CustomerAccountManagerEmail") or "") == cm_email
-                ]
-                if filtered_records:
-                    filtered_grps.append({**g, "records": filtered_records})
-            else:
-                filtered_grps.append(g)
-
-        # גיליון pipeline מסונן — רק רשומות של מנהלת תיק זו
-        cm_raw = []
-        for g in filtered_grps:
-            for r in g["records"]:
-                raw = r.get("_raw", {})
-                if (raw.get("CustomerAccountManagerEmail") or "") == cm_email:
-                    cm_raw.append(raw)
-
-        cm_skipped = [
-            (rec, reason) for rec, reason in (skipped_records or [])
-            if (rec.get("CustomerAccountManagerEmail") or "") == cm_email
-        ]
-
-        report_bytes = build_run_report(
-            filtered_grps, send_results,
-            skipped_records=cm_skipped,
-            raw_records=cm_raw,
-            run_date=run_date
-        )
-        results.append({
-            "email":      cm_email,
-            "name":       cm_names[cm_email],
-            "report_b64": base64.b64encode(report_bytes).decode("utf-8"),
-        })
+    cm_skipped = defaultdict(list)
+    for rec, reason in skipped_records:
+        cm_email = rec.get("CustomerAccountManagerEmail") or ""
+        if cm_email in cm_groups:
+            cm_skipped[cm_email].append((rec, reason))
 
-    return results
+    return {
+        cm_email: (list(keyed.values()), cm_skipped.get(cm_email, []), cm_raw[cm_email], cm_names[cm_email])
+        for cm_email, keyed in cm_groups.items()
+    }
+
+
+def _build_case_manager_report(task):
+    """
+    workbook של מנהלת תיק אחת — פונקציה ברמת המודול כדי שתרוץ גם ב-worker process.
+    מחזיר (bytes של Excel, summarize_run).
+    """
+    cm_groups, cm_send_results, cm_skipped, cm_raw, run_date = task
+    summary = summarize_run(cm_groups, cm_skipped)
+    report_bytes = build_run_report(
+        cm_groups, cm_send_results,
+        skipped_records=cm_skipped,
+        raw_records=cm_raw,
+        run_date=run_date,
+        summary=summary,
+    )
+    return report_bytes, summary
@@ -0,0 +1,180 @@
+"""
+status_submitter.py
+-------------------
+שליחת update chunks ל-SetFeedbackStatusBatch ישירות מה-runner (במקום דרך n8n).
+
+  - pool חסום של קריאות במקביל (ברירת מחדל 4)
+  - retry לכל chunk בנפרד — שגיאות רשת / timeout / 5xx / 429 / 408
+  - דו"ח כשלונות חלקי: chunks שנכשלו סופית + רשומות שהשרת דחה
+  - תגובת 2xx שאי אפשר לפענח — ה-chunk נחשב כנקלט (נרשם ב-log), לא נשלח שוב
+
+תגובת SetFeedbackStatusBatch (כמו ב-workflow של n8n):
+  []                               → כל הרשומות נקלטו
+  [{success: false, message, ...}] → רק הרשומות שנכשלו
+
+שימוש:
+  from status_submitter import submit_chunks
+  report = submit_chunks(api_base, token, payload_result["chunks"])
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+log = logging.getLogger(__name__)
+
+SUBMIT_PATH = "/services/AutomationFeedback/SetFeedbackStatusBatch"
+RECORD_ID   = "MISPAR_MEZAHE_RESHUMA"   # מזהה הרשומה ב-payload ובתגובת השרת
+
+DEFAULT_WORKERS     = 4
+DEFAULT_TIMEOUT     = 60
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 5
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+_session_local = threading.local()
+
+
+class SubmitError(Exception):
+    """chunk נדחה סופית (סטטוס שלא מצדיק retry או תגובה לא תקינה)."""
+
+
+# =============================================================================
+# Public API
+# =============================================================================
+
+def submit_chunks(api_base, access_token, chunks, max_workers=DEFAULT_WORKERS,
+                  max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    שולח כל chunk ב-POST אחד ל-SetFeedbackStatusBatch, עד max_workers במקביל.
+
+    מחזיר דו"ח:
+    {
+        "chunks":          int,
+        "ok_chunks":       int,
+        "records":         int,
+        "attempts":        int,
+        "seconds":         float,
+        "failed_chunks":   [ {"index": int, "records": int, "attempts": int, "error": str}, ... ],
+        "record_failures": [ {"chunk_index": int, ...תגובת השרת}, ... ],
+        "rejected":        [ {רשומת payload}, ... ],
+    }
+    index / chunk_index מתחילים מ-0 (מיקום ה-chunk ב-chunks).
+    rejected — רשומות ה-payload שהשרת החזיר עבורן success=false (לפי MISPAR_MEZAHE_RESHUMA),
+    לפי סדר ה-chunks; כשלון בלי מזהה מוכר נשאר רק ב-record_failures.
+    """
+    t0 = time.time()
+    outcomes = [None] * len(chunks)
+
+    if chunks:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            futures = [
+                executor.submit(_submit_chunk, api_base, access_token, chunk, max_retries, retry_delay)
+                for chunk in chunks
+            ]
+            for i, future in enumerate(futures):
+                outcomes[i] = future.result()
+
+    report = {
+        "chunks":          len(chunks),
+        "ok_chunks":       0,
+        "records":         sum(len(c) for c in chunks),
+        "attempts":        0,
+        "seconds":         0.0,
+        "failed_chunks":   [],
+        "record_failures": [],
+        "rejected":        [],
+    }
+    for i, (chunk, (attempts, failures, error)) in enumerate(zip(chunks, outcomes)):
+        report["attempts"] += attempts
+        if error is not None:
+            report["failed_chunks"].append({"index": i, "records": len(chunk), "attempts": attempts, "error": error})
+            continue
+        report["ok_chunks"] += 1
+        report["record_failures"].extend(dict(f, chunk_index=i) for f in failures)
+        report["rejected"].extend(_rejected_records(chunk, failures))
+
+    report["seconds"] = round(time.time() - t0, 2)
+    if report["failed_chunks"] or report["record_failures"]:
+        log.warning(f"SetFeedbackStatusBatch: {len(report['failed_chunks'])}/{len(chunks)} chunks נכשלו, "
+                    f"{len(report['record_failures'])} רשומות נדחו")
+    return report
+
+
+def failed_chunks(chunks, report):
+    """ה-chunks שנכשלו סופית — למסירה חזרה ל-caller (n8n) כ-update_chunks."""
+    return [chunks[f["index"]] for f in report["failed_chunks"]]
+
+
+# =============================================================================
+# Internal
+# =============================================================================
+
+def _session():
+    """requests.Session אחד לכל thread — שימוש חוזר בחיבורי TCP/TLS בין chunks."""
+    s = getattr(_session_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        _session_local.session = s
+    return s
+
+
+def _submit_chunk(api_base, access_token, chunk, max_retries, retry_delay):
+    """POST של chunk אחד עם retry. מחזיר (attempts, record_failures, error | None)."""
+    last_error = None
+    for attempt in range(1, max_retries + 1):
+        if attempt > 1:
+            log.warning(f"  SetFeedbackStatusBatch retry {attempt}/{max_retries} (ממתין {retry_delay}s)")
+            time.sleep(retry_delay)
+        try:
+            resp = _session().post(
+                f"{api_base}{SUBMIT_PATH}",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type":  "application/json",
+                    "api_version":   "1.0",
+                },
+                json=chunk,
+                timeout=DEFAULT_TIMEOUT,
+            )
+            if resp.status_code in RETRY_STATUSES:
+                last_error = f"HTTP {resp.status_code}"
+                continue
+            if resp.status_code >= 400:
+                raise SubmitError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            return attempt, _record_failures(resp), None
+
+        except SubmitError as e:
+            return attempt, [], str(e)
+        except (requests.RequestException, ValueError) as e:
+            last_error = str(e)
+
+    return max_retries, [], last_error
+
+
+def _record_failures(resp):
+    """
+    רשומות עם success=false מתגובת השרת (גוף ריק / {} / [] → אין כשלונות).
+    גוף שאינו JSON ב-2xx: השרת קיבל את ה-chunk — נרשם ב-log ונחשב כנקלט.
+    """
+    if not resp.content or not resp.content.strip():
+        return []
+    try:
+        data = resp.json()
+    except ValueError:
+        log.warning(f"SetFeedbackStatusBatch: HTTP {resp.status_code} עם גוף שאינו JSON — "
+                    f"ה-chunk נחשב כנקלט: {resp.text[:200]!r}")
+        return []
+    if not isinstance(data, list):
+        return []
+    return [item for item in data if isinstance(item, dict) and item.get("success") is False]
+
+
+def _rejected_records(chunk, failures):
+    """רשומות ה-chunk שהשרת דחה — התאמה לפי MISPAR_MEZAHE_RESHUMA, לפי סדר ה-chunk."""
+    ids = {str(f.get(RECORD_ID)) for f in failures if f.get(RECORD_ID) is not None}
+    return [rec for rec in chunk if str(rec.get(RECORD_ID)) in ids]
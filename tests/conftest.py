@@ -0,0 +1,113 @@
+"""
+conftest.py
+-----------
+המודולים יושבים בשורש הריפו (flat) — מוסיף אותו ל-sys.path כדי ש-tests יוכלו לייבא אותם.
+fake_gmail — GmailClients מול תעבורת Gmail מזויפת (gmail_sender / draft_journal).
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from email import policy as _policy
+from email.parser import BytesParser
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# --- Gmail מזויף (בלי רשת) ---
+
+
+class FakeGmail:
+    """
+    תעבורת Gmail מזויפת ל-GmailClients: כל בקשה (בודדת או batch) נרשמת ב-calls, נספרות בקשות
+    מקבילות לכל תיבה (max_inflight), ו-drafts.create מחזיר id חדש ("d1", "d2", ...).
+    item_status(mailbox, n) → סטטוס HTTP לפריט ה-n בתוך batch (ברירת מחדל 200).
+    """
+
+    service_account = {"client_email": "sa@test.iam.gserviceaccount.com", "private_key_id": "k1"}
+
+    def __init__(self, latency=0.0, item_status=None):
+        self.latency      = latency
+        self.item_status  = item_status or (lambda mailbox, n: 200)
+        self.lock         = threading.Lock()
+        self.calls        = []   # (mailbox, "single" | "batch", מספר פריטים)
+        self.inflight     = {}
+        self.max_inflight = {}
+        self.drafts       = 0
+        self.batch_items  = 0
+
+    def http(self, mailbox):
+        return _FakeHttp(self, mailbox)
+
+    def requests(self, kind=None):
+        return [c for c in self.calls if kind is None or c[1] == kind]
+
+    def _new_draft(self):
+        with self.lock:
+            self.drafts += 1
+            return {"id": f"d{self.drafts}"}
+
+
+class _FakeHttp:
+    def __init__(self, gmail, mailbox):
+        self.gmail, self.mailbox = gmail, mailbox
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        import httplib2
+        g = self.gmail
+        batch = "/batch" in uri
+        body = body if isinstance(body, bytes) else (body or "").encode("utf-8")
+        parts = self._batch_parts(body, headers) if batch else None
+        with g.lock:
+            g.calls.append((self.mailbox, "batch" if batch else "single", len(parts) if batch else 1))
+            g.inflight[self.mailbox] = g.inflight.get(self.mailbox, 0) + 1
+            g.max_inflight[self.mailbox] = max(g.max_inflight.get(self.mailbox, 0), g.inflight[self.mailbox])
+        try:
+            if g.latency:
+                time.sleep(g.latency)
+            if not batch:
+                return (httplib2.Response({"status": 200, "content-type": "application/json"}),
+                        json.dumps(g._new_draft()).encode())
+            boundary = "batch_fake"
+            out = []
+            for content_id in parts:
+                with g.lock:
+                    g.batch_items += 1
+                    n = g.batch_items
+                status = g.item_status(self.mailbox, n)
+                payload = g._new_draft() if status == 200 else {"error": {"code": status, "message": "fake"}}
+                out.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                           f"Content-ID: <response-{content_id}>\r\n\r\n"
+                           f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n\r\n"
+                           f"{json.dumps(payload)}\r\n")
+            out.append(f"--{boundary}--\r\n")
+            return (httplib2.Response({"status": 200, "content-type": f"multipart/mixed; boundary={boundary}"}),
+                    "".join(out).encode())
+        finally:
+            with g.lock:
+                g.inflight[self.mailbox] -= 1
+
+    @staticmethod
+    def _batch_parts(body, headers):
+        msg = BytesParser(policy=_policy.compat32).parsebytes(
+            b"Content-Type: " + headers["content-type"].encode() + b"\r\n\r\n" + body)
+        return [part["Content-ID"][1:-1] for part in msg.get_payload()]
+
+
+@pytest.fixture
+def fake_gmail(monkeypatch):
+    """GmailClients עם FakeGmail במקום httplib2 ו-credentials אנונימיים; הלקוחות השמורים מתאפסים."""
+    import gmail_client
+    from google.auth.credentials import AnonymousCredentials
+
+    gmail = FakeGmail()
+    monkeypatch.setattr(gmail_client.GmailClients, "http", lambda self, mailbox: gmail.http(mailbox))
+    monkeypatch.setattr(gmail_client.GmailClients, "credentials", lambda self, mailbox: AnonymousCredentials())
+    monkeypatch.delenv("TEST_GMAIL_IMPERSONATE", raising=False)
+    gmail_client.clear_clients()
+    yield gmail
+    gmail_client.clear_clients()
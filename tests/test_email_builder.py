@@ -0,0 +1,186 @@
+"""email_builder — iter_emails / build_all_emails (סטטיסטיקות בנייה, process pool)."""
+
+import os
+import sys
+
+import pytest
+
+from mapping_loader import load_mapping, FORMAT_EMPLOYER
+from record_classifier import classify_all, apply_post_routing
+from record_grouper import group_records
+from email_builder import build_all_emails, iter_emails
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from bench_engine import synthetic_mapping, synthetic_records   # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def built():
+    """(groups, mapping) מנתונים סינתטיים + קבוצת מעסיק שבורה אחת (records=None) שהבנייה שלה נכשלת."""
+    mapping = load_mapping(synthetic_mapping())
+    classified, _ = classify_all(synthetic_records(6000, mapping["error_codes"].keys()), mapping)
+    groups = group_records(apply_post_routing(classified))
+    groups.insert(3, {"group_key": "broken", "email_format": FORMAT_EMPLOYER, "records": None, "meta": {}})
+    return groups, mapping
+
+
+def _strip(results):
+    """(group_key, content בלי producers של קבצים מצורפים) — להשוואה בין inline ל-pool."""
+    out = []
+    for g, content in results:
+        content = dict(content or {})
+        content.pop("attachments", None)
+        out.append((g["group_key"], content))
+    return out
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_iter_emails_stats(built, processes):
+    groups, mapping = built
+    assert len(groups) > 100   # מעל chunk אחד — עם processes=2 הבנייה באמת עוברת ל-pool
+
+    stats   = {}
+    results = list(iter_emails(groups, mapping, processes=processes, stats=stats))
+    assert stats["skipped"] == 1
+    assert stats["built"] == len(results) == len(groups) - 1
+    assert stats["seconds"] > 0
+    assert "broken" not in [g["group_key"] for g, _ in results]
+
+    expected, skipped = build_all_emails(groups, mapping)
+    assert skipped == 1
+    assert _strip(results) == _strip(expected)
+
+
+def test_build_all_emails_fills_stats(built):
+    groups, mapping = built
+    stats = {}
+    results, skipped = build_all_emails(groups, mapping, stats=stats)
+    assert stats["skipped"] == skipped == 1
+    assert stats["built"] == len(results)
+
+
+def test_employer_digest_is_lazy(built, monkeypatch):
+    """ה-digest של הקובץ למעסיק לא מחושב בבנייה — רק כש-content_hash מבקש אותו, ואז זהה לשורות הקובץ."""
+    import email_builder
+    from draft_journal import content_hash
+
+    groups, mapping = built
+    group = next(g for g in groups if g["email_format"] == FORMAT_EMPLOYER and g["records"])
+
+    calls = []
+    rows_digest = email_builder._rows_digest
+    monkeypatch.setattr(email_builder, "_rows_digest", lambda rows: calls.append(1) or rows_digest(rows))
+    content = email_builder.build_email(group, mapping)
+    att = content["attachments"][0]
+    assert callable(att["digest"]) and calls == []
+
+    h = content_hash(content, "cm@x")
+    assert calls == [1]
+    eager = dict(content, attachments=[dict(att, digest=rows_digest(email_builder._employer_rows(group["records"])))])
+    assert content_hash(eager, "cm@x") == h
+
+
+def test_pool_resolves_digest(built):
+    """מה-pool חוזרים bytes ו-digest מחושב (לא partial שמחזיק את ה-records), עם אותו content_hash."""
+    from draft_journal import content_hash
+
+    groups, mapping = built
+    inline = {g["group_key"]: content for g, content in build_all_emails(groups, mapping)[0]}
+    pooled = list(iter_emails(groups, mapping, processes=2))
+    assert any(content and content["attachments"] for _, content in pooled)
+    for g, content in pooled:
+        for att in content["attachments"] if content else []:
+            assert isinstance(att["data"], bytes)
+            assert not callable(att.get("digest"))
+        if content:
+            assert content_hash(content, "cm@x") == content_hash(inline[g["group_key"]], "cm@x")
+
+
+# --- HTML escaping ---
+
+NASTY = """<b x='1'>&"שם"</b>"""
+NASTY_ESCAPED = "&lt;b x=&#x27;1&#x27;&gt;&amp;&quot;שם&quot;&lt;/b&gt;"
+
+
+def _nasty_record(**kw):
+    rec = {
+        "employee_id":           NASTY,
+        "full_name":             NASTY,
+        "error_description":     NASTY,
+        "explanation_employer":  NASTY,
+        "fund_institution_name": NASTY,
+        "fund_institution_type": NASTY,
+        "original_file_name":    NASTY,
+        "customer_number":       "500000001",
+        "_raw":                  {"CHODESH_MASKORET": NASTY},
+    }
+    rec.update(kw)
+    return rec
+
+
+def _assert_escaped(html_text, expected_count):
+    assert NASTY not in html_text
+    assert "&amp;lt;" not in html_text and "&amp;amp;" not in html_text   # בלי escape כפול
+    assert html_text.count(NASTY_ESCAPED) == expected_count
+
+
+def test_employer_table_escapes():
+    from email_builder import _employer_table
+    # ת.ז, שם, קופה, סוג, תיאור, הסבר, חודש שכר
+    _assert_escaped(_employer_table([_nasty_record()]), 7)
+
+
+@pytest.mark.parametrize("include_chodesh", [False, True])
+def test_employees_table_escapes(include_chodesh):
+    from email_builder import _collect_employees, _employees_table
+    employees = _collect_employees([_nasty_record()], include_chodesh=include_chodesh)
+    _assert_escaped(_employees_table(employees, include_chodesh=include_chodesh), 4 if include_chodesh else 3)
+
+
+@pytest.mark.parametrize("fmt", ["FORMAT_MOSADI_1", "FORMAT_MOSADI_2", "FORMAT_MOSADI_3", "FORMAT_EMPLOYER"])
+def test_build_email_bodies_escape(fmt):
+    import mapping_loader
+    from email_builder import build_email
+
+    group = {
+        "group_key":    "k",
+        "email_format": getattr(mapping_loader, fmt),
+        "records":      [_nasty_record()],
+        "meta":         {"customer_number": NASTY, "customer_name": NASTY, "fund_institution_name": NASTY},
+    }
+    body = build_email(group, {})["body_html"]
+    assert NASTY not in body
+    assert "&amp;lt;" not in body and "&amp;amp;" not in body
+    assert NASTY_ESCAPED in body
+    if fmt != "FORMAT_EMPLOYER":
+        assert f"<li>{NASTY_ESCAPED}</li>" in body   # שם הקובץ ברשימת הקבצים
+
+
+def test_ul_list_callers_pass_raw_values():
+    """
+    _ul_list עושה escape לפריטים — כל קורא שלו חייב להעביר ערכי רשומה גולמיים ולא HTML מוכן.
+    בודק במקור שכל קריאה מעבירה שם שהוגדר באותה פונקציה כ-sorted({r.get(...) ...}).
+    """
+    import ast
+    import inspect
+    import email_builder
+
+    tree  = ast.parse(inspect.getsource(email_builder))
+    calls = 0
+    for fn in ast.walk(tree):
+        if not isinstance(fn, ast.FunctionDef) or fn.name == "_ul_list":
+            continue
+        assigned = {t.id: node.value for node in ast.walk(fn) if isinstance(node, ast.Assign)
+                    for t in node.targets if isinstance(t, ast.Name)}
+        for call in ast.walk(fn):
+            if not (isinstance(call, ast.Call) and getattr(call.func, "id", None) == "_ul_list"):
+                continue
+            calls += 1
+            arg = call.args[0]
+            assert isinstance(arg, ast.Name), f"{fn.name}: _ul_list עם ביטוי במקום ערכי רשומה"
+            value = assigned[arg.id]
+            assert isinstance(value, ast.Call) and value.func.id == "sorted", fn.name
+            comp = value.args[0]
+            assert isinstance(comp, ast.SetComp), fn.name
+            assert isinstance(comp.elt, ast.Call) and comp.elt.func.attr == "get", fn.name
+    assert calls == 3
@@ -0,0 +1,49 @@
+"""בדיקות ל-gmail_client — על איזו שגיאה מותר לנסות שוב בקשה לא idempotent."""
+
+import pytest
+
+from gmail_client import retry_reason, maybe_executed
+
+
+class _Resp(dict):
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+
+
+class _HttpError(Exception):
+    def __init__(self, status, reason=None):
+        super().__init__(f"{status} {reason}")
+        self.resp = _Resp(status)
+        self.error_details = [{"reason": reason}] if reason else []
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (_HttpError(429), "429"),
+    (_HttpError(429, "userRateLimitExceeded"), "userRateLimitExceeded"),
+    (_HttpError(403, "rateLimitExceeded"), "rateLimitExceeded"),
+    (_HttpError(403, "insufficientPermissions"), None),
+    (_HttpError(400), None),
+    (_HttpError(500), None),
+    (_HttpError(503), None),
+    (ConnectionError("reset"), None),
+])
+def test_non_idempotent_retries_only_rate_limits(exc, expected):
+    assert retry_reason(exc) == expected
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_idempotent_retries_server_errors(status):
+    assert retry_reason(_HttpError(status), idempotent=True) == str(status)
+
+
+@pytest.mark.parametrize("exc, expected", [
+    (_HttpError(500), True),
+    (_HttpError(503), True),
+    (ConnectionError("reset"), True),
+    (_HttpError(429), False),
+    (_HttpError(403, "rateLimitExceeded"), False),
+    (_HttpError(400), False),
+])
+def test_maybe_executed(exc, expected):
+    assert maybe_executed(exc) is expected
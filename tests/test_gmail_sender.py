@@ -0,0 +1,161 @@
+"""gmail_sender.send_all_groups מול תעבורת Gmail מזויפת (fake_gmail ב-conftest)."""
+
+import pytest
+
+from draft_journal import DraftJournal
+from gmail_sender import send_all_groups
+
+MAILBOXES = ["cm1@x.co.il", "cm2@x.co.il", "cm3@x.co.il"]
+
+
+def _emails(n, mailboxes=MAILBOXES, attachment=True):
+    """n מיילים (group, content) לסירוגין בין התיבות; לחלקם קובץ מצורף lazy עם digest."""
+    out = []
+    for i in range(n):
+        group = {"group_key": f"g{i}", "email_format": "מעסיק", "records": [{"record_id": f"r{i}"}]}
+        content = {
+            "subject":   f"נושא {i}",
+            "body_html": f"<p>גוף {i}</p>",
+            "to_email":  f"emp{i}@x.co.il",
+            "cc_email":  None,
+            "account_manager_email": mailboxes[i % len(mailboxes)],
+            "attachments": [],
+        }
+        if attachment and i % 2:
+            content["attachments"].append({
+                "filename": f"f{i}.xlsx", "mimetype": "application/octet-stream",
+                "data": lambda i=i: f"data {i}".encode(), "digest": lambda i=i: f"digest {i}",
+            })
+        out.append((group, content))
+    return out
+
+
+def _ids(results):
+    return [(r["group_key"], r["draft_id"]) for r in results]
+
+
+# --- יומן drafts (run_id) ---
+
+@pytest.mark.parametrize("batch_size", [0, 5])
+def test_journal_rerun_reuses_drafts(fake_gmail, tmp_path, batch_size):
+    path   = str(tmp_path / "journal.sqlite3")
+    emails = _emails(12)
+
+    with DraftJournal(path, "run-1") as journal:
+        first, _ = send_all_groups(emails, fake_gmail.service_account, "", batch_size=batch_size, journal=journal)
+    assert all(r["ok"] for r in first)
+    assert len({r["draft_id"] for r in first}) == 12
+    calls = len(fake_gmail.calls)
+    assert calls > 0
+    assert bool(fake_gmail.requests("batch")) == bool(batch_size)
+
+    # אותו run_id, אותו תוכן — אותם draft_id, בלי אף בקשת HTTP
+    stats = {}
+    with DraftJournal(path, "run-1") as journal:
+        again, _ = send_all_groups(_emails(12), fake_gmail.service_account, "", batch_size=batch_size,
+                                   journal=journal, stats=stats)
+    assert _ids(again) == _ids(first)
+    assert len(fake_gmail.calls) == calls
+    assert stats["journal_hits"] == 12 and stats["http_requests"] == 0
+
+    # קבוצה שהתוכן שלה השתנה (גוף / digest של הקובץ המצורף) מקבלת draft חדש; השאר נשארים
+    changed = _emails(12)
+    changed[2][1]["body_html"] += "<p>עדכון</p>"
+    changed[3][1]["attachments"][0]["digest"] = lambda: "digest 3 v2"
+    with DraftJournal(path, "run-1") as journal:
+        third, _ = send_all_groups(changed, fake_gmail.service_account, "", batch_size=batch_size,
+                                   journal=journal, stats=stats)
+    assert stats["journal_hits"] == 10
+    fresh = {r["group_key"] for r, old in zip(third, first) if r["draft_id"] != old["draft_id"]}
+    assert fresh == {"g2", "g3"}
+    assert all(r["ok"] for r in third)
+
+    # run_id אחר — לא ממחזר drafts של ריצה אחרת
+    with DraftJournal(path, "run-2") as journal:
+        other, _ = send_all_groups(_emails(12), fake_gmail.service_account, "", batch_size=batch_size,
+                                   journal=journal, stats=stats)
+    assert stats["journal_hits"] == 0
+    assert not {r["draft_id"] for r in other} & {r["draft_id"] for r in first}
+
+
+def test_journal_resume_after_partial_run(fake_gmail, tmp_path):
+    """ריצה שנקטעה אחרי חלק מהקבוצות — הריצה החוזרת יוצרת רק את החסרים."""
+    path   = str(tmp_path / "journal.sqlite3")
+    emails = _emails(10)
+    with DraftJournal(path, "run-1") as journal:
+        first, _ = send_all_groups(emails[:4], fake_gmail.service_account, "", journal=journal)
+
+    stats = {}
+    with DraftJournal(path, "run-1") as journal:
+        full, _ = send_all_groups(iter(_emails(10)), fake_gmail.service_account, "", journal=journal,
+                                  stats=stats, window=3)
+    assert _ids(full)[:4] == _ids(first)
+    assert stats["journal_hits"] == 4 and stats["http_requests"] == 6
+    assert [r["group_key"] for r in full] == [f"g{i}" for i in range(10)]
+
+
+# --- לקוחות משותפים (GmailClients) ---
+
+def test_second_run_reuses_services(fake_gmail):
+    stats = {}
+    send_all_groups(_emails(9), fake_gmail.service_account, "", stats=stats)
+    assert stats["services_built"] == len(MAILBOXES)
+    assert stats["ok"] == 9
+
+    send_all_groups(_emails(9), fake_gmail.service_account, "", stats=stats)
+    assert stats["services_built"] == 0
+    assert stats["ok"] == 9
+
+
+@pytest.mark.parametrize("concurrency", [1, 3])
+def test_mailbox_concurrency_caps_inflight(fake_gmail, concurrency):
+    fake_gmail.latency = 0.02
+    results, _ = send_all_groups(_emails(36), fake_gmail.service_account, "", max_workers=20,
+                                 mailbox_concurrency=concurrency)
+    assert all(r["ok"] for r in results)
+    assert set(fake_gmail.max_inflight) == set(MAILBOXES)
+    assert max(fake_gmail.max_inflight.values()) == concurrency   # 20 threads, 12 מיילים לתיבה
+
+
+# --- batch HTTP ---
+
+def test_batches_capped_and_counted(fake_gmail, monkeypatch):
+    import gmail_client
+    from gmail_sender import GMAIL_BATCH_MAX
+
+    monkeypatch.setattr(gmail_client, "MAILBOX_RATE", 1e6)   # 280 units — בלי המתנה ל-token bucket
+
+    emails = _emails(250, mailboxes=["a@x.co.il"], attachment=False) + \
+        [(dict(g, group_key=f"b{i}"), dict(c, account_manager_email="b@x.co.il"))
+         for i, (g, c) in enumerate(_emails(30, attachment=False))]
+    stats = {}
+    results, _ = send_all_groups(emails, fake_gmail.service_account, "", batch_size=500, stats=stats)
+
+    batches = fake_gmail.requests("batch")
+    assert sorted(n for _, _, n in batches) == [30, 50, 100, 100]
+    assert all(n <= GMAIL_BATCH_MAX for _, _, n in batches)
+    assert not fake_gmail.requests("single")
+    assert stats["batches"] == 4 and stats["http_requests"] == 4 and stats["fallbacks"] == 0
+    assert [r["group_key"] for r in results] == [g["group_key"] for g, _ in emails]
+    assert all(r["ok"] for r in results)
+
+
+def test_batch_fallbacks_keep_input_order(fake_gmail):
+    """
+    פריט שנדחה ב-batch (429) נשלח שוב כבקשה בודדת; פריט שנכשל ב-5xx לא נשלח שוב (ייתכן
+    שה-draft נוצר) ומדווח כשגיאה. התוצאות נשארות לפי סדר הקלט.
+    """
+    fake_gmail.item_status = lambda mailbox, n: 429 if n % 7 == 0 else 503 if n % 11 == 0 else 200
+    emails = _emails(60)
+    stats  = {}
+    results, _ = send_all_groups(emails, fake_gmail.service_account, "", batch_size=10, stats=stats)
+
+    assert [r["group_key"] for r in results] == [g["group_key"] for g, _ in emails]
+    rejected = [r for r in results if not r["ok"]]
+    fallbacks = len(fake_gmail.requests("single"))
+    assert fallbacks == stats["fallbacks"] == 60 // 7
+    assert len(rejected) == len([n for n in range(1, 61) if n % 11 == 0 and n % 7])
+    assert all("לא נשלח שוב" in r["error"] for r in rejected)
+    assert stats["batches"] == len(fake_gmail.requests("batch")) == 6   # 20 לתיבה → 2 batches × 3 תיבות
+    assert stats["http_requests"] == 6 + fallbacks
+    assert len({r["draft_id"] for r in results if r["ok"]}) == 60 - len(rejected)
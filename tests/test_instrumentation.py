@@ -0,0 +1,164 @@
+"""instrumentation — StageRecorder, פורמט Prometheus של MetricsRegistry, ו-GET /metrics."""
+
+import re
+
+import pytest
+
+from instrumentation import MetricsRegistry, StageRecorder, REGISTRY, render_metrics
+
+_NAME = re.compile(r"^[a-zA-Z_:][a-zA-Z0-9_:]*$")
+
+
+def _registry():
+    """registry חדש עם אותן הגדרות כמו REGISTRY — בלי ערכים מבדיקות / ריצות אחרות."""
+    reg = MetricsRegistry()
+    for name, (kind, help_text, buckets) in REGISTRY._meta.items():
+        reg.describe(name, kind, help_text, buckets)
+    return reg
+
+
+def _samples(text):
+    """{"name{labels}": value} מכל שורות הדגימה."""
+    out = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            key, value = line.rsplit(" ", 1)
+            out[key] = float(value)
+    return out
+
+
+# --- Prometheus text ---
+
+def test_render_text_format():
+    reg = MetricsRegistry()
+    reg.describe("jobs_total", "counter", "Jobs by result")
+    reg.describe("queue_depth", "gauge", "Queued jobs")
+    reg.describe("job_duration_seconds", "histogram", "Job wall time", (0.5, 1, 5))
+    reg.inc("jobs_total", 2, result="ok")
+    reg.inc("jobs_total", 1, result='a"b\\c\nd')
+    reg.set("queue_depth", 3)
+    for v in (0.2, 0.7, 3.0, 9.0):
+        reg.observe("job_duration_seconds", v, stage="send")
+
+    assert reg.render() == "\n".join([
+        "# HELP jobs_total Jobs by result",
+        "# TYPE jobs_total counter",
+        'jobs_total{result="ok"} 2',
+        'jobs_total{result="a\\"b\\\\c\\nd"} 1',
+        "# HELP queue_depth Queued jobs",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+        "# HELP job_duration_seconds Job wall time",
+        "# TYPE job_duration_seconds histogram",
+        'job_duration_seconds_bucket{stage="send",le="0.5"} 1',
+        'job_duration_seconds_bucket{stage="send",le="1"} 2',
+        'job_duration_seconds_bucket{stage="send",le="5"} 3',
+        'job_duration_seconds_bucket{stage="send",le="+Inf"} 4',
+        'job_duration_seconds_sum{stage="send"} 12.9',
+        'job_duration_seconds_count{stage="send"} 4',
+    ]) + "\n"
+
+
+def test_metric_names_follow_prometheus_conventions():
+    text = render_metrics()
+    types = dict(re.findall(r"^# TYPE (\S+) (\S+)$", text, re.M))
+    assert types == {name: kind for name, (kind, _, _) in REGISTRY._meta.items()}
+    for name, kind in types.items():
+        assert _NAME.match(name), name
+        if kind == "counter":
+            assert name.endswith("_total"), name
+        else:
+            assert not name.endswith("_total"), name
+        if kind == "histogram":
+            assert name.endswith("_seconds"), name
+    assert len(re.findall(r"^# HELP ", text, re.M)) == len(types)
+    assert types["pipeline_stage_duration_seconds"] == "histogram"
+
+
+# --- StageRecorder ---
+
+def test_stage_recorder_publishes_closed_stages():
+    reg = _registry()
+    rec = StageRecorder(registry=reg)
+    rec.stage("fetch")
+    rec.records(out=10)
+    rec.stage("classify", records_in=10)
+    rec.records(out=7)
+    rec.finish()
+
+    stages = rec.stages()
+    assert [(s["stage"], s["records_in"], s["records_out"]) for s in stages] == \
+        [("fetch", None, 10), ("classify", 10, 7)]
+    for s in stages:
+        assert s["seconds"] >= 0 and s["cpu_seconds"] >= 0
+
+    samples = _samples(reg.render())
+    assert samples['pipeline_stage_runs_total{stage="fetch"}'] == 1
+    assert samples['pipeline_stage_records_out_total{stage="classify"}'] == 7
+    assert samples['pipeline_stage_records_in_total{stage="classify"}'] == 10
+    assert 'pipeline_stage_records_in_total{stage="fetch"}' not in samples
+    assert samples['pipeline_stage_duration_seconds_count{stage="classify"}'] == 1
+    assert samples['pipeline_stage_duration_seconds_bucket{stage="fetch",le="+Inf"}'] == 1
+
+
+def test_finish_closes_stage_on_early_return():
+    reg = _registry()
+    rec = StageRecorder(registry=reg)
+
+    def _pipeline():
+        rec.stage("mapping")
+        rec.stage("fetch")
+        return "502"          # יציאה מוקדמת — "fetch" נשאר פתוח
+
+    try:
+        _pipeline()
+        assert rec.snapshot()[0] == "fetch"
+    finally:
+        rec.finish()
+
+    assert rec.snapshot()[0] is None
+    assert [s["stage"] for s in rec.stages()] == ["mapping", "fetch"]
+    rec.finish()              # finish שני לא מוסיף שלב
+    rec.records(out=1)        # ואין שלב פתוח לעדכן
+    assert len(rec.stages()) == 2
+    assert _samples(reg.render())['pipeline_stage_runs_total{stage="fetch"}'] == 1
+
+
+def test_runner_closes_stage_when_a_step_fails():
+    import pilot_runner_server_v2 as runner
+
+    params, _ = runner._read_form({"access_token": "t", "api_base": "https://api.example"})
+    rec = StageRecorder(registry=_registry())
+    body, status = runner.run_pipeline_v2(params, b"not an xlsx", rec)
+    assert status == 400 and body["ok"] is False
+    assert [s["stage"] for s in rec.stages()] == ["mapping"]
+    assert rec.snapshot()[0] is None
+
+
+# --- GET /metrics ---
+
+@pytest.fixture
+def client(monkeypatch):
+    import pilot_runner_server_v2 as runner
+    monkeypatch.setenv("API_SECRET_KEY", "s3cret")
+    monkeypatch.delenv("METRICS_PUBLIC", raising=False)
+    return runner.app.test_client()
+
+
+def test_metrics_requires_api_key(client):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"X-API-Key": "wrong"}).status_code == 401
+
+    r = client.get("/metrics", headers={"X-API-Key": "s3cret"})
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    assert "version=0.0.4" in r.headers["Content-Type"]
+    assert "# TYPE pipeline_stage_duration_seconds histogram" in r.get_data(as_text=True)
+
+
+def test_metrics_public_opt_out(client, monkeypatch):
+    monkeypatch.setenv("METRICS_PUBLIC", "True")
+    assert client.get("/metrics").status_code == 200
+    monkeypatch.setenv("METRICS_PUBLIC", "false")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/health").status_code == 200
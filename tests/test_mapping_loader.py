@@ -0,0 +1,113 @@
+"""load_mapping_cached — LRU בזיכרון, pickle בדיסק (MAPPING_CACHE_DIR), ומה שה-runner מדווח."""
+
+import os
+
+import pytest
+
+import mapping_loader
+from mapping_loader import load_mapping, load_mapping_cached, clear_mapping_cache
+
+ROOT         = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPPING_PATH = os.path.join(ROOT, "error_code_mapping_v2.xlsx")
+
+
+@pytest.fixture
+def mapping_bytes():
+    with open(MAPPING_PATH, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    clear_mapping_cache()
+    yield
+    clear_mapping_cache()
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """מחליף את load_mapping בטעינה שנספרת — mapping קטן שמזהה את הקובץ."""
+    calls = []
+
+    def _load(source):
+        calls.append(source)
+        return {"source": bytes(source)}
+
+    monkeypatch.setattr(mapping_loader, "load_mapping", _load)
+    return calls
+
+
+def test_miss_then_memory_hit(mapping_bytes):
+    first, info = load_mapping_cached(mapping_bytes)
+    assert info["cache"] == "miss"
+    assert first == load_mapping(mapping_bytes)
+
+    again, info2 = load_mapping_cached(mapping_bytes)
+    assert info2["cache"] == "memory"
+    assert again is first
+    assert info2["sha256"] == info["sha256"]
+
+
+def test_disk_pickle_hit(mapping_bytes, tmp_path):
+    first, info = load_mapping_cached(mapping_bytes, cache_dir=str(tmp_path))
+    assert info["cache"] == "miss"
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(mapping_loader._pickle_path("", info["sha256"]))]
+
+    clear_mapping_cache()   # process חדש — רק הדיסק נשאר
+    loaded, info2 = load_mapping_cached(mapping_bytes, cache_dir=str(tmp_path))
+    assert info2["cache"] == "disk"
+    assert loaded == first and loaded is not first
+
+    _, info3 = load_mapping_cached(mapping_bytes, cache_dir=str(tmp_path))
+    assert info3["cache"] == "memory"
+
+
+def test_corrupt_pickle_is_a_miss(mapping_bytes, tmp_path, loads):
+    _, info = load_mapping_cached(mapping_bytes, cache_dir=str(tmp_path))
+    path = tmp_path / os.path.basename(mapping_loader._pickle_path("", info["sha256"]))
+    path.write_bytes(b"not a pickle")
+    clear_mapping_cache()
+
+    mapping, info2 = load_mapping_cached(mapping_bytes, cache_dir=str(tmp_path))
+    assert info2["cache"] == "miss"
+    assert mapping == {"source": mapping_bytes}
+    assert len(loads) == 2
+
+
+def test_lru_eviction(loads, monkeypatch):
+    monkeypatch.setattr(mapping_loader, "MAPPING_CACHE_SIZE", 3)
+    files = [f"mapping {i}".encode() for i in range(4)]
+
+    for data in files[:3]:
+        assert load_mapping_cached(data)[1]["cache"] == "miss"
+    assert load_mapping_cached(files[0])[1]["cache"] == "memory"   # 0 הכי חדש עכשיו; 1 הכי ישן
+
+    assert load_mapping_cached(files[3])[1]["cache"] == "miss"     # מוציא את 1
+    assert len(mapping_loader._mapping_cache) == 3
+    assert load_mapping_cached(files[0])[1]["cache"] == "memory"
+    assert load_mapping_cached(files[2])[1]["cache"] == "memory"
+    assert load_mapping_cached(files[1])[1]["cache"] == "miss"
+    assert len(loads) == 5
+
+
+def test_runner_reports_cache_source(mapping_bytes, tmp_path, monkeypatch):
+    import pilot_runner_server_v2 as runner
+
+    monkeypatch.setenv("MAPPING_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("GMAIL_SERVICE_ACCOUNT_B64", raising=False)
+    monkeypatch.setattr(runner, "fetch_all_managers", lambda *a, **kw: ([], {"seconds": 0.0, "managers": {}}))
+    params, err = runner._read_form({"access_token": "t", "api_base": "https://api.example", "dry_run": "true"})
+    assert err is None
+
+    def _source():
+        body, status = runner.run_pipeline_v2(params, mapping_bytes)
+        assert status == 200, body
+        return body["stats"]["mapping"]
+
+    first = _source()
+    assert first["cache"] == "miss"
+    assert _source()["cache"] == "memory"
+    clear_mapping_cache()
+    third = _source()
+    assert third["cache"] == "disk"
+    assert third["sha256"] == first["sha256"]
@@ -0,0 +1,129 @@
+"""PipelineJobs — מעברי סטטוס של job ברקע, ו-202 / polling דרך ה-runner."""
+
+import threading
+import time
+
+import pytest
+
+from pipeline_jobs import PipelineJobs, DEFAULT_JOB_WORKERS, QUEUED, RUNNING, DONE, FAILED
+
+
+def _wait(jobs, job_id, status, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} לא הגיע ל-{status}: {jobs.get(job_id)}")
+
+
+@pytest.fixture
+def jobs():
+    jobs = PipelineJobs()
+    yield jobs
+    jobs.shutdown()
+
+
+def test_default_is_one_worker():
+    assert DEFAULT_JOB_WORKERS == 1
+
+
+def test_status_transitions(jobs):
+    started, release = threading.Event(), threading.Event()
+
+    def _blocked(progress):
+        progress.stage("fetch", records_in=3)
+        started.set()
+        release.wait(10)
+        progress.records(out=3)
+        progress.stage("send")
+        return {"ok": True}, 200
+
+    first  = jobs.submit(_blocked, meta={"run_id": "r1"})
+    second = jobs.submit(lambda progress: ({"ok": False}, 502))
+
+    assert started.wait(10)
+    job = jobs.get(first)
+    assert job["status"] == RUNNING
+    assert job["stage"] == "fetch" and job["stages"] == []
+    assert job["started_at"] and job["finished_at"] is None and job["http_status"] is None
+    assert job["meta"] == {"run_id": "r1"}
+    assert jobs.get(second)["status"] == QUEUED            # worker אחד — השני ממתין
+    assert jobs.get(second)["started_at"] is None
+
+    release.set()
+    job = _wait(jobs, first, DONE)
+    assert job["http_status"] == 200 and job["result"] == {"ok": True} and job["error"] is None
+    assert [s["stage"] for s in job["stages"]] == ["fetch", "send"]
+    assert job["stages"][0]["records_out"] == 3
+    assert job["stage"] is None and job["seconds"] is not None
+
+    job = _wait(jobs, second, FAILED)                      # סטטוס HTTP של כשל → failed, בלי חריגה
+    assert job["http_status"] == 502 and job["error"] is None and job["result"] == {"ok": False}
+
+
+def test_exception_fails_with_500(jobs):
+    def _boom(progress):
+        progress.stage("classify")
+        raise RuntimeError("boom")
+
+    job = _wait(jobs, jobs.submit(_boom), FAILED)
+    assert job["http_status"] == 500 and job["error"] == "boom" and job["result"] is None
+    assert [s["stage"] for s in job["stages"]] == ["classify"]
+
+
+def test_unknown_and_evicted_jobs():
+    jobs = PipelineJobs(keep=2)
+    try:
+        ids = [jobs.submit(lambda progress, i=i: ({"i": i}, 200)) for i in range(4)]
+        for job_id in ids[2:]:
+            _wait(jobs, job_id, DONE)
+        assert jobs.get(ids[0]) is None and jobs.get(ids[1]) is None
+        assert jobs.get(ids[3])["result"] == {"i": 3}
+        assert jobs.get("nope") is None
+    finally:
+        jobs.shutdown()
+
+
+# --- runner: 202 + GET /jobs/<id> ---
+
+def test_background_run_202_and_poll(monkeypatch):
+    import io
+    import os
+    import pilot_runner_server_v2 as runner
+
+    monkeypatch.delenv("API_SECRET_KEY", raising=False)
+    monkeypatch.delenv("GMAIL_SERVICE_ACCOUNT_B64", raising=False)
+    monkeypatch.delenv("MAPPING_CACHE_DIR", raising=False)
+    monkeypatch.setattr(runner, "fetch_all_managers", lambda *a, **kw: ([], {"seconds": 0.0, "managers": {}}))
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "error_code_mapping_v2.xlsx"), "rb") as f:
+        mapping_bytes = f.read()
+
+    client = runner.app.test_client()
+    r = client.post("/run-pilot/from-api-v2", content_type="multipart/form-data", data={
+        "access_token": "t", "api_base": "https://api.example", "dry_run": "true", "background": "true",
+        "run_id": "r-bg", "mapping": (io.BytesIO(mapping_bytes), "mapping.xlsx"),
+    })
+    assert r.status_code == 202
+    body = r.get_json()
+    assert body["ok"] is True and body["status_url"] == f"/jobs/{body['job_id']}"
+
+    deadline = time.time() + 30
+    while True:
+        job = client.get(body["status_url"])
+        assert job.status_code == 200
+        job = job.get_json()
+        assert job["status"] in (QUEUED, RUNNING, DONE)
+        if job["status"] == DONE or time.time() > deadline:
+            break
+        time.sleep(0.05)
+
+    assert job["status"] == DONE and job["http_status"] == 200
+    assert job["meta"]["run_id"] == "r-bg" and job["meta"]["dry_run"] is True
+    assert job["result"]["ok"] is True and job["result"]["dry_run"] is True
+    assert [s["stage"] for s in job["stages"]][:2] == ["mapping", "fetch"]
+
+    missing = client.get("/jobs/0000")
+    assert missing.status_code == 404 and missing.get_json()["ok"] is False
@@ -0,0 +1,77 @@
+"""_read_form — נרמול שדות הטופס של POST /run-pilot/from-api-v2."""
+
+import pytest
+
+from pilot_runner_server_v2 import _read_form
+
+BASE = {"access_token": "t", "api_base": "https://api.example"}
+
+
+def _read(**fields):
+    return _read_form({**BASE, **fields})
+
+
+def test_defaults():
+    params, err = _read()
+    assert err is None
+    assert params["fetch_workers"] == 4
+    assert params["submit_workers"] == 4
+    assert params["classify_procs"] == 0
+    assert params["stream"] is False
+    assert params["engine"] == "rows"
+    assert params["run_id"] is None
+
+
+def test_missing_credentials():
+    params, err = _read_form({"access_token": "=", "api_base": "x"})
+    assert params is None and err
+
+
+@pytest.mark.parametrize("field", ["stream", "submit_status", "dry_run", "background"])
+@pytest.mark.parametrize("raw", ["true", "=true", " =TRUE "])
+def test_bool_fields_strip_equals(field, raw):
+    params, err = _read(**{field: raw})
+    assert err is None
+    assert params[field] is True
+
+
+def test_text_fields_strip_equals():
+    params, _ = _read(dev_impersonate="=a@b.co", run_id="=r1", account_manager_email="=m1@x, m2@x")
+    assert params["dev_impersonate"] == "a@b.co"
+    assert params["run_id"] == "r1"
+    assert params["acct_mgr_list"] == ["m1@x", "m2@x"]
+
+
+def test_classify_engine():
+    params, err = _read(classify_engine="=Columnar ")
+    assert err is None and params["engine"] == "columnar"
+
+    params, err = _read(classify_engine="pandas")
+    assert params is None and "classify_engine" in err
+
+
+@pytest.mark.parametrize("field,key", [
+    ("fetch_workers", "fetch_workers"),
+    ("page_size", "page_size"),
+    ("classify_processes", "classify_procs"),
+    ("report_processes", "report_procs"),
+    ("build_processes", "build_procs"),
+    ("gmail_batch_size", "gmail_batch"),
+    ("submit_workers", "submit_workers"),
+])
+def test_int_fields(field, key):
+    params, err = _read(**{field: "=3"})
+    assert err is None and params[key] == 3
+
+    for bad in ("abc", "1.5", "-1"):
+        params, err = _read(**{field: bad})
+        assert params is None
+        assert field in err
+
+
+def test_int_error_is_400(monkeypatch):
+    from pilot_runner_server_v2 import app
+    monkeypatch.delenv("API_SECRET_KEY", raising=False)
+    r = app.test_client().post("/run-pilot/from-api-v2", data={**BASE, "fetch_workers": "x"})
+    assert r.status_code == 400
+    assert r.get_json() == {"ok": False, "message": "fetch_workers must be an integer"}
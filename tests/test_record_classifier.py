@@ -0,0 +1,250 @@
+"""
+classify_all ב-process pool — אותה תוצאה ואותו סדר כמו סיווג באותו process, גם מ-generator.
+engine="columnar" — פלט זהה ל-engine="rows" (כולל סדר, טיפוסים וערכי קצה).
+apply_post_routing — פלט זהה ל-apply_employer_max_counter_routing + apply_cross_error_inheritance.
+"""
+
+import os
+import sys
+import random
+
+import pytest
+
+from mapping_loader import load_mapping, FORMAT_EMPLOYER, FORMAT_MOSADI_1, RESP_EMPLOYER, RESP_CASE_MANAGER
+from record_classifier import (
+    classify_all, apply_post_routing, apply_employer_max_counter_routing, apply_cross_error_inheritance,
+    _iter_chunks,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAPPING_PATH = os.path.join(ROOT, "error_code_mapping_v2.xlsx")
+
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+from bench_engine import synthetic_mapping, synthetic_records  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def mapping():
+    with open(MAPPING_PATH, "rb") as f:
+        return load_mapping(f.read())
+
+
+def _records(n, seed=1):
+    rnd = random.Random(seed)
+    return [
+        {
+            "MISPAR_MEZAHE_RESHUMA":               f"R{i:06d}",
+            "CustomerNumber":                      str(rnd.randint(500000000, 500000020)),
+            "ErrorCodeV4Id":                       rnd.choice([4, 5, 6, 15, 26, 93, 999]),
+            "OnlyOnStatusChange_DatesDiffInWeeks": rnd.choice([0, 1, 2, 3, 5, None]),
+            "FeedbackStatus":                      rnd.choice([1, 2, 3, 6]),
+            "LastPositive_CHODESH_MASKORET":       rnd.choice([None, "202401"]),
+            "CHODESH_MASKORET":                    "202405",
+            "FundInstitutionName":                 "הראל",
+            "FundInstitutionIdentityNumber":       rnd.choice(["512065202", "520004078"]),
+            "MISPAR_MEZAHE_OVED":                  str(rnd.randint(10000000, 99999999)),
+            "CustomerContactEmail":                "cc@example.com",
+            "CustomerAccountManagerEmail":         rnd.choice(["m1@example.com", "m2@example.com"]),
+        }
+        for i in range(n)
+    ]
+
+
+def _strip(result):
+    classified, skipped = result
+    return ([{k: v for k, v in r.items() if k != "_raw"} for r in classified],
+            [(rec["MISPAR_MEZAHE_RESHUMA"], reason) for rec, reason in skipped])
+
+
+def test_iter_chunks_is_lazy():
+    consumed = []
+
+    def gen():
+        for i in range(10):
+            consumed.append(i)
+            yield i
+
+    chunks = _iter_chunks(gen(), 4)
+    assert next(chunks) == [0, 1, 2, 3]
+    assert consumed == [0, 1, 2, 3]
+    assert list(chunks) == [[4, 5, 6, 7], [8, 9]]
+
+
+def test_sharded_matches_inline_from_generator(mapping):
+    records  = _records(700)
+    expected = classify_all(records, mapping)
+    got      = classify_all(iter(records), mapping, processes=2, chunk_size=100)
+    assert _strip(got) == _strip(expected)
+    # _raw מצביע על הרשומה המקורית, לא על עותק שעבר pickle
+    assert all(a["_raw"] is b["_raw"] for a, b in zip(got[0], expected[0]))
+    assert all(a[0] is b[0] for a, b in zip(got[1], expected[1]))
+
+
+def test_single_chunk_stays_in_process(mapping):
+    records = _records(50)
+    assert _strip(classify_all(iter(records), mapping, processes=2, chunk_size=100)) == \
+        _strip(classify_all(records, mapping))
+
+
+# --- engine="columnar" ---
+
+NAN = float("nan")
+
+# ערכי קצה לכל שדה החלטה: NaN, None, רווחים, מספרים כטקסט, טיפוסים מעורבים, ערכים לא מספריים
+EDGE_VALUES = {
+    "ErrorCodeV4Id":                       [NAN, None, "abc", " 7 ", "2.0", 1, 2, 15.0, True, "26"],
+    "OnlyOnStatusChange_DatesDiffInWeeks": [NAN, None, "x", "3", 2.7, -1, "0", True, 0.0],
+    "FeedbackStatus":                      [NAN, None, "6", " 6.0 ", "x", 6.0],
+    "StatusDescription":                   [NAN, None, "רשומה מבוטלת!", 0, 5],
+    "LastPositive_CHODESH_MASKORET":       [NAN, "nan", "None", " ", 202405, "2024x", "202312 "],
+    "CHODESH_MASKORET":                    [NAN, None, "abc", 202406],
+    "MISPAR_MEZAHE_OVED":                  [NAN, None, "5", "12345678x", " 123456789 ", 123456784],
+    "FundInstitutionType":                 [NAN, " קרן פנסיה ", None],
+    "AgentEmail":                          [NAN, "  ", "None", "agent@example.com"],
+    "Contact1Email":                       [NAN, "", "nan"],
+    "EmployeeFirstName":                   [NAN, None, ""],
+    "MISPAR_MEZAHE_RESHUMA":               [NAN, None],
+}
+
+
+def _with_edge_values(records, seed=3, rate=0.3):
+    rnd = random.Random(seed)
+    fields = list(EDGE_VALUES)
+    for rec in records:
+        if rnd.random() < rate:
+            field = rnd.choice(fields)
+            rec[field] = rnd.choice(EDGE_VALUES[field])
+        if rnd.random() < 0.01:
+            rec.pop(rnd.choice(fields), None)
+    return records
+
+
+def _assert_same(got, expected):
+    assert got[1] == expected[1]
+    assert got[0] == expected[0]
+    # אותו סדר מפתחות ואותם טיפוסים (1 ≠ 1.0 ≠ True ב-JSON / Excel)
+    assert [[(k, type(v)) for k, v in r.items()] for r in got[0]] == \
+        [[(k, type(v)) for k, v in r.items()] for r in expected[0]]
+    assert all(a["_raw"] is b["_raw"] for a, b in zip(got[0], expected[0]))
+
+
+@pytest.fixture(scope="module")
+def synthetic():
+    mapping = load_mapping(synthetic_mapping())
+    return mapping, synthetic_records(30000, mapping["error_codes"].keys())
+
+
+def test_columnar_matches_rows_on_synthetic_data(synthetic):
+    mapping, records = synthetic
+    _assert_same(classify_all(records, mapping, engine="columnar"), classify_all(records, mapping))
+
+
+def test_columnar_matches_rows_with_edge_values(synthetic):
+    mapping, records = synthetic
+    records = _with_edge_values([dict(r) for r in records])
+    _assert_same(classify_all(records, mapping, engine="columnar"), classify_all(records, mapping))
+
+
+def test_columnar_matches_rows_on_real_mapping(mapping):
+    records = _with_edge_values(_records(5000), rate=0.5)
+    _assert_same(classify_all(records, mapping, engine="columnar"), classify_all(records, mapping))
+
+    # חוק בלי אחריות — base_responsibility נופל לאחריות שאחרי ההסלמה
+    no_resp = dict(mapping, error_codes={code: dict(rule, responsibility=None)
+                                         for code, rule in mapping["error_codes"].items()})
+    _assert_same(classify_all(records, no_resp, engine="columnar"), classify_all(records, no_resp))
+
+
+def test_columnar_empty_input(mapping):
+    assert classify_all([], mapping, engine="columnar") == ([], [])
+
+
+def test_columnar_raises_like_rows(mapping):
+    """counter אינסופי — OverflowError בשני המנועים, ורק כשהרשומה מגיעה לבדיקת ה-counter."""
+    records = _records(20)
+    records[3]["OnlyOnStatusChange_DatesDiffInWeeks"] = float("inf")
+    records[3]["StatusDescription"] = "רשומה מבוטלת"
+    _assert_same(classify_all(records, mapping, engine="columnar"), classify_all(records, mapping))
+
+    records[3]["StatusDescription"] = ""
+    for engine in ("rows", "columnar"):
+        with pytest.raises(OverflowError):
+            classify_all(records, mapping, engine=engine)
+
+
+def test_columnar_sharded_matches_rows(mapping):
+    records = _records(700)
+    expected = classify_all(records, mapping)
+    got = classify_all(iter(records), mapping, engine="columnar", processes=2, chunk_size=100)
+    assert _strip(got) == _strip(expected)
+
+
+def test_unknown_engine(mapping):
+    with pytest.raises(ValueError):
+        classify_all(_records(5), mapping, engine="pandas")
+
+
+# --- apply_post_routing ---
+
+def _route_both(classified):
+    separate = apply_cross_error_inheritance(apply_employer_max_counter_routing([dict(r) for r in classified]))
+    fused    = apply_post_routing([dict(r) for r in classified])
+    return separate, fused
+
+
+def _routing_input(seed=5):
+    """
+    רשומות מסווגות עם קבוצות אמיתיות: מעט מעסיקים ועובדים (הרבה רשומות לכל עובד/קופה/קוד),
+    counters עד 5, ~20% בלי base_responsibility (המפתח נקבע אחרי כלל 1), ות.ז. משותפות —
+    אותה ת.ז. אצל מעסיקים וקופות שונים, וגם כ-int מול str.
+    """
+    mapping = load_mapping(synthetic_mapping())
+    records = synthetic_records(20000, mapping["error_codes"].keys(), employers=40, employees_per_employer=5,
+                                seed=seed)
+    classified, _ = classify_all(records, mapping)
+    rnd = random.Random(seed)
+    for r in classified:
+        if rnd.random() < 0.2:
+            r["base_responsibility"] = rnd.choice([None, ""])
+        if rnd.random() < 0.05:
+            r["employee_id"] = rnd.choice(["000000018", 18, "18"])
+    return classified
+
+
+def test_post_routing_matches_separate_passes():
+    classified = _routing_input()
+    separate, fused = _route_both(classified)
+    assert fused == separate
+
+    # הנתונים באמת מפעילים את כל המסלולים
+    paths = [r["routing_path"] for r in fused]
+    assert any(p.startswith("employer_max_counter_") for p in paths)
+    assert any(p.startswith("cross_error_inheritance_c") and int(p.rsplit("c", 1)[1]) >= 2 for p in paths)
+    deferred = [i for i, r in enumerate(classified) if not r["base_responsibility"]]
+    assert any(fused[i]["routing_path"].startswith("cross_error_inheritance_") for i in deferred)
+    assert any(fused[i]["counter_weeks"] != classified[i]["counter_weeks"] for i in deferred)
+    shared = [r for r in fused if str(r["employee_id"]) == "18"]
+    assert len({r["customer_number"] for r in shared}) > 1
+    assert any(r["routing_path"].startswith(("cross_error_inheritance_", "employer_max_counter_")) for r in shared)
+
+
+def test_post_routing_defers_key_without_base_responsibility():
+    """
+    רשומת מעסיק בלי base_responsibility עוברת למנהלת תיק בכלל 1, ורק אז נכנסת לקבוצת
+    הירושה של מנהלת התיק — שם ה-counter שלה (3) מסלים את הרשומה השנייה.
+    """
+    def rec(**kw):
+        base = {"employee_id": "123456782", "customer_number": "500000001", "fund_institution_id": "512065202",
+                "error_code": 26, "counter_weeks": 1, "routing_path": "default", "to_role": None, "cc_role": None}
+        return {**base, **kw}
+
+    classified = [
+        rec(email_format=FORMAT_EMPLOYER, responsibility=RESP_EMPLOYER, base_responsibility=None, counter_weeks=3),
+        rec(email_format=FORMAT_MOSADI_1, responsibility=RESP_CASE_MANAGER, base_responsibility=RESP_CASE_MANAGER,
+            error_code=93),
+    ]
+    separate, fused = _route_both(classified)
+    assert fused == separate
+    assert fused[0]["routing_path"] == "employer_max_counter_3"
+    assert fused[1]["routing_path"] == "cross_error_inheritance_c3"
+    assert fused[1]["counter_weeks"] == 3
@@ -0,0 +1,126 @@
+"""בדיקות ל-record_fetcher — פענוח זורם (iter_json_array) ודפדוף ב-fetch_records מול API מזויף."""
+
+import json
+
+import pytest
+
+import record_fetcher
+from record_fetcher import iter_json_array, fetch_records, FIELD_RECORD_ID, PAGE_SKIP_FIELD
+
+RECORDS = [
+    {
+        "MISPAR_MEZAHE_RESHUMA": 123456,
+        "CustomerNumber": "51-234567-8",
+        "CustomerName": "חברה בע\"מ — סניף \\ ראשי",
+        "OnlyOnStatusChange_DatesDiffInWeeks": 3,
+        "Amount": 2.5,
+        "Ratio": -1.5e-3,
+        "Big": 12345678901234567890,
+        "Flag": True,
+        "Missing": None,
+        "Nested": {"a": [1, 2.25, "x"], "b": {}},
+    },
+    7,
+    -0.125,
+    3e10,
+    "טקסט א \U0001F600",
+    [],
+    {},
+    False,
+    None,
+]
+PAYLOAD = json.dumps(RECORDS, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+@pytest.mark.parametrize("cut", range(1, len(PAYLOAD)))
+def test_split_at_every_byte_offset(cut):
+    assert list(iter_json_array([PAYLOAD[:cut], PAYLOAD[cut:]])) == RECORDS
+
+
+def test_one_byte_chunks():
+    assert list(iter_json_array(PAYLOAD[i:i + 1] for i in range(len(PAYLOAD)))) == RECORDS
+
+
+@pytest.mark.parametrize("chunks, expected", [
+    ([b"[1, 2.", b"5]"], [1, 2.5]),
+    ([b"[1.5e", b"-3]"], [1.5e-3]),
+    ([b"[1", b"2", b"]"], [12]),
+    ([b"[1", b"]"], [1]),
+    ([b"[-", b"4 ,5]"], [-4, 5]),
+])
+def test_number_cut_by_chunk_boundary(chunks, expected):
+    assert list(iter_json_array(chunks)) == expected
+
+
+@pytest.mark.parametrize("chunks", [[b"[1, 2"], [b"{}"], [b"[1 2]"], [b"[1,]"], [b"[1] x"]])
+def test_invalid_stream_raises(chunks):
+    with pytest.raises(ValueError):
+        list(iter_json_array(chunks))
+
+
+# --- fetch_records: דפדוף ---
+
+class _FakeApi:
+    """Session מזויף ל-GetFeedbackData: מחזיר עד top רשומות מ-skip (או מ-0 אם honor_skip=False)."""
+
+    def __init__(self, n, honor_skip=True):
+        self.rows       = [{FIELD_RECORD_ID: i, "CustomerNumber": f"c{i}"} for i in range(n)]
+        self.honor_skip = honor_skip
+        self.bodies     = []
+
+    def post(self, url, json=None, **kwargs):
+        self.bodies.append(dict(json))
+        skip = json.get(PAGE_SKIP_FIELD, 0) if self.honor_skip else 0
+        return _FakeResponse(self.rows[skip:skip + json["top"]])
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def api(monkeypatch):
+    def _api(n, honor_skip=True):
+        fake = _FakeApi(n, honor_skip)
+        monkeypatch.setattr(record_fetcher, "_session", lambda: fake)
+        return fake
+    return _api
+
+
+def _fetch(top, page_size):
+    return fetch_records("https://api.example", "t", "2022-01-01", top, "a@x.co.il",
+                         page_size=page_size, retry_delay=0)
+
+
+def test_paged_fetch(api):
+    fake = api(25)
+    records, stats = _fetch(100, 10)
+    assert [r[FIELD_RECORD_ID] for r in records] == list(range(25))
+    assert [b.get(PAGE_SKIP_FIELD) for b in fake.bodies] == [0, 10, 20]
+    assert stats["pages"] == 3 and stats["records"] == 25
+    assert "unpaged_refetch" not in stats
+
+
+def test_ignored_skip_refetches_without_paging(api):
+    """השרת מתעלם מ-skip — עמוד שני זהה לראשון; התוצאה היא כל הרשומות, לא רק העמוד הראשון."""
+    fake = api(25, honor_skip=False)
+    records, stats = _fetch(100, 10)
+    assert [r[FIELD_RECORD_ID] for r in records] == list(range(25))
+    assert fake.bodies[-1] == {"StartDate": "2022-01-01", "top": 100, "AccountManagerEmail": "a@x.co.il"}
+    assert [b.get(PAGE_SKIP_FIELD) for b in fake.bodies] == [0, 10, None]
+    assert stats["unpaged_refetch"] is True
+    assert stats["pages"] == 3 and stats["records"] == 25
+
+
+def test_page_size_at_least_top_is_one_request(api):
+    fake = api(5)
+    records, stats = _fetch(10, 10)
+    assert len(records) == 5 and len(fake.bodies) == 1
+    assert PAGE_SKIP_FIELD not in fake.bodies[0]
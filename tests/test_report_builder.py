@@ -0,0 +1,216 @@
+"""report_builder — דו"ח הריצה ודוחות מנהלות התיק, נקראים חזרה ב-openpyxl מ-fixture קטן."""
+
+import io
+import base64
+from datetime import datetime
+
+import openpyxl
+import pytest
+
+from mapping_loader import FORMAT_MOSADI_1, FORMAT_EMPLOYER, FORMAT_CASE_MGR
+from report_builder import (
+    build_run_report, build_case_manager_reports, summarize_run, SUMMARY_COLUMNS, DETAIL_COLUMNS, SKIPPED_COLUMNS, PIPELINE_COLUMNS,
+)
+
+RUN_DATE = datetime(2026, 10, 18, 6, 30)
+NASTY    = "<b>&כהן</b>"
+
+
+def _rec(rid, fmt, customer, weeks, cm, counter=1, **kw):
+    raw = {
+        "MISPAR_MEZAHE_RESHUMA":               rid,
+        "OnlyOnStatusChange_DatesDiffInWeeks": weeks,
+        "CustomerAccountManagerEmail":         cm,
+        "CustomerAccountManagerName":          {"a@x": "אנה", "b@x": "בתיה"}.get(cm),
+        "CHODESH_MASKORET":                    "2026-09",
+    }
+    raw.update(kw.pop("raw", {}))
+    rec = {
+        "record_id":       rid,
+        "email_format":    fmt,
+        "customer_number": customer,
+        "customer_name":   f"מעסיק {customer}",
+        "employee_id":     f"0{rid}",
+        "full_name":       f"עובד {rid}",
+        "error_code":      26,
+        "counter_weeks":   counter,
+        "responsibility":  "employer",
+        "routing_path":    "default",
+        "_raw":            raw,
+    }
+    rec.update(kw)
+    return rec
+
+
+@pytest.fixture
+def run():
+    """
+    שלוש קבוצות, שתי מנהלות תיק, שלוש רשומות מוחרגות:
+      מוסדי-1   — r1 (a, 1 שבוע), r2 (b, 3)
+      מעסיק     — r3 (a, 6), r4 (a, "2.0"; שם עם <&)
+      מנהלת תיק — r5 (a, 2), r6 (b, בלי שבועות)
+    """
+    groups = [
+        {"group_key": f"{FORMAT_MOSADI_1}|F1|100", "email_format": FORMAT_MOSADI_1,
+         "meta": {"fund_institution_name": "קופה 1", "customer_number": "100"},
+         "records": [_rec("1", FORMAT_MOSADI_1, "100", 1, "a@x", counter=1),
+                     _rec("2", FORMAT_MOSADI_1, "100", 3, "b@x", counter=3)]},
+        {"group_key": f"{FORMAT_EMPLOYER}|200|employer", "email_format": FORMAT_EMPLOYER,
+         "meta": {"customer_name": "מעסיק 200", "customer_number": "200"},
+         "records": [_rec("3", FORMAT_EMPLOYER, "200", 6, "a@x", counter=6),
+                     _rec("4", FORMAT_EMPLOYER, "200", "2.0", "a@x", counter=2, full_name=NASTY,
+                          raw={"Extra": float("nan")})]},
+        {"group_key": f"{FORMAT_CASE_MGR}|case_manager", "email_format": FORMAT_CASE_MGR,
+         "meta": {},
+         "records": [_rec("5", FORMAT_CASE_MGR, "100", 2, "a@x", counter=2),
+                     _rec("6", FORMAT_CASE_MGR, "300", None, "b@x", counter=0)]},
+    ]
+    send_results = [
+        {"group_key": groups[0]["group_key"], "ok": True, "draft_id": "d1", "error": None},
+        {"group_key": groups[1]["group_key"], "ok": False, "draft_id": None, "error": "quota"},
+    ]
+    skipped = [
+        ({"MISPAR_MEZAHE_RESHUMA": "7", "CustomerAccountManagerEmail": "a@x", "CustomerNumber": "100",
+          "ErrorCodeV4Id": 26, "OnlyOnStatusChange_DatesDiffInWeeks": 0}, "Counter=0 — שגיאה חדשה"),
+        ({"MISPAR_MEZAHE_RESHUMA": "8", "CustomerAccountManagerEmail": "b@x"}, "רשומה מבוטלת"),
+        ({"MISPAR_MEZAHE_RESHUMA": "9"}, "משהו אחר"),
+    ]
+    raw_records = [r["_raw"] for g in groups for r in g["records"]] + [rec for rec, _ in skipped]
+    return groups, send_results, skipped, raw_records
+
+
+def _load(data):
+    return openpyxl.load_workbook(io.BytesIO(data))
+
+
+def _rows(ws):
+    return [list(r) for r in ws.iter_rows(values_only=True)]
+
+
+def test_run_report_workbook(run):
+    groups, send_results, skipped, raw_records = run
+    wb = _load(build_run_report(groups, send_results, skipped_records=skipped, raw_records=raw_records,
+                                run_date=RUN_DATE))
+
+    assert wb.sheetnames == ["דשבורד", "סיכום", "פירוט", "מוחרגות", "מעקב pipeline"]
+    for ws in wb.worksheets:
+        assert ws.sheet_view.rightToLeft is True, ws.title
+
+    dash = wb["דשבורד"]
+    assert dash.freeze_panes is None
+    assert dash["A1"].value == "דשבורד — ריצה 18/10/2026 06:30 UTC"
+    assert "A1:C1" in [str(r) for r in dash.merged_cells.ranges]
+
+    for name, columns in [("סיכום", SUMMARY_COLUMNS), ("פירוט", DETAIL_COLUMNS), ("מוחרגות", SKIPPED_COLUMNS)]:
+        ws = wb[name]
+        assert ws.freeze_panes == "A2", name
+        assert [c.value for c in ws[1]] == columns, name
+        assert not ws.merged_cells.ranges
+
+    summary = _rows(wb["סיכום"])[1:]
+    assert [r[1] for r in summary] == [g["group_key"] for g in groups]
+    assert summary[0][4:10] == [2, 1, 3, "d1", "כן", None]       # "" → תא ריק
+    assert summary[1][4:10] == [2, 2, 6, None, "לא", "quota"]
+    assert summary[2][7:9] == [None, "—"]
+    assert wb["סיכום"]["E2"].data_type == "n"
+
+    detail = wb["פירוט"]
+    assert detail.max_row == 1 + 6
+    weeks = DETAIL_COLUMNS.index("שבועות") + 1
+    assert detail.cell(2, weeks).value == 1 and detail.cell(2, weeks).data_type == "n"
+    assert detail.cell(5, weeks).value == "2.0" and detail.cell(5, weeks).data_type == "s"
+    assert detail.cell(7, weeks).value is None                   # None → תא לא נכתב
+    assert detail.cell(5, DETAIL_COLUMNS.index("שם עובד") + 1).value == NASTY
+
+    assert _rows(wb["מוחרגות"])[1:] == [
+        ["7", "100", 26, 0, "Counter=0 — שגיאה חדשה"],
+        ["8", None, None, None, "רשומה מבוטלת"],
+        ["9", None, None, None, "משהו אחר"],
+    ]
+
+    pipe = wb["מעקב pipeline"]
+    header = [c.value for c in pipe[1]]
+    assert header[-len(PIPELINE_COLUMNS):] == PIPELINE_COLUMNS
+    assert pipe.max_row == 1 + len(raw_records)
+    extra = header.index("Extra") + 1
+    assert all(pipe.cell(r, extra).value is None for r in range(2, pipe.max_row + 1))   # NaN → תא לא נכתב
+    action = [pipe.cell(r, header.index("פעולה") + 1).value for r in range(2, pipe.max_row + 1)]
+    assert action == ["טופל"] * 6 + ["סונן"] * 3
+
+
+def _weeks(**counts):
+    """{"1": .., "5+": ..} — שבוע 0 לא מוצג בטבלאות, אבל נספר ב-total."""
+    return {b: counts.get("w" + b.replace("+", "p"), 0) for b in ["1", "2", "3", "4", "5+"]}
+
+
+def test_summarize_run_totals(run):
+    groups, _, skipped, _ = run
+    summary = summarize_run(groups, skipped)
+
+    assert (summary["fetched"], summary["treated"], summary["skipped"]) == (9, 6, 3)
+    assert summary["top"] is None and summary["truncation_warning"] is False
+    assert summary["skip_reasons"] == {
+        "Counter=0 (שגיאה חדשה)": 1, "קוד שגיאה 1/2 (מוחרג)": 0, "רשומה מבוטלת": 1,
+        "מוחרג בקובץ מיפוי": 0, "אחר": 1,
+    }
+    assert summary["formats"] == [
+        {"email_format": FORMAT_MOSADI_1, "records": 2, "mails": 1},
+        {"email_format": FORMAT_CASE_MGR, "records": 2, "mails": 2},   # שתי מנהלות ייחודיות
+        {"email_format": FORMAT_EMPLOYER, "records": 2, "mails": 1},
+    ]
+    # לפי OnlyOnStatusChange_DatesDiffInWeeks: 1, 3, 6, "2.0", 2, None(→0)
+    assert summary["weeks"] == _weeks(w1=1, w2=2, w3=1, w5p=1)
+    # לפי counter_weeks: חיצוני r1-r4 = 1, 3, 6, 2; פנימי r5-r6 = 2, 0
+    assert summary["weeks_by_side"] == {
+        "external": _weeks(w1=1, w2=1, w3=1, w5p=1),
+        "internal": _weeks(w2=1),
+    }
+    assert summary["case_managers"] == [
+        {"email": "a@x", "name": "אנה",  "total": 4, "weeks": _weeks(w1=1, w2=2, w5p=1)},
+        {"email": "b@x", "name": "בתיה", "total": 2, "weeks": _weeks(w3=1)},
+    ]
+    assert summary["top_employers"] == [
+        {"customer_number": "100", "name": "מעסיק 100", "total": 3, "weeks": _weeks(w1=1, w2=1, w3=1)},
+        {"customer_number": "200", "name": "מעסיק 200", "total": 2, "weeks": _weeks(w2=1, w5p=1)},
+        {"customer_number": "300", "name": "מעסיק 300", "total": 1, "weeks": _weeks()},
+    ]
+
+    assert summarize_run(groups, skipped, top=14)["truncation_warning"] is False   # 9 < int(14 * 0.75)
+    assert summarize_run(groups, skipped, top=14)["top"] == 14
+    assert summarize_run(groups, skipped, top=10)["truncation_warning"] is True
+    assert summarize_run([], None)["fetched"] == 0
+
+
+def test_dashboard_sheet_shows_summary(run):
+    groups, send_results, skipped, raw_records = run
+    wb = _load(build_run_report(groups, send_results, skipped_records=skipped, raw_records=raw_records,
+                                run_date=RUN_DATE))
+    cells = {}
+    for row in _rows(wb["דשבורד"]):
+        if row[0]:
+            cells.setdefault(row[0], row[1:])   # טבלת השבועות הראשונה (לפי הדיווח), לא לפי צד
+    assert cells["שבוע 2"][0] == 2 and cells["שבוע 5+"][0] == 1
+    assert cells["אנה"][0] == 4 and cells["בתיה"][0] == 2
+
+
+def test_case_manager_reports_same_in_pool(run):
+    """processes>1 בונה כל workbook ב-worker process — אותם גיליונות ואותן שורות כמו באותו process."""
+    groups, send_results, skipped, _ = run
+    inline = build_case_manager_reports(groups, send_results, skipped, run_date=RUN_DATE)
+    pooled = build_case_manager_reports(groups, send_results, skipped, run_date=RUN_DATE, processes=2)
+
+    assert [(r["email"], r["name"]) for r in inline] == [("a@x", "אנה"), ("b@x", "בתיה")]
+    assert [(r["email"], r["name"]) for r in pooled] == [(r["email"], r["name"]) for r in inline]
+    # a@x: מוסדי-1 ומעסיק במלואן + r5 מקבוצת מנהלת התיק; b@x: מוסדי-1 במלואה + r6
+    assert [(r["summary"]["treated"], r["summary"]["skipped"]) for r in inline] == [(5, 1), (3, 1)]
+
+    for a, b in zip(inline, pooled):
+        assert a["summary"] == b["summary"]
+        wa, wb = _load(base64.b64decode(a["report_b64"])), _load(base64.b64decode(b["report_b64"]))
+        assert wa.sheetnames == wb.sheetnames == ["דשבורד", "סיכום", "פירוט", "מוחרגות", "מעקב pipeline"]
+        for name in wa.sheetnames:
+            assert wa[name].max_row == wb[name].max_row, (a["email"], name)
+            assert _rows(wa[name]) == _rows(wb[name]), (a["email"], name)
+
+    detail = {r["email"]: _load(base64.b64decode(r["report_b64"]))["פירוט"].max_row - 1 for r in inline}
+    assert detail == {"a@x": 5, "b@x": 3}
@@ -0,0 +1,65 @@
+"""submit_chunks — רשומות שנדחו ותגובות 2xx שאינן JSON."""
+
+import pytest
+
+import status_submitter
+from david_api_stub import start_stub
+from status_submitter import submit_chunks
+
+
+def _chunk(*ids):
+    return [{"MISPAR_MEZAHE_RESHUMA": rid, "Responsibility": "x", "EmailDraftId": f"d{rid}"} for rid in ids]
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def _start(**kw):
+        server, api_base = start_stub(**kw)
+        servers.append(server)
+        return server, api_base
+
+    yield _start
+    for server in servers:
+        server.shutdown()
+
+
+def test_rejected_records_are_returned(stub):
+    server, api_base = stub(reject_ids={"2", "5"})
+    chunks = [_chunk("1", "2", "3"), _chunk("4", "5")]
+    report = submit_chunks(api_base, "t", chunks, retry_delay=0)
+    assert report["ok_chunks"] == 2
+    assert [f["chunk_index"] for f in report["record_failures"]] == [0, 1]
+    assert report["rejected"] == [chunks[0][1], chunks[1][1]]
+
+
+class _Resp:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content     = content
+        self.text        = content.decode("utf-8")
+
+    def json(self):
+        import json
+        return json.loads(self.content)
+
+
+class _Session:
+    def __init__(self, resp):
+        self.resp  = resp
+        self.posts = 0
+
+    def post(self, *args, **kwargs):
+        self.posts += 1
+        return self.resp
+
+
+def test_unparsable_2xx_is_accepted_not_resent(monkeypatch):
+    session = _Session(_Resp(200, b"<html>OK</html>"))
+    monkeypatch.setattr(status_submitter, "_session", lambda: session)
+    report = submit_chunks("http://api", "t", [_chunk("1", "2")], retry_delay=0)
+    assert session.posts == 1
+    assert report["ok_chunks"] == 1
+    assert report["failed_chunks"] == []
+    assert report["rejected"] == []
@@ -0,0 +1,87 @@
+"""xlsx_writer — הקבצים נקראים חזרה ב-openpyxl (מבנה, טיפוסי תאים, escape)."""
+
+import io
+import math
+from datetime import date
+
+import openpyxl
+
+from xlsx_writer import StreamingWorkbook, table_xlsx, column_widths
+
+
+def _load(data):
+    return openpyxl.load_workbook(io.BytesIO(data))
+
+
+def test_table_xlsx_roundtrip():
+    columns = ["מ.ז. עובד", "שם מלא", "סכום", "פעיל"]
+    rows = [
+        ("000000018", "<b>&\"כהן\"</b>", 12, True),
+        (18, None, 1.5, False),
+        ("", float("nan"), math.inf, None),
+        ("a\x01b", " רווח ", date(2026, 1, 31), 0),
+    ]
+    wb = _load(table_xlsx(columns, rows, sheet_name="שגיאות"))
+
+    assert wb.sheetnames == ["שגיאות"]
+    ws = wb["שגיאות"]
+    assert ws.sheet_view.rightToLeft is True
+    assert ws.freeze_panes == "A2"
+    assert [c.value for c in ws[1]] == columns
+    assert all(c.font.b for c in ws[1])
+
+    # מחרוזת נשארת מחרוזת (גם כשהיא נראית כמו מספר), מספר נשאר מספר
+    assert ws["A2"].value == "000000018" and ws["A2"].data_type == "s"
+    assert ws["A3"].value == 18 and ws["A3"].data_type == "n"
+    assert ws["C2"].value == 12 and ws["C3"].value == 1.5
+    assert ws["D2"].value is True and ws["D3"].value is False
+    assert ws["D5"].value == 0 and ws["D5"].data_type == "n"
+
+    # escape של XML — הטקסט חוזר כמו שנכתב
+    assert ws["B2"].value == "<b>&\"כהן\"</b>"
+    assert ws["B5"].value == " רווח "
+    assert ws["A5"].value == "ab"                  # תו בקרה שאסור ב-XML מוסר
+    assert ws["C5"].value == "2026-01-31"          # date נכתב כטקסט
+
+    # None / "" / NaN / inf → התא לא נכתב
+    for ref in ("B3", "A4", "B4", "C4", "D4"):
+        assert ws[ref].value is None, ref
+    assert ws.max_row == 5
+
+
+def test_table_xlsx_column_widths():
+    columns = ["א", "שם"]
+    rows = [("1234567890", None), ("x" * 80, float("nan"))]
+    ws = _load(table_xlsx(columns, rows, max_width=50)).active
+    widths = column_widths(columns, rows, max_width=50)
+    assert widths == [50, 6]
+    assert [ws.column_dimensions[c].width for c in "AB"] == widths
+
+
+def test_workbook_sheets_styles_and_merges():
+    wb = StreamingWorkbook()
+    header = wb.add_style(bold=True, color="FFFFFF", fill="1F4E79", horizontal="center")
+    assert wb.add_style(bold=True, color="FFFFFF", fill="1F4E79", horizontal="center") == header
+
+    ws = wb.create_sheet("סיכום", widths=[20, 14], freeze_header=True)
+    ws.append(["כותרת ארוכה", None], header)
+    ws.append(["מעסיק", 12])
+    ws.merge(1, 1, 2)
+    ws = wb.create_sheet("פירוט", rtl=False)
+    ws.append(["x"])
+
+    book = _load(wb.save())
+    assert book.sheetnames == ["סיכום", "פירוט"]
+    first, second = book["סיכום"], book["פירוט"]
+    assert [str(r) for r in first.merged_cells.ranges] == ["A1:B1"]
+    assert first.freeze_panes == "A2" and second.freeze_panes is None
+    assert first.sheet_view.rightToLeft is True and not second.sheet_view.rightToLeft
+    cell = first["A1"]
+    assert cell.font.b and cell.font.color.rgb.endswith("FFFFFF")
+    assert cell.fill.fgColor.rgb.endswith("1F4E79")
+    assert cell.alignment.horizontal == "center"
+    assert first["B2"].value == 12
+
+
+def test_empty_workbook_has_a_sheet():
+    assert _load(StreamingWorkbook().save()).sheetnames == ["Sheet"]
@@ -0,0 +1,335 @@
+"""
+xlsx_writer.py
+--------------
+כותב XLSX מינימלי וזורם — בלי מודל האובייקטים של openpyxl.
+
+הקבצים שהמערכת מייצרת הם טבלאות פשוטות: header + שורות, RTL, רוחב עמודות,
+כמה סגנונות קבועים ומיזוג תאים בדשבורד. המודול כותב את ה-XML ישירות ל-zip:
+  - כל גיליון נכתב שורה אחרי שורה לתוך ה-member שלו ב-zip (ZipFile.open "w")
+  - מחרוזות כ-inlineStr — בלי טבלת sharedStrings בזיכרון
+  - escape של XML מחושב פעם אחת לכל מחרוזת שונה בגיליון (cache)
+  - None / "" / NaN → התא לא נכתב
+
+מגבלות: גיליון אחד פתוח לכתיבה בכל רגע (create_sheet סוגר את הקודם), רוחב עמודות
+נקבע ביצירת הגיליון, date / datetime נכתבים כטקסט.
+
+שימוש:
+  from xlsx_writer import StreamingWorkbook, table_xlsx
+
+  xlsx_bytes = table_xlsx(["מ.ז. עובד", "שם מלא"], rows, sheet_name="שגיאות")
+
+  wb     = StreamingWorkbook()
+  header = wb.add_style(bold=True, color="FFFFFF", fill="1F4E79", horizontal="center")
+  ws     = wb.create_sheet("סיכום", widths=[20, 14], freeze_header=True)
+  ws.append(["פורמט", "כמות"], header)
+  ws.append(["מעסיק", 12])
+  ws.merge(1, 1, 2)          # A1:B1
+  xlsx_bytes = wb.save()
+"""
+
+import io
+import re
+import math
+import zipfile
+from numbers import Real
+
+# שורות שנצברות לפני כתיבה ל-zip (פחות קריאות קטנות ל-deflate)
+FLUSH_ROWS = 500
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL  = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_NS_PKG  = "http://schemas.openxmlformats.org/package/2006/relationships"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# תווי בקרה שאסורים ב-XML 1.0 (openpyxl זורק עליהם IllegalCharacterError — כאן הם מוסרים)
+_ILLEGAL_XML = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# תווים שאסורים בשם גיליון ב-Excel
+_ILLEGAL_TITLE = re.compile(r"[\\/*?:\[\]]")
+
+
+def _xml_escape(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _attr_escape(text):
+    return _xml_escape(text).replace('"', "&quot;")
+
+
+def column_letter(n):
+    """1 → A, 27 → AA."""
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def column_widths(columns, rows, pad=4, max_width=50):
+    """רוחב לכל עמודה = הערך הארוך ביותר ב-header וב-rows (+pad, עד max_width). ריק / NaN לא נספר."""
+    widths = [len(str(c)) for c in columns]
+    for row in rows:
+        for i, v in enumerate(row):
+            if v is None or v == "" or (isinstance(v, float) and math.isnan(v)):
+                continue
+            n = len(str(v))
+            if n > widths[i]:
+                widths[i] = n
+    return [min(w + pad, max_width) for w in widths]
+
+
+class _TextCells(dict):
+    """מחרוזת → סוף תא inlineStr מוכן (escape + xml:space). מחושב פעם אחת לכל מחרוזת."""
+
+    def __missing__(self, text):
+        esc = _xml_escape(text)
+        if _ILLEGAL_XML.search(esc):
+            esc = _ILLEGAL_XML.sub("", esc)
+        space = ' xml:space="preserve"' if text[0].isspace() or text[-1].isspace() else ""
+        frag = self[text] = f' t="inlineStr"><is><t{space}>{esc}</t></is></c>'
+        return frag
+
+
+class StreamingSheet:
+    """גיליון פתוח לכתיבה — נוצר ע"י StreamingWorkbook.create_sheet."""
+
+    def __init__(self, stream, widths, rtl, freeze_header):
+        self._stream  = stream
+        self._buf     = []
+        self._row     = 0
+        self._merges  = []
+        self._text    = _TextCells()
+        self._letters = []
+
+        head = [_XML_DECL, f'<worksheet xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheetViews><sheetView']
+        if rtl:
+            head.append(' rightToLeft="1"')
+        head.append(' workbookViewId="0">')
+        if freeze_header:
+            head.append('<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                        '<selection pane="bottomLeft" activeCell="A2" sqref="A2"/>')
+        head.append('</sheetView></sheetViews><sheetFormatPr defaultRowHeight="15"/>')
+        if widths:
+            head.append("<cols>")
+            head.extend(f'<col min="{i}" max="{i}" width="{w}" customWidth="1"/>'
+                        for i, w in enumerate(widths, 1) if w)
+            head.append("</cols>")
+        head.append("<sheetData>")
+        self._stream.write("".join(head).encode("utf-8"))
+
+    @property
+    def max_row(self):
+        return self._row
+
+    def append(self, values, style=0):
+        """
+        שורה חדשה. style: אינדקס מ-add_style לכל התאים, או רשימה — סגנון לכל תא.
+        str / int / float / bool נכתבים לפי הטיפוס; None, "" ו-NaN → תא לא נכתב; כל השאר → str.
+        """
+        self._row += 1
+        r = self._row
+        letters = self._letters
+        if len(values) > len(letters):
+            letters.extend(column_letter(i) for i in range(len(letters) + 1, len(values) + 1))
+        styles = style if isinstance(style, (list, tuple)) else None
+        s_attr = f' s="{style}"' if style and styles is None else ""
+        text   = self._text
+
+        parts = [f'<row r="{r}">']
+        add   = parts.append
+        for i, v in enumerate(values):
+            if v is None:
+                continue
+            if styles is not None:
+                s_attr = f' s="{styles[i]}"' if styles[i] else ""
+            t = type(v)
+            if t is not str:
+                if t is bool:
+                    add(f'<c r="{letters[i]}{r}"{s_attr} t="b"><v>{int(v)}</v></c>')
+                    continue
+                if t is int or (isinstance(v, Real) and math.isfinite(v)):
+                    add(f'<c r="{letters[i]}{r}"{s_attr}><v>{v!r}</v></c>' if t is float
+                        else f'<c r="{letters[i]}{r}"{s_attr}><v>{v}</v></c>')
+                    continue
+                if isinstance(v, Real):
+                    continue   # NaN / inf
+                v = str(v)
+            if v:
+                add(f'<c r="{letters[i]}{r}"{s_attr}{text[v]}')
+        add("</row>")
+        self._buf.append("".join(parts))
+        if len(self._buf) >= FLUSH_ROWS:
+            self._flush()
+
+    def merge(self, row, first_col, last_col):
+        """מיזוג תאים בשורה row מעמודה first_col עד last_col (1-based)."""
+        self._merges.append(f"{column_letter(first_col)}{row}:{column_letter(last_col)}{row}")
+
+    def _flush(self):
+        if self._buf:
+            self._stream.write("".join(self._buf).encode("utf-8"))
+            self._buf = []
+
+    def close(self):
+        self._flush()
+        tail = ["</sheetData>"]
+        if self._merges:
+            tail.append(f'<mergeCells count="{len(self._merges)}">')
+            tail.extend(f'<mergeCell ref="{ref}"/>' for ref in self._merges)
+            tail.append("</mergeCells>")
+        tail.append("</worksheet>")
+        self._stream.write("".join(tail).encode("utf-8"))
+        self._stream.close()
+
+
+class StreamingWorkbook:
+    """workbook שנכתב ישירות ל-zip בזיכרון; save() מחזיר את ה-bytes של הקובץ."""
+
+    def __init__(self, font="Arial", size=10):
+        self._out    = io.BytesIO()
+        self._zip    = zipfile.ZipFile(self._out, "w", zipfile.ZIP_DEFLATED)
+        self._sheets = []     # שמות הגיליונות לפי סדר
+        self._open   = None
+        self._fonts  = [(False, None, size, font)]
+        self._fills  = [None, None]            # none + gray125 — שני ה-fills ש-Excel מצפה להם
+        self._xfs    = [(0, 0, None, None, False)]
+        self._font, self._size = font, size
+
+    def add_style(self, bold=False, color=None, fill=None, size=None, horizontal=None, vertical="center",
+                  wrap_text=False):
+        """מוסיף סגנון תא ומחזיר את האינדקס שלו (ל-append). צבעים כ-hex RGB, למשל "1F4E79"."""
+        font = (bold, color, size or self._size, self._font)
+        if font not in self._fonts:
+            self._fonts.append(font)
+        if fill is not None and fill not in self._fills:
+            self._fills.append(fill)
+        xf = (self._fonts.index(font), self._fills.index(fill) if fill is not None else 0,
+              horizontal, vertical, wrap_text)
+        if xf not in self._xfs:
+            self._xfs.append(xf)
+        return self._xfs.index(xf)
+
+    def create_sheet(self, name, widths=None, rtl=True, freeze_header=False):
+        """פותח גיליון חדש (וסוגר את הקודם). widths — רוחב לכל עמודה לפי הסדר."""
+        self._close_sheet()
+        self._sheets.append(name)
+        stream = self._zip.open(f"xl/worksheets/sheet{len(self._sheets)}.xml", "w")
+        self._open = StreamingSheet(stream, widths, rtl, freeze_header)
+        return self._open
+
+    def save(self):
+        """סוגר את הגיליון הפתוח, כותב את חלקי ה-workbook ומחזיר bytes."""
+        self._close_sheet()
+        if not self._sheets:
+            self.create_sheet("Sheet")
+            self._close_sheet()
+        z, n = self._zip, len(self._sheets)
+        z.writestr("[Content_Types].xml", _content_types(n))
+        z.writestr("_rels/.rels", _ROOT_RELS)
+        z.writestr("xl/workbook.xml", _workbook_xml(self._sheets))
+        z.writestr("xl/_rels/workbook.xml.rels", _workbook_rels(n))
+        z.writestr("xl/styles.xml", self._styles_xml())
+        z.close()
+        return self._out.getvalue()
+
+    def _close_sheet(self):
+        if self._open is not None:
+            self._open.close()
+            self._open = None
+
+    def _styles_xml(self):
+        fonts = []
+        for bold, color, size, name in self._fonts:
+            fonts.append("<font>" + ("<b/>" if bold else "") + f'<sz val="{size}"/>'
+                         + (f'<color rgb="FF{color}"/>' if color else "") + f'<name val="{name}"/></font>')
+        fills = ['<fill><patternFill patternType="none"/></fill>',
+                 '<fill><patternFill patternType="gray125"/></fill>']
+        fills.extend(f'<fill><patternFill patternType="solid"><fgColor rgb="FF{c}"/><bgColor rgb="FF{c}"/>'
+                     f'</patternFill></fill>' for c in self._fills[2:])
+        xfs = []
+        for font_id, fill_id, horizontal, vertical, wrap in self._xfs:
+            align = "".join((f' horizontal="{horizontal}"' if horizontal else "",
+                             f' vertical="{vertical}"' if vertical else "",
+                             ' wrapText="1"' if wrap else ""))
+            xfs.append(f'<xf numFmtId="0" fontId="{font_id}" fillId="{fill_id}" borderId="0" xfId="0"'
+                       + (' applyFont="1"' if font_id else "") + (' applyFill="1"' if fill_id else "")
+                       + (f' applyAlignment="1"><alignment{align}/></xf>' if align else "/>"))
+        return (
+            f'{_XML_DECL}<styleSheet xmlns="{_NS_MAIN}">'
+            f'<fonts count="{len(fonts)}">{"".join(fonts)}</fonts>'
+            f'<fills count="{len(fills)}">{"".join(fills)}</fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>'
+        )
+
+
+def table_xlsx(columns, rows, sheet_name="Sheet1", max_width=50):
+    """
+    קובץ XLSX של גיליון טבלה אחד: header מודגש + rows (tuples), RTL, שורת header קפואה,
+    רוחב עמודות לפי התוכן. מחזיר bytes.
+    """
+    rows = list(rows)
+    wb = StreamingWorkbook()
+    header = wb.add_style(bold=True, horizontal="center")
+    ws = wb.create_sheet(sheet_name, widths=column_widths(columns, rows, max_width=max_width),
+                         freeze_header=True)
+    ws.append(columns, header)
+    for row in rows:
+        ws.append(row)
+    return wb.save()
+
+
+_ROOT_RELS = (
+    f'{_XML_DECL}<Relationships xmlns="{_NS_PKG}">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+
+def _content_types(n_sheets):
+    sheets = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, n_sheets + 1)
+    )
+    return (
+        f'{_XML_DECL}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{sheets}</Types>'
+    )
+
+
+def _workbook_xml(names):
+    sheets = "".join(
+        f'<sheet name="{_attr_escape(_ILLEGAL_TITLE.sub("", name)[:31])}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(names, 1)
+    )
+    return (
+        f'{_XML_DECL}<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}">'
+        f'<bookViews><workbookView activeTab="0"/></bookViews><sheets>{sheets}</sheets></workbook>'
+    )
+
+
+def _workbook_rels(n_sheets):
+    rels = "".join(
+        f'<Relationship Id="rId{i}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, n_sheets + 1)
+    )
+    return (
+        f'{_XML_DECL}<Relationships xmlns="{_NS_PKG}">{rels}'
+        f'<Relationship Id="rId{n_sheets + 1}" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    )